@@ -1,38 +1,298 @@
 """AI Handler for OpenRouter and Ollama integration"""
 
 import asyncio
+import hashlib
 import json
 import time
-from typing import Optional, Dict, Any, List, Tuple
-from datetime import datetime, timedelta
+from collections import deque
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Callable, Deque, Sequence, Set
+from datetime import datetime, timezone
 import aiohttp
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from .config import AIConfig, AIProvider, load_config, get_phase_prompt
+from .answer_analyzer import AnswerAssessment, analyze_answer, find_question
+from .cache import SemanticCache, create_cache
+from .config import (
+    AIConfig, AIProvider, DEFAULT_MAX_OUTPUT_TOKENS, MODEL_MAX_OUTPUT_TOKENS, PHASE_SYSTEM_PROMPTS, PROMPT_TEMPLATES,
+    load_config, get_phase_prompt, get_prompt_template
+)
+from .connection_pool import get_shared_session
+from .discovery import ProviderDiscovery
+from .model_catalog import CANDIDATE_MODELS, ModelCatalog, ModelInfo, default_calibration_path
 from .models import AIConversation, AIMessage
+from .resilience import CircuitBreaker, CircuitState
+from .scheduler import AdaptiveLimit, RequestPriority, RequestScheduler
 
 
 @dataclass
 class RateLimiter:
-    """Simple rate limiter for API calls"""
+    """Sliding-window rate limiter for API calls
+    
+    Timestamps live in a deque ordered by time, so expiring old requests
+    only pops from the left and every check is amortized O(1). Callers
+    waiting for a slot are served by priority class, FIFO within a class,
+    so an interactive request never queues behind a batch once the budget
+    runs out.
+    """
     max_requests: int
-    window_seconds: int = 60
-    requests: List[float] = None
+    window_seconds: float = 60
+    requests: Deque[float] = field(default_factory=deque)
+    # Waiting callers as [priority, arrival, owner, wake-up event], best first
+    waiters: List[List[Any]] = field(default_factory=list)
+    _arrivals: int = 0
     
-    def __post_init__(self):
-        if self.requests is None:
-            self.requests = []
+    def _prune(self, now: float):
+        """Drop requests that have left the window"""
+        while self.requests and now - self.requests[0] >= self.window_seconds:
+            self.requests.popleft()
     
     def can_make_request(self) -> bool:
         """Check if we can make a request within rate limits"""
-        now = time.time()
-        # Remove requests older than window
-        self.requests = [req_time for req_time in self.requests if now - req_time < self.window_seconds]
+        self._prune(time.monotonic())
         return len(self.requests) < self.max_requests
     
-    def record_request(self):
-        """Record a new request"""
-        self.requests.append(time.time())
+    def record_request(self) -> float:
+        """Record a new request and return its timestamp"""
+        now = time.monotonic()
+        self.requests.append(now)
+        return now
+    
+    def remaining(self) -> int:
+        """Number of requests still available in the current window"""
+        self._prune(time.monotonic())
+        return max(self.max_requests - len(self.requests), 0)
+    
+    def next_slot_eta(self) -> float:
+        """Seconds until a request slot is available"""
+        now = time.monotonic()
+        self._prune(now)
+        if len(self.requests) < self.max_requests:
+            return 0.0
+        if not self.requests:
+            return float("inf")  # max_requests of zero never frees up
+        return max(self.requests[0] + self.window_seconds - now, 0.0)
+    
+    async def acquire(
+        self,
+        timeout: Optional[float] = None,
+        priority: RequestPriority = RequestPriority.INTERACTIVE,
+        owner: Any = None
+    ) -> Optional[float]:
+        """
+        Wait for a request slot and reserve it
+        
+        Only the best waiter (lowest priority value, then earliest) may take
+        a freed slot. Returns None straight away if the next slot cannot
+        free up before ``timeout`` expires, rather than sleeping for nothing.
+        ``owner`` lets :meth:`reprioritize` find this caller later.
+        
+        Returns:
+            The reservation's timestamp, to hand to :meth:`release`, or None
+        """
+        if not self.waiters and self.can_make_request():
+            return self.record_request()
+        
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._arrivals += 1
+        entry = [priority, self._arrivals, owner, asyncio.Event()]
+        self.waiters.append(entry)
+        self.waiters.sort(key=lambda waiter: (waiter[0], waiter[1]))
+        try:
+            while True:
+                is_head = self.waiters[0] is entry
+                if is_head and self.can_make_request():
+                    return self.record_request()
+                
+                # The next slot is a lower bound on the wait even behind other callers
+                wait = self.next_slot_eta()
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    return None
+                if not is_head:
+                    # Sleep until a better waiter is served or gives up
+                    wait = None if deadline is None else deadline - time.monotonic()
+                
+                entry[3].clear()
+                try:
+                    await asyncio.wait_for(entry[3].wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiters.remove(entry)
+            self._wake_head()
+    
+    def _wake_head(self):
+        """Let the best waiter re-check for a slot"""
+        if self.waiters:
+            self.waiters[0][3].set()
+    
+    def reprioritize(self, owner: Any, priority: RequestPriority):
+        """Move a waiting caller to a higher class, e.g. when a user joins it"""
+        moved = False
+        for waiter in self.waiters:
+            if waiter[2] is owner and priority < waiter[0]:
+                waiter[0] = priority
+                moved = True
+        if moved:
+            self.waiters.sort(key=lambda waiter: (waiter[0], waiter[1]))
+            self._wake_head()
+    
+    def release(self, reserved_at: float):
+        """Give back a reservation from :meth:`acquire` whose request never went out"""
+        try:
+            self.requests.remove(reserved_at)
+        except ValueError:
+            return  # already left the window
+        self._wake_head()
+
+
+@dataclass
+class ProviderStats:
+    """Per-provider request accounting"""
+    attempts: int = 0
+    successes: int = 0
+    failures: int = 0
+    last_error: Optional[str] = None
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    usage: Deque[Dict[str, int]] = field(default_factory=lambda: deque(maxlen=200))  # per request
+    
+    def record_usage(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        """Record token usage reported for one request"""
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += completion_tokens
+        self.usage.append({
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+        })
+    
+    def record(self, success: bool, error: Optional[str] = None, latency: Optional[float] = None):
+        """Record the outcome of one attempt"""
+        if success:
+            self.successes += 1
+            if latency is not None:
+                self.latencies.append(latency)
+        else:
+            self.failures += 1
+            self.last_error = error
+    
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Latency of successful attempts at the given percentile (0-1)"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(int(percentile * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+    
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        p50 = self.latency_percentile(0.5)
+        p95 = self.latency_percentile(0.95)
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_token_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+        }
+
+
+@dataclass
+class RequestContext:
+    """Per-request state passed down through provider calls"""
+    priority: RequestPriority = RequestPriority.INTERACTIVE
+    waiters: int = 0  # callers currently awaiting the shared request
+    dispatched: Set[AIProvider] = field(default_factory=set)  # providers an HTTP call was sent to
+    deadline: Optional[float] = None  # time.monotonic() by which the request must finish
+    
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None if unbounded"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+    
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+
+class AIStreamError(Exception):
+    """Raised when a streamed AI response cannot be produced"""
+
+
+# Statuses worth retrying: timeouts, throttling and transient server faults.
+# Anything else (bad key, unknown model, invalid payload) fails the same way again.
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class ProviderError(Exception):
+    """Raised by provider calls for a transient failure worth retrying"""
+    
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for prompt budgeting"""
+    return len(text) // 4 + 1
+
+
+def _parse_packed_answers(text: str, count: int) -> Optional[List[str]]:
+    """Split a packed JSON response into one answer per question, or None if malformed"""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    
+    answers = []
+    for number in range(1, count + 1):
+        answer = data.get(str(number))
+        if not isinstance(answer, str) or not answer.strip():
+            return None
+        answers.append(answer.strip())
+    return answers
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _capped(limit: int, cap: Optional[int]) -> int:
+    """A limit no higher than the cap, if there is one (0 means unlimited in aiohttp)"""
+    return min(limit, cap) if cap else limit
+
+
+NOT_CONFIGURED_MESSAGE = "AI assistance is not configured. Set OPENROUTER_API_KEY or ensure Ollama is running."
 
 
 class AIHandler:
@@ -40,230 +300,1575 @@ class AIHandler:
     
     def __init__(self, config: Optional[AIConfig] = None):
         self.config = config or load_config()
-        self.rate_limiter = RateLimiter(self.config.max_requests_per_minute)
+        # Separate budgets so the local model is not throttled by the remote quota
+        self.rate_limiters: Dict[AIProvider, RateLimiter] = {
+            AIProvider.OPENROUTER: RateLimiter(self.config.max_requests_per_minute),
+            AIProvider.OLLAMA: RateLimiter(self.config.ollama_max_requests_per_minute),
+        }
+        self.provider_stats: Dict[AIProvider, ProviderStats] = {
+            AIProvider.OPENROUTER: ProviderStats(),
+            AIProvider.OLLAMA: ProviderStats(),
+        }
+        self.circuit_breakers: Dict[AIProvider, CircuitBreaker] = {
+            provider: CircuitBreaker(
+                failure_rate_threshold=self.config.circuit_failure_rate,
+                slow_call_seconds=self.config.circuit_slow_call_seconds,
+                minimum_calls=self.config.circuit_min_calls,
+                window_size=self.config.circuit_window,
+                open_seconds=self.config.circuit_open_seconds
+            )
+            for provider in (AIProvider.OPENROUTER, AIProvider.OLLAMA)
+        }
+        self._probe_tasks: Dict[AIProvider, "asyncio.Task[None]"] = {}
+        self.discovery = ProviderDiscovery(self.config)
+        self.model_catalog = ModelCatalog(self.config)
+        if self.config.auto_select_model:
+            self.model_catalog.load(self._calibration_path())
+        self._warmup_task: Optional["asyncio.Task[bool]"] = None
+        self.hedge_stats = {"launched": 0, "won": 0}
         self.session: Optional[aiohttp.ClientSession] = None
-        self.cache: Dict[str, Tuple[str, datetime]] = {}
+        self._owns_session = False
+        self.cache = create_cache(self.config)
+        self.semantic_cache: Optional[SemanticCache] = None
+        if self.config.enable_cache and self.config.enable_semantic_cache:
+            self.semantic_cache = SemanticCache(self.config.semantic_cache_threshold, self.config.cache_ttl)
+        self.conversations: Dict[str, AIConversation] = {}
+        self.prescreen_stats = {"answered": 0, "escalated": 0}
+        self._inflight: Dict[str, Tuple["asyncio.Future[Tuple[bool, str, AIProvider]]", RequestContext]] = {}
+        self.schedulers: Dict[AIProvider, RequestScheduler] = {
+            AIProvider.OPENROUTER: RequestScheduler(self.config.max_concurrent_requests, self.config.interactive_reserve),
+            AIProvider.OLLAMA: RequestScheduler(self.config.ollama_max_concurrent_requests, self.config.interactive_reserve),
+        }
+        # Learned per provider: a local Ollama's capacity depends on the host hardware
+        self.adaptive_limits: Dict[AIProvider, AdaptiveLimit] = {}
+        if self.config.adaptive_concurrency:
+            # Calls beyond the pool's per-host connections would queue inside aiohttp,
+            # where the wait looks like provider latency and shrinks the limit
+            host_cap = self.config.pool_limit_per_host if self.config.use_shared_pool else None
+            self.adaptive_limits = {
+                AIProvider.OPENROUTER: AdaptiveLimit(
+                    float(self.config.max_concurrent_requests),
+                    max_limit=_capped(self.config.adaptive_max_concurrency, host_cap)
+                ),
+                AIProvider.OLLAMA: AdaptiveLimit(
+                    float(self.config.ollama_max_concurrent_requests),
+                    max_limit=_capped(self.config.ollama_adaptive_max_concurrency, host_cap)
+                ),
+            }
+    
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """Rate limiter for the primary provider"""
+        return self.rate_limiters.get(self.config.provider, self.rate_limiters[AIProvider.OPENROUTER])
+    
+    async def _acquire_rate_limit(
+        self, provider: AIProvider, context: Optional[RequestContext] = None
+    ) -> Tuple[bool, Optional[float]]:
+        """Wait for a request slot with the given provider, within the request deadline
+        
+        Returns:
+            (acquired, reservation) where the reservation is passed to
+            :meth:`_release_rate_limit` if the request never goes out
+        """
+        limiter = self.rate_limiters.get(provider)
+        if limiter is None:
+            return True, None
+        timeout = self.config.rate_limit_timeout
+        remaining = context.remaining() if context else None
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        if context is None:
+            reservation = await limiter.acquire(timeout=timeout)
+        else:
+            reservation = await limiter.acquire(timeout=timeout, priority=context.priority, owner=context)
+        return reservation is not None, reservation
+    
+    def _release_rate_limit(self, provider: AIProvider, reservation: Optional[float]):
+        """Return a reserved slot that was never used, e.g. after cancellation"""
+        limiter = self.rate_limiters.get(provider)
+        if limiter is not None and reservation is not None:
+            limiter.release(reservation)
     
     async def __aenter__(self):
         """Async context manager entry"""
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=self.config.timeout)
-        )
+        if self.config.use_shared_pool:
+            # Borrow the process-wide pool so connections outlive this handler
+            self.session = get_shared_session(self.config)
+        else:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.config.timeout)
+            )
+            self._owns_session = True
+        
+        if self.config.discover_providers:
+            self.discovery.refresh_in_background(self.session)
+        if self.config.ollama_warmup and AIProvider.OLLAMA in self._route():
+            # Load the model in the background so the first question does not pay for it
+            self._warmup_task = asyncio.ensure_future(self.warm_up())
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit"""
-        if self.session:
+        await self.close()
+    
+    async def close(self):
+        """Stop background work and release the session and the response cache"""
+        for task in self._probe_tasks.values():
+            task.cancel()
+        self._probe_tasks.clear()
+        self.discovery.close()
+        self.model_catalog.close()
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            self._warmup_task = None
+        if self.session and self._owns_session:
             await self.session.close()
+            self._owns_session = False
+        self.session = None
+        # Waits for queued disk cache writes, so keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.cache.close)
+    
+    async def warm_up(self) -> bool:
+        """Load the Ollama model into memory and pin it for ``ollama_keep_alive``
+        
+        Sends a chat request with no messages, which Ollama treats as a
+        load-only call. Failures are ignored; the first real request simply
+        pays the load time instead.
+        
+        Returns:
+            True if the model is loaded, False if it failed or Ollama is not in use
+        """
+        if AIProvider.OLLAMA not in self._route():
+            return False
+        
+        url = f"{self.config.ollama_base_url}/api/chat"
+        payload = {"model": self.config.ollama_model.value, "messages": [], "keep_alive": self.config.ollama_keep_alive}
+        try:
+            async with self._http().post(url, json=payload, timeout=self._request_timeout()) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+    
+    def _http(self) -> aiohttp.ClientSession:
+        """Session for provider calls, borrowing the shared pool if needed"""
+        if self.session is None and self.config.use_shared_pool:
+            self.session = get_shared_session(self.config)
+        return self.session
+    
+    def _request_timeout(self, context: Optional[RequestContext] = None) -> aiohttp.ClientTimeout:
+        """Timeout applied to each provider call
+        
+        Connect, first-byte and total limits are each capped by whatever is
+        left of the request's deadline.
+        """
+        total = self.config.timeout
+        remaining = context.remaining() if context else None
+        if remaining is not None:
+            total = min(total, remaining)
+        return aiohttp.ClientTimeout(
+            total=total,
+            sock_connect=min(self.config.connect_timeout, total),
+            sock_read=min(self.config.first_byte_timeout, total)
+        )
+    
+    def _stream_timeout(self) -> aiohttp.ClientTimeout:
+        """Timeout applied to a streaming call
+        
+        A long answer may stream for minutes on a slow host, so there is no
+        total limit. ``first_byte_timeout`` bounds the wait for the first
+        chunk and the gap between chunks instead.
+        """
+        return aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.config.connect_timeout,
+            sock_read=self.config.first_byte_timeout
+        )
+    
+    def _deadline_for(self, deadline: Optional[float]) -> Optional[float]:
+        """Absolute deadline for a request given its budget in seconds"""
+        budget = deadline if deadline is not None else self.config.request_deadline
+        return None if budget is None else time.monotonic() + budget
+    
+    def _model_for(self, provider: AIProvider, prompt_data: Optional[Dict[str, Any]] = None) -> str:
+        """Concrete model name used for a provider, honoring a per-request choice"""
+        if prompt_data and provider.value in prompt_data.get("models", {}):
+            return prompt_data["models"][provider.value]
+        if provider == AIProvider.OPENROUTER:
+            return self.config.openrouter_model.value
+        elif provider == AIProvider.OLLAMA:
+            return self.config.ollama_model.value
+        return provider.value
+    
+    def _phase_prompt(self, phase: str, question_text: str, current_answer: str = "") -> Dict[str, Any]:
+        """Prompt for a question, with the models chosen for its phase"""
+        return self._select_models(phase, get_phase_prompt(phase, question_text, current_answer))
+    
+    def _select_models(self, phase: str, prompt_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Pick the fastest model meeting the phase's quality tier, if enabled
+        
+        The choice goes in ``prompt_data["models"]`` so it is part of the
+        cache key and every attempt of the request uses the same model.
+        Providers without measured candidates keep their configured model.
+        """
+        if not self.config.auto_select_model:
+            return prompt_data
+        
+        tier = self.config.phase_quality_tiers.get(phase, self.config.model_quality_tier)
+        models = {}
+        for provider in CANDIDATE_MODELS:
+            name = self.model_catalog.select_model(provider, tier, self.config.model_max_error_rate)
+            if name is not None:
+                models[provider.value] = name
+        if models:
+            prompt_data["models"] = models
+        return prompt_data
     
-    def _get_cache_key(self, prompt: str, model: str) -> str:
-        """Generate cache key for prompt and model"""
-        return f"{model}:{hash(prompt)}"
+    def _calibration_path(self) -> Path:
+        """Where measured model latency is persisted"""
+        if self.config.model_calibration_path:
+            return Path(self.config.model_calibration_path)
+        return default_calibration_path()
+    
+    def _get_cache_key(self, prompt_data: Dict[str, Any], provider: AIProvider) -> str:
+        """Generate cache key for a prompt sent to a provider
+        
+        Covers everything that changes the response: provider, concrete model,
+        system and user prompts and sampling parameters. Uses a content hash
+        rather than ``hash()`` so keys stay stable across processes.
+        """
+        material = json.dumps([
+            provider.value,
+            self._model_for(provider, prompt_data),
+            prompt_data["system"],
+            prompt_data.get("history", []),
+            prompt_data["user"],
+            self.config.temperature,
+            prompt_data.get("max_tokens", self.config.max_tokens),
+        ])
+        digest = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        return f"{provider.value}:{digest}"
     
     def _get_cached_response(self, cache_key: str) -> Optional[str]:
         """Get cached response if still valid"""
         if not self.config.enable_cache:
             return None
         
-        if cache_key in self.cache:
-            response, timestamp = self.cache[cache_key]
-            if datetime.now() - timestamp < timedelta(seconds=self.config.cache_ttl):
-                return response
-            else:
-                del self.cache[cache_key]
-        
-        return None
+        return self.cache.get(cache_key)
     
     def _cache_response(self, cache_key: str, response: str):
         """Cache a response"""
         if self.config.enable_cache:
-            self.cache[cache_key] = (response, datetime.now())
+            self.cache.set(cache_key, response)
     
     async def get_ai_guidance(
         self, 
         phase: str, 
         question_text: str, 
         current_answer: str = "",
-        conversation_id: Optional[str] = None
+        conversation_id: Optional[str] = None,
+        priority: RequestPriority = RequestPriority.INTERACTIVE,
+        deadline: Optional[float] = None
     ) -> Tuple[bool, str, Optional[AIConversation]]:
         """
         Get AI guidance for a specific question
         
+        ``priority`` orders the call against other queued work for the same
+        provider; bulk and speculative callers pass BATCH or BACKGROUND.
+        ``deadline`` bounds the whole call in seconds, retries and fallback
+        included; it defaults to ``config.request_deadline``.
+        
+        Passing the ``conversation_id`` of an earlier exchange continues that
+        conversation: its previous turns are sent along with the new prompt.
+        
         Returns:
             (success, response_text, conversation)
         """
         
-        if self.config.provider == AIProvider.DISABLED:
-            return False, "AI assistance is not configured. Set OPENROUTER_API_KEY or ensure Ollama is running.", None
-        
-        # Check rate limits
-        if not self.rate_limiter.can_make_request():
-            return False, "Rate limit exceeded. Please wait before making another request.", None
+        if not await self._available():
+            return False, NOT_CONFIGURED_MESSAGE, None
         
         # Generate prompt
-        prompt_data = get_phase_prompt(phase, question_text, current_answer)
+        prompt_data = self._phase_prompt(phase, question_text, current_answer)
+        
+        # Answer common cases locally; asking again in a conversation always reaches the AI
+        if conversation_id not in self.conversations:
+            local = self._local_guidance(phase, question_text, current_answer, prompt_data, conversation_id)
+            if local is not None:
+                return local
+        
+        return await self._guidance_turn(
+            phase, prompt_data, conversation_id, priority, deadline, (question_text, current_answer.strip())
+        )
+    
+    def _prescreen(self, phase: str, question_text: str, current_answer: str) -> Optional[AnswerAssessment]:
+        """Local assessment of an answer, or None if the pre-screen is off or the question unknown"""
+        if not self.config.enable_answer_prescreen:
+            return None
+        question = find_question(phase, question_text)
+        if question is None:
+            return None
+        return analyze_answer(question, current_answer)
+    
+    def _local_guidance(
+        self,
+        phase: str,
+        question_text: str,
+        current_answer: str,
+        prompt_data: Dict[str, Any],
+        conversation_id: Optional[str] = None
+    ) -> Optional[Tuple[bool, str, Optional[AIConversation]]]:
+        """Canned guidance if the pre-screen can answer without the AI, else None"""
+        assessment = self._prescreen(phase, question_text, current_answer)
+        if assessment is None:
+            return None
+        if assessment.needs_ai:
+            self.prescreen_stats["escalated"] += 1
+            return None
+        self.prescreen_stats["answered"] += 1
+        return True, assessment.guidance, self._build_conversation(
+            conversation_id, phase, prompt_data, assessment.guidance, "local"
+        )
+    
+    async def ask_follow_up(
+        self,
+        conversation_id: str,
+        message: str,
+        deadline: Optional[float] = None
+    ) -> Tuple[bool, str, Optional[AIConversation]]:
+        """
+        Send a free-form follow-up message in an existing conversation
+        
+        Returns:
+            (success, response_text, conversation)
+        """
+        
+        if not await self._available():
+            return False, NOT_CONFIGURED_MESSAGE, None
+        
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            return False, f"Unknown conversation: {conversation_id}", None
+        
+        phase = conversation.phase.value
+        prompt_data = self._select_models(
+            phase, {"system": PHASE_SYSTEM_PROMPTS.get(phase, PHASE_SYSTEM_PROMPTS["clarify"]), "user": message}
+        )
+        return await self._guidance_turn(phase, prompt_data, conversation_id, RequestPriority.INTERACTIVE, deadline)
+    
+    def end_conversation(self, conversation_id: str) -> Optional[AIConversation]:
+        """Stop tracking a conversation and return its final record"""
+        return self.conversations.pop(conversation_id, None)
+    
+    async def _guidance_turn(
+        self,
+        phase: str,
+        prompt_data: Dict[str, Any],
+        conversation_id: Optional[str],
+        priority: RequestPriority,
+        deadline: Optional[float],
+        answer: Optional[Tuple[str, str]] = None
+    ) -> Tuple[bool, str, Optional[AIConversation]]:
+        """Run one exchange, continuing the stored conversation if there is one
+        
+        ``answer`` is ``(question_text, current_answer)`` for guidance on a
+        question, which lets the similarity tier match lightly edited answers.
+        """
+        
+        absolute_deadline = self._deadline_for(deadline)
+        await self._attach_history(conversation_id, prompt_data, absolute_deadline)
+        
+        providers = self._route()
+        if not providers:
+            return False, NOT_CONFIGURED_MESSAGE, None
+        
+        # Similar answers only stand in for each other outside a conversation
+        similarity_key = None
+        if self.semantic_cache is not None and answer is not None and not prompt_data.get("history"):
+            similarity_key = self._semantic_index_key(phase, answer[0], providers[0], prompt_data)
         
         # Check cache
-        cache_key = self._get_cache_key(prompt_data["user"], str(self.config.provider))
+        cache_key = self._get_cache_key(prompt_data, providers[0])
         cached_response = self._get_cached_response(cache_key)
+        if not cached_response and similarity_key:
+            cached_response = self.semantic_cache.get(similarity_key, answer[1])
         if cached_response:
-            return True, cached_response, None
-        
-        # Try primary provider
-        success, response = await self._make_ai_request(prompt_data)
+            if conversation_id is None:
+                return True, cached_response, None
+            return True, cached_response, self._build_conversation(
+                conversation_id, phase, prompt_data, cached_response, providers[0].value
+            )
         
-        # Try fallback provider if primary fails
-        if not success and self.config.fallback_provider != AIProvider.DISABLED:
-            original_provider = self.config.provider
-            self.config.provider = self.config.fallback_provider
-            success, response = await self._make_ai_request(prompt_data)
-            self.config.provider = original_provider
+        # Identical concurrent requests share a single provider call
+        success, response, provider = await self._coalesced_request(
+            cache_key, prompt_data, providers, priority, absolute_deadline
+        )
         
         if success:
-            self.rate_limiter.record_request()
-            self._cache_response(cache_key, response)
+            if similarity_key:
+                self.semantic_cache.set(similarity_key, answer[1], response)
             
-            # Create conversation record
-            conversation = AIConversation(
-                id=conversation_id or f"ai_{int(time.time())}",
-                phase=phase,
-                messages=[
-                    AIMessage(
-                        role="user",
-                        content=prompt_data["user"],
-                        timestamp=datetime.now()
-                    ),
-                    AIMessage(
-                        role="assistant", 
-                        content=response,
-                        timestamp=datetime.now(),
-                        model=str(self.config.provider)
-                    )
-                ],
-                created_at=datetime.now(),
-                updated_at=datetime.now()
+            # Create or extend the conversation record
+            conversation = self._build_conversation(
+                conversation_id, phase, prompt_data, response, provider.value
             )
             
             return True, response, conversation
         
         return False, response, None
     
-    async def _make_ai_request(self, prompt_data: Dict[str, str]) -> Tuple[bool, str]:
-        """Make AI request to configured provider"""
+    def _semantic_index_key(
+        self, phase: str, question_text: str, provider: AIProvider, prompt_data: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Similarity index for a question: its id when known, else phase and text"""
+        template_key = get_prompt_template(phase, question_text).key
+        question_key = template_key if template_key in PROMPT_TEMPLATES else f"{phase}:{question_text}"
+        return f"{provider.value}:{self._model_for(provider, prompt_data)}:{question_key}"
+    
+    async def _attach_history(
+        self, conversation_id: Optional[str], prompt_data: Dict[str, Any], deadline: Optional[float] = None
+    ):
+        """Add the earlier turns of a stored conversation to the prompt"""
+        conversation = self.conversations.get(conversation_id) if conversation_id else None
+        if conversation is None:
+            return
         
-        for attempt in range(self.config.max_retries):
+        await self._fold_conversation(conversation, prompt_data, deadline)
+        prompt_data["history"] = [
+            {"role": message.role, "content": message.content} for message in conversation.messages
+        ]
+    
+    async def _fold_conversation(
+        self, conversation: AIConversation, prompt_data: Dict[str, Any], deadline: Optional[float] = None
+    ):
+        """Fold older turns into a summary once the prompt nears the token budget
+        
+        The last ``conversation_keep_turns`` exchanges stay verbatim; anything
+        before them, including an earlier summary, is replaced by one system
+        message so the prompt size stops growing with the conversation.
+        """
+        prompt_tokens = _estimate_tokens(prompt_data["system"]) + _estimate_tokens(prompt_data["user"])
+        history_tokens = sum(_estimate_tokens(message.content) for message in conversation.messages)
+        if prompt_tokens + history_tokens <= self.config.conversation_token_budget:
+            return
+        
+        keep = self.config.conversation_keep_turns * 2
+        older = conversation.messages[:-keep] if keep else conversation.messages
+        if not older:
+            return
+        
+        summary = await self._summarize_turns(older, deadline)
+        conversation.messages = [
+            AIMessage(role="system", content=f"Summary of the earlier conversation: {summary}", timestamp=datetime.now())
+        ] + conversation.messages[len(older):]
+        conversation.updated_at = datetime.now()
+    
+    async def _summarize_turns(self, messages: List[AIMessage], deadline: Optional[float] = None) -> str:
+        """Summarize conversation turns, falling back to a truncated transcript"""
+        transcript = "\n\n".join(f"{message.role}: {message.content}" for message in messages)
+        # A quarter of the budget, leaving the rest for recent turns and the new prompt
+        summary_tokens = self.config.conversation_token_budget // 4
+        summary_chars = summary_tokens * 4
+        
+        prompt_data = {
+            "system": "You condense planning conversations. Keep decisions, open questions and facts the user stated; drop pleasantries.",
+            "user": f"Summarize this conversation in at most {summary_tokens * 3 // 4} words:\n\n{transcript}"
+        }
+        context = RequestContext(deadline=deadline)
+        success, summary, _ = await self._request_with_fallback(prompt_data, self._route(), context)
+        if success:
+            return summary[:summary_chars]
+        return transcript[-summary_chars:]
+    
+    async def prefetch_guidance(self, phase: str, question_text: str, current_answer: str = "") -> bool:
+        """
+        Warm the cache for a question the user is likely to open next
+        
+        Only runs while the primary provider has more than
+        ``prefetch_reserve`` requests left in its window, so speculative work
+        never takes budget an interactive request needs. An interactive call
+        for the same question joins the in-flight prefetch.
+        
+        Returns:
+            True if guidance for the question is now cached or available locally
+        """
+        if not self.config.enable_cache or not await self._available():
+            return False
+        
+        assessment = self._prescreen(phase, question_text, current_answer)
+        if assessment is not None and not assessment.needs_ai:
+            # Answered locally when asked; no provider call to warm up
+            return True
+        
+        prompt_data = self._phase_prompt(phase, question_text, current_answer)
+        providers = self._route()
+        if not providers:
+            return False
+        cache_key = self._get_cache_key(prompt_data, providers[0])
+        if cache_key in self._inflight or self._get_cached_response(cache_key):
+            return True
+        
+        limiter = self.rate_limiters.get(providers[0])
+        if limiter and limiter.remaining() <= self.config.prefetch_reserve:
+            return False
+        
+        success, _, _ = await self._coalesced_request(
+            cache_key, prompt_data, providers, RequestPriority.BACKGROUND, self._deadline_for(None)
+        )
+        return success
+    
+    async def get_ai_guidance_batch(
+        self,
+        items: Sequence[Tuple[str, str, str]],
+        max_concurrency: int = 4,
+        packed: bool = False
+    ) -> List[Tuple[bool, str, Optional[AIConversation]]]:
+        """
+        Get AI guidance for many questions concurrently
+        
+        Each item is ``(phase, question_text, current_answer)``. Requests run
+        through the cache and rate limiters like single calls, and one failing
+        item does not affect the others. With ``packed`` up to
+        ``batch_pack_size`` questions from the same phase share one provider
+        call.
+        
+        Returns:
+            A (success, response_text, conversation) tuple per item, in input order
+        """
+        results: List[Tuple[bool, str, Optional[AIConversation]]] = [
+            (False, "AI request did not run", None)
+        ] * len(items)
+        async for index, result in self.iter_ai_guidance_batch(items, max_concurrency, packed):
+            results[index] = result
+        return results
+    
+    async def iter_ai_guidance_batch(
+        self,
+        items: Sequence[Tuple[str, str, str]],
+        max_concurrency: int = 4,
+        packed: bool = False
+    ) -> AsyncIterator[Tuple[int, Tuple[bool, str, Optional[AIConversation]]]]:
+        """Yield ``(index, result)`` for each batch item as soon as it completes"""
+        
+        if packed and await self._available():
+            async for result in self._iter_packed_batch(items, max_concurrency):
+                yield result
+            return
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(index: int, item: Tuple[str, str, str]):
+            async with semaphore:
+                try:
+                    return index, await self.get_ai_guidance(*item, priority=RequestPriority.BATCH)
+                except Exception as e:
+                    return index, (False, f"AI request failed: {str(e)}", None)
+        
+        tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Stop outstanding work if the consumer stops iterating early
+            for task in tasks:
+                task.cancel()
+    
+    async def _iter_packed_batch(
+        self,
+        items: Sequence[Tuple[str, str, str]],
+        max_concurrency: int
+    ) -> AsyncIterator[Tuple[int, Tuple[bool, str, Optional[AIConversation]]]]:
+        """Answer batch items in packs of same-phase questions
+        
+        Items the pre-screen, the cache or the similarity tier can answer are
+        yielded straight away, as a single request would return them; only
+        the rest are packed.
+        """
+        
+        providers = self._route()
+        if not providers:
+            for index in range(len(items)):
+                yield index, (False, NOT_CONFIGURED_MESSAGE, None)
+            return
+        groups: Dict[str, List[Tuple[int, Tuple[str, str, str], Dict[str, Any]]]] = {}
+        for index, item in enumerate(items):
+            phase, question_text, current_answer = item
+            prompt_data = self._phase_prompt(*item)
+            local = self._local_guidance(phase, question_text, current_answer, prompt_data)
+            if local is not None:
+                yield index, local
+                continue
+            
+            cached_response = self._get_cached_response(self._get_cache_key(prompt_data, providers[0]))
+            if not cached_response and self.semantic_cache is not None:
+                cached_response = self.semantic_cache.get(
+                    self._semantic_index_key(phase, question_text, providers[0], prompt_data), current_answer.strip()
+                )
+            if cached_response:
+                yield index, (True, cached_response, None)
+            else:
+                groups.setdefault(phase, []).append((index, item, prompt_data))
+        
+        packs = []
+        for members in groups.values():
+            size = self._pack_size(providers[0], members[0][2])
+            packs.extend(members[i:i + size] for i in range(0, len(members), size))
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(pack):
+            async with semaphore:
+                try:
+                    return await self._run_pack(pack, providers)
+                except Exception as e:
+                    return [(index, (False, f"AI request failed: {str(e)}", None)) for index, _, _ in pack]
+        
+        tasks = [asyncio.ensure_future(run(pack)) for pack in packs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for result in await next_done:
+                    yield result
+        finally:
+            # Stop outstanding work if the consumer stops iterating early
+            for task in tasks:
+                task.cancel()
+    
+    async def _run_pack(
+        self,
+        pack: List[Tuple[int, Tuple[str, str, str], Dict[str, Any]]],
+        providers: List[AIProvider]
+    ) -> List[Tuple[int, Tuple[bool, str, Optional[AIConversation]]]]:
+        """Send one packed request and split the reply into per-question results
+        
+        Each answer is cached under the key a single request for that
+        question would use. If the packed request fails or its reply cannot
+        be split, every question is retried as its own request.
+        """
+        if len(pack) == 1:
+            index, item, prompt_data = pack[0]
+            return [(index, await self._single_guidance(item, prompt_data))]
+        
+        packed_prompt = self._packed_prompt([prompt_data for _, _, prompt_data in pack])
+        success, response, provider = await self._coalesced_request(
+            self._get_cache_key(packed_prompt, providers[0]),
+            packed_prompt,
+            providers,
+            RequestPriority.BATCH,
+            self._deadline_for(None)
+        )
+        
+        answers = _parse_packed_answers(response, len(pack)) if success else None
+        if answers is None:
+            results = await asyncio.gather(*[
+                self._single_guidance(item, prompt_data) for _, item, prompt_data in pack
+            ])
+            return [(index, result) for (index, _, _), result in zip(pack, results)]
+        
+        packed_results = []
+        for (index, item, prompt_data), answer in zip(pack, answers):
+            self._cache_response(self._get_cache_key(prompt_data, provider), answer)
+            if self.semantic_cache is not None:
+                self.semantic_cache.set(
+                    self._semantic_index_key(item[0], item[1], provider, prompt_data), item[2].strip(), answer
+                )
+            conversation = self._build_conversation(None, item[0], prompt_data, answer, provider.value)
+            packed_results.append((index, (True, answer, conversation)))
+        return packed_results
+    
+    async def _single_guidance(
+        self, item: Tuple[str, str, str], prompt_data: Dict[str, Any]
+    ) -> Tuple[bool, str, Optional[AIConversation]]:
+        """Answer one already pre-screened batch item with its own request"""
+        phase, question_text, current_answer = item
+        return await self._guidance_turn(
+            phase, prompt_data, None, RequestPriority.BATCH, None, (question_text, current_answer.strip())
+        )
+    
+    def _max_output_tokens(self, provider: AIProvider, prompt_data: Dict[str, Any]) -> Optional[int]:
+        """Output token limit of the model a prompt goes to, None if unbounded"""
+        if provider != AIProvider.OPENROUTER:
+            return None
+        return MODEL_MAX_OUTPUT_TOKENS.get(self._model_for(provider, prompt_data), DEFAULT_MAX_OUTPUT_TOKENS)
+    
+    def _pack_size(self, provider: AIProvider, prompt_data: Dict[str, Any]) -> int:
+        """Questions per pack, shrunk so the packed reply fits the model's output limit"""
+        size = max(self.config.batch_pack_size, 1)
+        limit = self._max_output_tokens(provider, prompt_data)
+        if limit is not None:
+            size = min(size, max(limit // max(self.config.max_tokens, 1), 1))
+        return size
+    
+    def _packed_prompt(self, prompts: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combine same-phase prompts into one request asking for JSON answers
+        
+        The shared phase system prompt is sent once instead of per question.
+        """
+        questions = "\n\n".join(
+            f"### Question {number}\n{prompt_data['user']}" for number, prompt_data in enumerate(prompts, 1)
+        )
+        packed = {
+            "system": prompts[0]["system"],
+            "user": (
+                f"Give separate guidance for each of the {len(prompts)} questions below. "
+                "Reply with only a JSON object whose keys are the question numbers and whose values "
+                'are your guidance for that question as a string, e.g. {"1": "...", "2": "..."}.'
+                f"\n\n{questions}"
+            ),
+            "max_tokens": self.config.max_tokens * len(prompts),
+        }
+        if "models" in prompts[0]:
+            packed["models"] = prompts[0]["models"]
+        return packed
+    
+    async def get_ai_guidance_stream(
+        self,
+        phase: str,
+        question_text: str,
+        current_answer: str = "",
+        conversation_id: Optional[str] = None,
+        on_complete: Optional[Callable[[AIConversation], None]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream AI guidance for a specific question as tokens arrive
+        
+        Yields response chunks as soon as the provider emits them. Once the
+        stream ends the full response is cached and ``on_complete`` (if given)
+        receives the conversation record. If the consumer stops early or is
+        cancelled the HTTP request is aborted; the partial text is cached
+        only when ``cache_partial_streams`` is enabled.
+        
+        Raises:
+            AIStreamError: if no provider could produce a response
+        """
+        
+        if not await self._available():
+            raise AIStreamError(NOT_CONFIGURED_MESSAGE)
+        
+        prompt_data = self._phase_prompt(phase, question_text, current_answer)
+        await self._attach_history(conversation_id, prompt_data, self._deadline_for(None))
+        
+        providers = self._route()
+        if not providers:
+            raise AIStreamError(NOT_CONFIGURED_MESSAGE)
+        
+        cached_response = self._get_cached_response(self._get_cache_key(prompt_data, providers[0]))
+        if cached_response:
+            yield cached_response
+            return
+        
+        error = "No AI provider configured"
+        for provider in providers:
+            breaker = self.circuit_breakers[provider]
+            if breaker.is_open():
+                error = self._circuit_open_message(provider)
+                continue
+            
+            acquired, reservation = await self._acquire_rate_limit(provider)
+            if not acquired:
+                error = "Rate limit exceeded. Please wait before making another request."
+                continue
+            
+            # Interactive: a user is reading the stream as it arrives
+            dispatched = False
             try:
-                if self.config.provider == AIProvider.OPENROUTER:
-                    return await self._call_openrouter(prompt_data)
-                elif self.config.provider == AIProvider.OLLAMA:
-                    return await self._call_ollama(prompt_data)
-                else:
-                    return False, "No AI provider configured"
+                async with self.schedulers[provider].slot(RequestPriority.INTERACTIVE):
+                    if not breaker.allow_request():
+                        self._release_rate_limit(provider, reservation)
+                        error = self._circuit_open_message(provider)
+                        continue
+                    
+                    dispatched = True
+                    stats = self.provider_stats[provider]
+                    stats.attempts += 1
+                    started = time.monotonic()
+                    chunks: List[str] = []
+                    try:
+                        async for chunk in self._stream_provider(provider, prompt_data):
+                            chunks.append(chunk)
+                            yield chunk
+                    except Exception as e:
+                        stats.record(False, str(e))
+                        self._record_circuit_outcome(provider, False)
+                        # Once tokens reached the caller we cannot switch providers
+                        if chunks:
+                            raise AIStreamError(f"AI stream interrupted: {str(e)}") from e
+                        error = str(e)
+                        continue
+                    except BaseException:
+                        # Consumer stopped reading or was cancelled
+                        breaker.release_trial()
+                        if chunks and self.config.cache_partial_streams:
+                            self._cache_response(self._get_cache_key(prompt_data, provider), "".join(chunks).strip())
+                        raise
                     
-            except Exception as e:
-                if attempt == self.config.max_retries - 1:
-                    return False, f"AI request failed after {self.config.max_retries} attempts: {str(e)}"
+                    latency = time.monotonic() - started
+                    stats.record(True, latency=latency)
+                    self._record_circuit_outcome(provider, True, latency)
+                    self.model_catalog.record_latency(provider, self._model_for(provider, prompt_data), latency)
+            except asyncio.CancelledError:
+                if not dispatched:
+                    self._release_rate_limit(provider, reservation)
+                raise
+            
+            response = "".join(chunks).strip()
+            self._cache_response(self._get_cache_key(prompt_data, provider), response)
+            
+            if on_complete:
+                on_complete(self._build_conversation(
+                    conversation_id, phase, prompt_data, response, provider.value
+                ))
+            return
+        
+        raise AIStreamError(error)
+    
+    def _build_conversation(
+        self,
+        conversation_id: Optional[str],
+        phase: str,
+        prompt_data: Dict[str, Any],
+        response: str,
+        model: str
+    ) -> AIConversation:
+        """Record a completed exchange
+        
+        Extends the stored conversation with this id, or starts a new one.
+        Conversations are only stored when the caller supplied an id.
+        """
+        exchange = [
+            AIMessage(
+                role="user",
+                content=prompt_data["user"],
+                timestamp=datetime.now()
+            ),
+            AIMessage(
+                role="assistant", 
+                content=response,
+                timestamp=datetime.now(),
+                model=model
+            )
+        ]
+        
+        conversation = self.conversations.get(conversation_id) if conversation_id else None
+        if conversation is not None:
+            conversation.messages.extend(exchange)
+            conversation.updated_at = datetime.now()
+            return conversation
+        
+        conversation = AIConversation(
+            id=conversation_id or f"ai_{int(time.time())}",
+            phase=phase,
+            messages=exchange,
+            created_at=datetime.now(),
+            updated_at=datetime.now()
+        )
+        if conversation_id:
+            self.conversations[conversation_id] = conversation
+        return conversation
+    
+    def _route(self) -> List[AIProvider]:
+        """Providers to try for a request, in order
+        
+        With discovery on, providers last seen unreachable are skipped, so
+        the list is empty when none is reachable. Stale results are
+        refreshed in the background.
+        """
+        providers = [self.config.provider]
+        if self.config.fallback_provider not in (AIProvider.DISABLED, self.config.provider):
+            providers.append(self.config.fallback_provider)
+        if not self.config.discover_providers:
+            return providers
+        
+        if any(self.discovery.is_stale(provider) for provider in providers):
+            self.discovery.refresh_in_background(self._http())
+        return [provider for provider in providers if self.discovery.is_available(provider) is not False]
+    
+    async def _available(self) -> bool:
+        """Check if any provider can take a request
+        
+        The first call after startup waits for discovery's first probe, which
+        its short timeouts bound, rather than sending a request to a provider
+        that may be down.
+        """
+        if self.config.provider == AIProvider.DISABLED:
+            return False
+        if self.config.discover_providers:
+            await self.discovery.wait_for_first_results(self._http())
+        return bool(self._route())
+    
+    async def refresh_providers(self) -> Dict[str, bool]:
+        """Probe all configured providers in parallel
+        
+        Joins a refresh that is already running instead of starting a second
+        one, and leaves it running if this caller is cancelled.
+        
+        Returns:
+            Reachability per provider name
+        """
+        results = await asyncio.shield(self.discovery.refresh_in_background(self._http()))
+        return {provider.value: probe.available for provider, probe in results.items()}
+    
+    async def calibrate_models(self, rounds: int = 1) -> Dict[str, Dict[str, Optional[float]]]:
+        """Time a short prompt against every candidate model and save the results
+        
+        Providers are calibrated in parallel; models of one provider are
+        timed one after another so they do not slow each other down. A
+        failed call counts towards the model's error rate. Calls go straight
+        to the provider, bypassing retries and the circuit breaker, so a
+        missing model does not mark the whole provider as down.
+        
+        Returns:
+            Calibration latency per provider and model, None where every call failed
+        """
+        prompt = {
+            "system": "You are a concise assistant.",
+            "user": "Reply with the single word: ready",
+            "max_tokens": 8,
+        }
+        
+        async def calibrate(provider: AIProvider) -> Dict[str, Optional[float]]:
+            latencies: Dict[str, Optional[float]] = {}
+            for name in CANDIDATE_MODELS[provider]:
+                prompt_data = dict(prompt, models={provider.value: name})
+                for _ in range(rounds):
+                    acquired, _ = await self._acquire_rate_limit(
+                        provider, RequestContext(priority=RequestPriority.BACKGROUND)
+                    )
+                    if not acquired:
+                        break
+                    started = time.monotonic()
+                    try:
+                        if provider == AIProvider.OPENROUTER:
+                            success, _ = await self._call_openrouter(prompt_data)
+                        else:
+                            success, _ = await self._call_ollama(prompt_data)
+                    except (ProviderError, aiohttp.ClientError, asyncio.TimeoutError):
+                        success = False
+                    if success:
+                        self.model_catalog.record_latency(
+                            provider, name, time.monotonic() - started, calibration=True
+                        )
+                    else:
+                        self.model_catalog.record_error(provider, name)
+                info = self.model_catalog.get(provider, name)
+                latencies[name] = info.calibration_latency if info else None
+            return latencies
+        
+        providers = [provider for provider in self._route() if provider in CANDIDATE_MODELS]
+        results = await asyncio.gather(*(calibrate(provider) for provider in providers))
+        self.model_catalog.save(self._calibration_path())
+        return {provider.value: latencies for provider, latencies in zip(providers, results)}
+    
+    async def _coalesced_request(
+        self,
+        cache_key: str,
+        prompt_data: Dict[str, Any],
+        providers: List[AIProvider],
+        priority: RequestPriority = RequestPriority.INTERACTIVE,
+        deadline: Optional[float] = None
+    ) -> Tuple[bool, str, AIProvider]:
+        """Join the in-flight request for this cache key, or start one
+        
+        ``deadline`` is absolute (``time.monotonic()``). Each caller stops
+        waiting at its own deadline; the shared request runs until the
+        latest deadline among its callers.
+        """
+        inflight = self._inflight.get(cache_key)
+        if inflight is None:
+            context = RequestContext(priority=priority, deadline=deadline)
+            task = asyncio.ensure_future(self._request_with_fallback(prompt_data, providers, context))
+            self._inflight[cache_key] = (task, context)
+            
+            def forget(done: asyncio.Future):
+                if cache_key in self._inflight and self._inflight[cache_key][0] is done:
+                    del self._inflight[cache_key]
+            
+            task.add_done_callback(forget)
+        else:
+            task, context = inflight
+            if priority < context.priority:
+                # A more urgent caller joined, e.g. a user asking for a prefetched question
+                context.priority = priority
+                for scheduler in self.schedulers.values():
+                    scheduler.reprioritize(context, priority)
+                for limiter in self.rate_limiters.values():
+                    limiter.reprioritize(context, priority)
+            if context.deadline is not None and (deadline is None or deadline > context.deadline):
+                context.deadline = deadline
+        
+        # Shield so one caller giving up does not cancel the shared request,
+        # but abort it once the last caller has gone
+        context.waiters += 1
+        try:
+            if deadline is None:
+                return await asyncio.shield(task)
+            return await asyncio.wait_for(asyncio.shield(task), max(deadline - time.monotonic(), 0.0))
+        except asyncio.TimeoutError:
+            return False, "AI request timed out before its deadline", providers[0]
+        finally:
+            context.waiters -= 1
+            if context.waiters == 0 and not task.done():
+                task.cancel()
+                if self._inflight.get(cache_key, (None,))[0] is task:
+                    del self._inflight[cache_key]
+    
+    async def _request_with_fallback(
+        self, prompt_data: Dict[str, Any], providers: List[AIProvider], context: RequestContext
+    ) -> Tuple[bool, str, AIProvider]:
+        """Try each provider in turn and cache the first success
+        
+        The provider is passed down explicitly rather than swapped on the
+        shared config, so concurrent requests never see each other's routing.
+        """
+        if self.config.enable_hedging and len(providers) > 1:
+            return await self._hedged_request(prompt_data, providers[0], providers[1], context)
+        
+        response = "No AI provider configured"
+        for provider in providers:
+            if context.expired():
+                return False, "AI request timed out before its deadline", provider
+            success, response = await self._request_within_rate_limit(prompt_data, provider, context)
+            if success:
+                self._cache_response(self._get_cache_key(prompt_data, provider), response)
+                return True, response, provider
+        
+        return False, response, providers[-1]
+    
+    def _hedge_delay(self, provider: AIProvider) -> float:
+        """How long to wait on a provider before hedging to the fallback"""
+        stats = self.provider_stats[provider]
+        if len(stats.latencies) < self.config.hedge_min_samples:
+            return self.config.hedge_delay
+        return stats.latency_percentile(self.config.hedge_percentile)
+    
+    async def _hedged_request(
+        self, prompt_data: Dict[str, Any], primary: AIProvider, fallback: AIProvider, context: RequestContext
+    ) -> Tuple[bool, str, AIProvider]:
+        """Race the fallback against a slow primary and keep the first success
+        
+        The fallback is only started once the primary has been outstanding
+        longer than its usual tail latency, or as soon as the primary fails.
+        The losing request is cancelled.
+        """
+        
+        async def attempt(provider: AIProvider) -> Tuple[bool, str, AIProvider]:
+            success, response = await self._request_within_rate_limit(prompt_data, provider, context)
+            return success, response, provider
+        
+        pending = {asyncio.ensure_future(attempt(primary))}
+        hedged = False
+        result: Tuple[bool, str, AIProvider] = (False, "No AI provider configured", primary)
+        
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self._hedge_delay(primary))
+            if not done:
+                self.hedge_stats["launched"] += 1
+                hedged = True
+            pending.add(asyncio.ensure_future(attempt(fallback)))
+            
+            while True:
+                for task in done:
+                    result = task.result()
+                    success, response, provider = result
+                    if success:
+                        if hedged and provider == fallback:
+                            self.hedge_stats["won"] += 1
+                        self._cache_response(self._get_cache_key(prompt_data, provider), response)
+                        return result
+                if not pending:
+                    return result
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _request_within_rate_limit(
+        self, prompt_data: Dict[str, Any], provider: AIProvider, context: RequestContext
+    ) -> Tuple[bool, str]:
+        """Reserve a rate-limit slot for the provider, then call it"""
+        breaker = self.circuit_breakers.get(provider)
+        if breaker and breaker.is_open():
+            return False, self._circuit_open_message(provider)
+        
+        acquired, reservation = await self._acquire_rate_limit(provider, context)
+        if not acquired:
+            return False, "Rate limit exceeded. Please wait before making another request."
+        try:
+            return await self._make_ai_request(prompt_data, provider, context)
+        finally:
+            if provider not in context.dispatched:
+                # Cancelled while queued, or turned away by the circuit breaker
+                # or the deadline: nothing reached the provider
+                self._release_rate_limit(provider, reservation)
+    
+    async def _make_ai_request(
+        self, prompt_data: Dict[str, Any], provider: AIProvider, context: Optional[RequestContext] = None
+    ) -> Tuple[bool, str]:
+        """Make AI request to the given provider
+        
+        Transient failures are retried after the provider's ``Retry-After``
+        or an exponential backoff, but only while the request deadline leaves
+        room for another attempt. Fatal errors return straight away.
+        """
+        
+        stats = self.provider_stats.get(provider)
+        if stats is None:
+            return False, "No AI provider configured"
+        breaker = self.circuit_breakers[provider]
+        context = context or RequestContext()
+        
+        for attempt in range(self.config.max_retries):
+            retry_after = None
+            # Hold a scheduler slot only while the call is on the wire, not during backoff
+            async with self.schedulers[provider].slot(context.priority, context):
+                # Stop retrying as soon as the provider is known to be down
+                if not breaker.allow_request():
+                    return False, self._circuit_open_message(provider)
+                if context.expired():
+                    breaker.release_trial()
+                    return False, "AI request timed out before its deadline"
+                
+                stats.attempts += 1
+                context.dispatched.add(provider)
+                started = time.monotonic()
+                try:
+                    if provider == AIProvider.OPENROUTER:
+                        success, response = await self._call_openrouter(prompt_data, context=context)
+                    else:
+                        success, response = await self._call_ollama(prompt_data, context=context)
+                    latency = time.monotonic() - started
+                    stats.record(success, None if success else response, latency)
+                    self._record_circuit_outcome(provider, success, latency)
+                    if success:
+                        self._adapt_concurrency(provider, latency)
+                        self.model_catalog.record_latency(provider, self._model_for(provider, prompt_data), latency)
+                    else:
+                        self.model_catalog.record_error(provider, self._model_for(provider, prompt_data))
+                    return success, response
                 
-                # Exponential backoff
-                await asyncio.sleep(self.config.retry_delay * (2 ** attempt))
+                except asyncio.CancelledError:
+                    breaker.release_trial()
+                    raise
+                except ProviderError as e:
+                    error = str(e)
+                    retry_after = e.retry_after
+                    stats.record(False, error)
+                    self._record_circuit_outcome(provider, False)
+                    self._adapt_concurrency(provider, overloaded=True)
+                except asyncio.TimeoutError:
+                    error = "request timed out"
+                    stats.record(False, error)
+                    self._record_circuit_outcome(provider, False)
+                    self._adapt_concurrency(provider, overloaded=True)
+                    self.model_catalog.record_error(provider, self._model_for(provider, prompt_data))
+                except Exception as e:
+                    error = str(e)
+                    stats.record(False, error)
+                    self._record_circuit_outcome(provider, False)
+            
+            if attempt == self.config.max_retries - 1:
+                return False, f"AI request failed after {self.config.max_retries} attempts: {error}"
+            
+            # Honor the provider's Retry-After, else exponential backoff
+            delay = retry_after if retry_after is not None else self.config.retry_delay * (2 ** attempt)
+            if not self._retry_fits_deadline(provider, context, delay):
+                return False, f"AI request failed after {attempt + 1} attempts (no time left to retry): {error}"
+            await asyncio.sleep(delay)
         
         return False, "Maximum retries exceeded"
     
-    async def _call_openrouter(self, prompt_data: Dict[str, str]) -> Tuple[bool, str]:
-        """Call OpenRouter API"""
+    def _adapt_concurrency(self, provider: AIProvider, latency: float = 0.0, overloaded: bool = False):
+        """Feed a call outcome to the provider's adaptive limit, if enabled"""
+        adaptive = self.adaptive_limits.get(provider)
+        if adaptive is None:
+            return
+        scheduler = self.schedulers[provider]
+        if overloaded:
+            limit = adaptive.on_overload()
+        else:
+            limit = adaptive.on_success(latency, scheduler.active)
+        if limit != scheduler.max_concurrency:
+            scheduler.set_limit(limit)
+    
+    def _retry_fits_deadline(self, provider: AIProvider, context: RequestContext, delay: float) -> bool:
+        """Check if another attempt after ``delay`` can finish before the deadline"""
+        remaining = context.remaining()
+        if remaining is None:
+            return True
+        # A typical call to this provider, once there is history to go on
+        expected = self.provider_stats[provider].latency_percentile(0.5) or 0.0
+        return remaining - delay > expected
+    
+    def _circuit_open_message(self, provider: AIProvider) -> str:
+        """Error returned while a provider's circuit is open"""
+        return f"{provider.value} is temporarily unavailable (circuit open), retrying in {self.circuit_breakers[provider].open_remaining():.0f}s"
+    
+    def _record_circuit_outcome(self, provider: AIProvider, success: bool, latency: float = 0.0):
+        """Feed a call outcome to the provider's breaker and watch for it opening"""
+        breaker = self.circuit_breakers[provider]
+        was_open = breaker.state == CircuitState.OPEN
         
-        if not self.config.openrouter_api_key:
-            return False, "OpenRouter API key not configured"
+        if success:
+            breaker.record_success(latency)
+        else:
+            breaker.record_failure()
         
-        headers = {
-            "Authorization": f"Bearer {self.config.openrouter_api_key}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://github.com/core-framework/core-framework",
-            "X-Title": "CORE Framework"
-        }
+        if breaker.state == CircuitState.OPEN and not was_open:
+            self._schedule_recovery_probe(provider)
+    
+    def _schedule_recovery_probe(self, provider: AIProvider):
+        """Start a background task that closes the breaker once the provider recovers"""
+        existing = self._probe_tasks.get(provider)
+        if existing and not existing.done():
+            return
+        if self.session is None and not self.config.use_shared_pool:
+            # Without a session, half-open trial requests handle recovery
+            return
+        self._probe_tasks[provider] = asyncio.ensure_future(self._probe_recovery(provider))
+    
+    async def _probe_recovery(self, provider: AIProvider):
+        """Probe an open provider in the background until its breaker closes"""
+        breaker = self.circuit_breakers[provider]
+        while breaker.state != CircuitState.CLOSED:
+            await asyncio.sleep(breaker.open_remaining())
+            if not breaker.allow_request():
+                # A live request holds the trial slot; let it decide
+                await asyncio.sleep(1.0)
+                continue
+            
+            started = time.monotonic()
+            if await self._check_provider_health(provider):
+                breaker.record_success(time.monotonic() - started)
+            else:
+                breaker.record_failure()
+    
+    async def _check_provider_health(self, provider: AIProvider) -> bool:
+        """Cheap request confirming a provider answers again"""
+        if provider == AIProvider.OPENROUTER:
+            url = f"{self.config.openrouter_base_url}/models"
+            headers = self._openrouter_headers()
+        else:
+            url = f"{self.config.ollama_base_url}/api/tags"
+            headers = None
         
-        payload = {
-            "model": self.config.openrouter_model.value,
-            "messages": [
-                {"role": "system", "content": prompt_data["system"]},
-                {"role": "user", "content": prompt_data["user"]}
-            ],
-            "max_tokens": self.config.max_tokens,
-            "temperature": self.config.temperature
-        }
+        try:
+            async with self._http().get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+    
+    async def _call_openrouter(
+        self, prompt_data: Dict[str, Any], context: Optional[RequestContext] = None
+    ) -> Tuple[bool, str]:
+        """Call OpenRouter API
+        
+        Raises:
+            ProviderError: for a retryable status such as 429 or 503
+        """
+        
+        if not self.config.openrouter_api_key:
+            return False, "OpenRouter API key not configured"
         
+        headers = self._openrouter_headers()
+        payload = self._openrouter_payload(prompt_data)
         url = f"{self.config.openrouter_base_url}/chat/completions"
         
-        async with self.session.post(url, headers=headers, json=payload) as response:
+        async with self._http().post(
+            url, headers=headers, json=payload, timeout=self._request_timeout(context)
+        ) as response:
             if response.status == 200:
                 data = await response.json()
+                self._record_openrouter_usage(data.get("usage"))
                 content = data["choices"][0]["message"]["content"]
                 return True, content.strip()
             else:
                 error_text = await response.text()
-                return False, f"OpenRouter API error ({response.status}): {error_text}"
+                message = f"OpenRouter API error ({response.status}): {error_text}"
+                self._raise_if_retryable(response, message)
+                return False, message
+    
+    async def _call_ollama(
+        self, prompt_data: Dict[str, Any], context: Optional[RequestContext] = None
+    ) -> Tuple[bool, str]:
+        """Call Ollama local API
+        
+        Raises:
+            ProviderError: for a retryable status such as 503 while a model loads
+        """
+        
+        payload = self._ollama_payload(prompt_data)
+        url = f"{self.config.ollama_base_url}/api/chat"
+        
+        try:
+            async with self._http().post(url, json=payload, timeout=self._request_timeout(context)) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    # Ollama only reports evaluated tokens; a reused KV prefix shows up as fewer of them
+                    self.provider_stats[AIProvider.OLLAMA].record_usage(
+                        data.get("prompt_eval_count", 0), data.get("eval_count", 0)
+                    )
+                    return True, data["message"]["content"].strip()
+                else:
+                    error_text = await response.text()
+                    message = f"Ollama API error ({response.status}): {error_text}"
+                    self._raise_if_retryable(response, message)
+                    return False, message
+        except aiohttp.ClientConnectorError:
+            return False, f"Cannot connect to Ollama. Make sure Ollama is running on {self.config.ollama_base_url}"
+    
+    def _record_openrouter_usage(self, usage: Optional[Dict[str, Any]]):
+        """Record token usage, including prompt tokens served from the provider's cache"""
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        self.provider_stats[AIProvider.OPENROUTER].record_usage(
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            details.get("cached_tokens") or 0
+        )
+    
+    def _raise_if_retryable(self, response: aiohttp.ClientResponse, message: str):
+        """Turn a transient error status into a ProviderError carrying Retry-After"""
+        if response.status in RETRYABLE_STATUSES:
+            raise ProviderError(
+                message,
+                status=response.status,
+                retry_after=_parse_retry_after(response.headers.get("Retry-After"))
+            )
+    
+    def _openrouter_headers(self) -> Dict[str, str]:
+        """Build request headers for OpenRouter"""
+        return {
+            "Authorization": f"Bearer {self.config.openrouter_api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/core-framework/core-framework",
+            "X-Title": "CORE Framework"
+        }
+    
+    def _chat_messages(self, prompt_data: Dict[str, Any]) -> List[Dict[str, str]]:
+        """System prompt, earlier turns and the new prompt as chat messages"""
+        return [
+            {"role": "system", "content": prompt_data["system"]},
+            *prompt_data.get("history", []),
+            {"role": "user", "content": prompt_data["user"]}
+        ]
+    
+    def _supports_cache_control(self, model: str) -> bool:
+        """Check if the OpenRouter model honors explicit cache_control breakpoints
+        
+        Anthropic and Gemini models need the markers. Other models either
+        cache long prefixes automatically or not at all, so they get plain
+        string messages.
+        """
+        return self.config.enable_prompt_caching and model.startswith(("anthropic/", "google/gemini"))
     
-    async def _call_ollama(self, prompt_data: Dict[str, str]) -> Tuple[bool, str]:
-        """Call Ollama local API"""
+    def _openrouter_messages(self, prompt_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Chat messages with cache breakpoints after the stable prefix
         
-        # Combine system and user prompts for Ollama
-        combined_prompt = f"{prompt_data['system']}\n\nUser: {prompt_data['user']}\n\nAssistant:"
+        The system prompt (phase instructions) and, in a conversation, the
+        last earlier turn are marked, so a follow-up reuses the cached prefix
+        and only the new prompt is processed from scratch.
+        """
+        messages: List[Dict[str, Any]] = self._chat_messages(prompt_data)
+        if not self._supports_cache_control(self._model_for(AIProvider.OPENROUTER, prompt_data)):
+            return messages
         
+        breakpoints = [0]
+        if prompt_data.get("history"):
+            breakpoints.append(len(messages) - 2)
+        for index in breakpoints:
+            message = messages[index]
+            messages[index] = {
+                "role": message["role"],
+                "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+            }
+        return messages
+    
+    def _openrouter_payload(self, prompt_data: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        """Build chat completion payload for OpenRouter"""
         payload = {
-            "model": self.config.ollama_model.value,
-            "prompt": combined_prompt,
-            "stream": False,
+            "model": self._model_for(AIProvider.OPENROUTER, prompt_data),
+            "messages": self._openrouter_messages(prompt_data),
+            "max_tokens": prompt_data.get("max_tokens", self.config.max_tokens),
+            "temperature": self.config.temperature
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def _ollama_payload(self, prompt_data: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        """Build chat payload for Ollama
+        
+        Messages go out in the same order every turn (system, earlier turns,
+        new prompt), so Ollama can reuse the KV cache for the shared prefix
+        instead of re-evaluating the whole conversation. ``keep_alive`` keeps
+        the model loaded between questions.
+        """
+        
+        return {
+            "model": self._model_for(AIProvider.OLLAMA, prompt_data),
+            "messages": self._chat_messages(prompt_data),
+            "stream": stream,
+            "keep_alive": self.config.ollama_keep_alive,
             "options": {
                 "temperature": self.config.temperature,
-                "num_predict": self.config.max_tokens
+                "num_predict": prompt_data.get("max_tokens", self.config.max_tokens)
             }
         }
+    
+    def _stream_provider(self, provider: AIProvider, prompt_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Dispatch a streaming request to the given provider"""
+        if provider == AIProvider.OPENROUTER:
+            return self._stream_openrouter(prompt_data)
+        elif provider == AIProvider.OLLAMA:
+            return self._stream_ollama(prompt_data)
+        raise AIStreamError("No AI provider configured")
+    
+    async def _stream_openrouter(self, prompt_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream tokens from OpenRouter's server-sent events endpoint"""
         
-        url = f"{self.config.ollama_base_url}/api/generate"
+        if not self.config.openrouter_api_key:
+            raise AIStreamError("OpenRouter API key not configured")
+        
+        url = f"{self.config.openrouter_base_url}/chat/completions"
+        payload = self._openrouter_payload(prompt_data, stream=True)
+        
+        async with self._http().post(
+            url, headers=self._openrouter_headers(), json=payload, timeout=self._stream_timeout()
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise AIStreamError(f"OpenRouter API error ({response.status}): {error_text}")
+            
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                # Skip blank event separators and ": OPENROUTER PROCESSING" comments
+                if not line.startswith("data:"):
+                    continue
+                
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                
+                event = json.loads(data)
+                if "error" in event:
+                    raise AIStreamError(f"OpenRouter stream error: {event['error']}")
+                
+                # The final chunk carries usage and may have no choices
+                self._record_openrouter_usage(event.get("usage"))
+                if not event.get("choices"):
+                    continue
+                delta = event["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    
+    async def _stream_ollama(self, prompt_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream tokens from Ollama's newline-delimited JSON chat endpoint"""
+        
+        url = f"{self.config.ollama_base_url}/api/chat"
+        payload = self._ollama_payload(prompt_data, stream=True)
         
         try:
-            async with self.session.post(url, json=payload) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return True, data["response"].strip()
-                else:
+            async with self._http().post(url, json=payload, timeout=self._stream_timeout()) as response:
+                if response.status != 200:
                     error_text = await response.text()
-                    return False, f"Ollama API error ({response.status}): {error_text}"
+                    raise AIStreamError(f"Ollama API error ({response.status}): {error_text}")
+                
+                async for raw_line in response.content:
+                    line = raw_line.strip()
+                    if not line:
+                        continue
+                    
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise AIStreamError(f"Ollama stream error: {event['error']}")
+                    
+                    content = event.get("message", {}).get("content")
+                    if content:
+                        yield content
+                    if event.get("done"):
+                        self.provider_stats[AIProvider.OLLAMA].record_usage(
+                            event.get("prompt_eval_count", 0), event.get("eval_count", 0)
+                        )
+                        break
         except aiohttp.ClientConnectorError:
-            return False, "Cannot connect to Ollama. Make sure Ollama is running on localhost:11434"
+            raise AIStreamError(f"Cannot connect to Ollama. Make sure Ollama is running on {self.config.ollama_base_url}")
     
     async def list_available_models(self) -> Tuple[bool, List[str]]:
-        """List available models for the current provider"""
+        """List available models for the current provider
         
-        if self.config.provider == AIProvider.OPENROUTER:
-            # For OpenRouter, return predefined models
-            from .config import OpenRouterModel
-            return True, [model.value for model in OpenRouterModel]
+        Served from the model catalog; the network is only used the first
+        time and, in the background, once the list is older than
+        ``model_catalog_ttl``.
+        """
         
-        elif self.config.provider == AIProvider.OLLAMA:
-            try:
-                url = f"{self.config.ollama_base_url}/api/tags"
-                async with self.session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        models = [model["name"] for model in data.get("models", [])]
-                        return True, models
-                    else:
-                        return False, []
-            except:
-                return False, []
+        if self.config.provider == AIProvider.DISABLED:
+            return False, []
         
-        return False, []
+        success, models = await self.model_catalog.list_models(self.config.provider, self._http())
+        return success, [model.name for model in models]
+    
+    def get_model_info(self, name: str, provider: Optional[AIProvider] = None) -> Optional[ModelInfo]:
+        """Cached metadata for a model, such as context length and observed latency"""
+        return self.model_catalog.get(provider or self.config.provider, name)
     
     def get_provider_status(self) -> Dict[str, Any]:
         """Get status information about AI providers"""
         
+        cache_stats = self.cache.stats()
         return {
             "primary_provider": self.config.provider.value,
             "fallback_provider": self.config.fallback_provider.value,
             "openrouter_configured": bool(self.config.openrouter_api_key),
-            "ollama_available": self.config.provider == AIProvider.OLLAMA or self.config.fallback_provider == AIProvider.OLLAMA,
-            "rate_limit_remaining": self.config.max_requests_per_minute - len(self.rate_limiter.requests),
+            "ollama_available": (
+                self.discovery.is_available(AIProvider.OLLAMA) is not False
+                and AIProvider.OLLAMA in (self.config.provider, self.config.fallback_provider)
+            ),
+            "discovery": self.discovery.to_status(),
+            "model_catalog": self.model_catalog.to_status(),
+            "model_selection": {
+                "enabled": self.config.auto_select_model,
+                "tier": self.config.model_quality_tier.value,
+                "selected": {
+                    provider.value: self.model_catalog.select_model(
+                        provider, self.config.model_quality_tier, self.config.model_max_error_rate
+                    )
+                    for provider in CANDIDATE_MODELS
+                },
+                "candidates": {
+                    provider.value: [info.to_status() for info in self.model_catalog.measured(provider)]
+                    for provider in CANDIDATE_MODELS
+                },
+            },
+            "rate_limit_remaining": self.rate_limiter.remaining(),
+            "rate_limits": {
+                provider.value: {
+                    "limit": limiter.max_requests,
+                    "remaining": limiter.remaining(),
+                    "next_slot_eta": round(limiter.next_slot_eta(), 2)
+                }
+                for provider, limiter in self.rate_limiters.items()
+            },
+            "providers": {
+                provider.value: stats.to_status() for provider, stats in self.provider_stats.items()
+            },
+            "circuit_breakers": {
+                provider.value: breaker.to_status() for provider, breaker in self.circuit_breakers.items()
+            },
+            "hedging": dict(self.hedge_stats, enabled=self.config.enable_hedging),
+            "prescreen": dict(self.prescreen_stats, enabled=self.config.enable_answer_prescreen),
             "cache_enabled": self.config.enable_cache,
-            "cached_responses": len(self.cache)
+            "cache_backend": self.config.cache_backend.value,
+            "cached_responses": len(self.cache),
+            "inflight_requests": len(self._inflight),
+            "schedulers": {
+                provider.value: scheduler.metrics() for provider, scheduler in self.schedulers.items()
+            },
+            "adaptive_concurrency": {
+                provider.value: adaptive.to_status() for provider, adaptive in self.adaptive_limits.items()
+            },
+            "cache_hits": cache_stats["hits"],
+            "cache_misses": cache_stats["misses"],
+            "cache_evictions": cache_stats["evictions"],
+            "cache_bytes": cache_stats["bytes"],
+            "semantic_cache_enabled": self.semantic_cache is not None,
+            "semantic_cache_hits": self.semantic_cache.hits if self.semantic_cache else 0,
+            "semantic_cache_misses": self.semantic_cache.misses if self.semantic_cache else 0
         }
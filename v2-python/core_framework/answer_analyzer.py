@@ -0,0 +1,153 @@
+"""Local answer checks that decide whether guidance needs the AI"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .models import Question, QUESTIONS
+
+
+VAGUE_WORDS = frozenset({
+    "things", "stuff", "etc", "various", "some", "many", "lots", "better", "good",
+    "nice", "easy", "simple", "everyone", "anyone", "somehow", "maybe", "probably",
+    "basically", "generally", "several", "improve", "efficient",
+})
+
+# Share of vague words above which an answer needs rewording, not just a tip
+VAGUE_DENSITY_LIMIT = 0.08
+
+_WORD = re.compile(r"[a-z']+")
+_MONTH = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_UNIT = (
+    r"(?:%|percent|k|thousand|million|users?|students?|customers?|clients?|people|members?|subscribers?"
+    r"|sign-?ups?|downloads?|installs?|sessions?|visit(?:s|ors?)|teams?|orders?|sales|reviews?|stars?|ratings?"
+    r"|tasks?|times|hours?|hrs?|days?|weeks?|months?|years?|minutes?|mins?|seconds?|secs?|ms"
+    r"|developers?|devs?|engineers?|designers?|dollars?|euros?|pounds?|usd|eur|gbp|mau|dau|wau|nps)"
+)
+# A number next to a unit (up to two words apart), a currency amount or a date
+_METRIC = re.compile(
+    rf"\b\d+(?:[.,]\d+)*\s*(?:[a-z-]+\s+){{0,2}}?{_UNIT}(?![a-z])"
+    r"|[$€£]\s*\d"
+    r"|\b(?:19|20)\d{2}\b|\bq[1-4]\b"
+    rf"|\b{_MONTH}\s+\d{{1,2}}\b|\b\d{{1,2}}\s+{_MONTH}(?![a-z])"
+    r"|\b\d{1,4}[-/]\d{1,2}[-/]\d{1,4}\b",
+    re.IGNORECASE
+)
+# A stated boundary, e.g. "will not support", "out of scope" or "excluding X"
+_EXCLUSION = re.compile(
+    r"\b(?:out of|not in|beyond(?: the)?) scope\b|\bnon-goals?\b|\bexclud(?:e[sd]?|ing)\b"
+    r"|\b(?:leav(?:e|ing)|left) out\b"
+    r"|\b(?:not|never|won't|don't|doesn't|isn't|aren't)\s+(?:be\s+|going to\s+|try(?:ing)? to\s+)?"
+    r"(?:includ|support|build|cover|handl|offer|provid|add|implement|ship|target|part of)",
+    re.IGNORECASE
+)
+
+
+@dataclass
+class AnswerAssessment:
+    """Outcome of the local pre-screen"""
+    needs_ai: bool
+    guidance: str = ""  # canned guidance when the AI is not needed
+    issues: List[str] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class AnswerRule:
+    """A per-question check with the tip shown when it fails"""
+    name: str
+    check: Callable[[str], bool]
+    tip: str
+
+
+QUESTION_RULES: Dict[str, List[AnswerRule]] = {
+    "C-02": [AnswerRule(
+        "missing_metric",
+        lambda answer: bool(_METRIC.search(answer)),
+        "Add measurable targets, e.g. a number of users, a percentage or a date, so success can be checked."
+    )],
+    "C-05": [AnswerRule(
+        "missing_exclusions",
+        lambda answer: bool(_EXCLUSION.search(answer)),
+        "Name concrete features or audiences you are leaving out, and say why they are excluded."
+    )],
+    "O-04": [AnswerRule(
+        "missing_metric",
+        lambda answer: bool(_METRIC.search(answer)),
+        "Say which numbers you will track (e.g. weekly active users or task completion rate) and the target for each."
+    )],
+    "R-02": [AnswerRule(
+        "missing_figures",
+        lambda answer: bool(_METRIC.search(answer)),
+        "Put figures on your constraints: hours per week, budget and deadline."
+    )],
+}
+
+_QUESTIONS_BY_TEXT: Dict[Tuple[str, str], Question] = {
+    (question.phase.value, question.text): question for question in QUESTIONS
+}
+
+
+def find_question(phase: str, question_text: str) -> Optional[Question]:
+    """Look up a framework question by phase and text"""
+    return _QUESTIONS_BY_TEXT.get((phase, question_text))
+
+
+def vague_word_density(answer: str) -> float:
+    """Share of words in the answer that are vague"""
+    words = _WORD.findall(answer.lower())
+    if not words:
+        return 0.0
+    return sum(1 for word in words if word in VAGUE_WORDS) / len(words)
+
+
+def analyze_answer(question: Question, answer: str) -> AnswerAssessment:
+    """
+    Decide whether an answer needs AI feedback or a canned tip will do
+
+    Empty, too short and too long answers and failed per-question rules get
+    instant guidance. Everything else goes to the AI: the rules can show
+    that an answer lacks a metric or an exclusion, but not that the one it
+    has is any good.
+    """
+    answer = answer.strip()
+
+    if not answer:
+        return AnswerAssessment(
+            needs_ai=False,
+            guidance=f"Start with a rough first draft. {question.guidance}",
+            issues=["empty"]
+        )
+
+    if len(answer) < question.min_length:
+        return AnswerAssessment(
+            needs_ai=False,
+            guidance=(
+                f"Your answer is {len(answer)} characters; aim for at least {question.min_length}. "
+                f"{question.guidance}"
+            ),
+            issues=["too_short"]
+        )
+
+    if len(answer) > question.max_length:
+        return AnswerAssessment(
+            needs_ai=False,
+            guidance=(
+                f"Your answer is {len(answer)} characters; keep it under {question.max_length}. "
+                "Cut background detail and keep the points that answer the question directly."
+            ),
+            issues=["too_long"]
+        )
+
+    rules = QUESTION_RULES.get(question.id, [])
+    failed = [rule for rule in rules if not rule.check(answer)]
+    if failed:
+        return AnswerAssessment(
+            needs_ai=False,
+            guidance=" ".join(rule.tip for rule in failed),
+            issues=[rule.name for rule in failed]
+        )
+
+    if vague_word_density(answer) > VAGUE_DENSITY_LIMIT:
+        return AnswerAssessment(needs_ai=True, issues=["vague"])
+
+    return AnswerAssessment(needs_ai=True)
@@ -0,0 +1,442 @@
+"""Response cache backends for AI guidance"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple
+
+from .config import AIConfig, CacheBackend
+
+try:
+    import numpy
+except ImportError:  # optional: the similarity tier falls back to pure Python
+    numpy = None
+
+
+def default_cache_path() -> Path:
+    """Location of the shared on-disk cache for this user"""
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(cache_home) / "core-framework" / "ai_cache.sqlite3"
+
+
+def _entry_size(key: str, response: str) -> int:
+    """Approximate memory footprint of a cache entry in bytes"""
+    return len(key) + len(response.encode("utf-8"))
+
+
+class MemoryCache:
+    """In-process LRU response cache with TTL expiry and a byte budget"""
+
+    def __init__(self, ttl: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_sweep = time.time()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get cached response if still valid"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        response, stored_at = entry
+        if time.time() - stored_at >= self.ttl:
+            self._remove(key)
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def set(self, key: str, response: str):
+        """Store a response, evicting expired and least recently used entries"""
+        size = _entry_size(key, response)
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (response, time.time())
+        self.total_bytes += size
+
+        self._sweep_expired()
+        while self.total_bytes > self.max_bytes:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _sweep_expired(self):
+        """Drop expired entries at most once per sweep interval"""
+        now = time.time()
+        if now - self._last_sweep < min(self.ttl, 60):
+            return
+        self._last_sweep = now
+
+        expired = [key for key, (_, stored_at) in self.entries.items() if now - stored_at >= self.ttl]
+        for key in expired:
+            self._remove(key)
+        self.evictions += len(expired)
+
+    def _remove(self, key: str):
+        response, _ = self.entries.pop(key)
+        self.total_bytes -= _entry_size(key, response)
+
+    def clear(self):
+        """Drop every cached response"""
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def close(self):
+        """Nothing to release for the in-process cache"""
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class DiskCache:
+    """SQLite-backed response cache that survives restarts
+
+    Uses WAL journaling so several core-framework processes on one host can
+    read and write the same file concurrently. Entries expire after ``ttl``
+    seconds and the least recently used ones are evicted once the stored
+    responses exceed ``max_bytes``.
+
+    Only reads run on the caller's thread, with a short busy timeout so a
+    locked file counts as a miss rather than a stall. Writes, including
+    deletes of expired entries and the access times of cache hits (batched
+    until the next write), go to a single writer thread; responses waiting
+    to be written are served from memory meanwhile.
+    """
+
+    READ_BUSY_TIMEOUT = 0.05
+    WRITE_BUSY_TIMEOUT = 5.0
+
+    def __init__(self, path: Path, ttl: int, max_bytes: int):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = False
+        self._pending: Dict[str, Tuple[str, float]] = {}  # key -> (response, stored_at) not yet written
+        self._touched: Dict[str, float] = {}  # key -> access time not yet written
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.write_conn = sqlite3.connect(
+            str(self.path), timeout=self.WRITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self.write_conn.execute("PRAGMA journal_mode=WAL")
+        self.write_conn.execute("PRAGMA synchronous=NORMAL")
+        self.write_conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.write_conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self.conn = sqlite3.connect(
+            str(self.path), timeout=self.READ_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Get cached response if still valid"""
+        now = time.time()
+        with self._lock:
+            pending = self._pending.get(key)
+        if pending is not None and now - pending[1] < self.ttl:
+            self.hits += 1
+            return pending[0]
+
+        try:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error:
+            # A locked or damaged cache must never break guidance requests
+            self.misses += 1
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+
+        response, created_at = row
+        if now - created_at >= self.ttl:
+            self._submit(self._write_delete, key)
+            self.misses += 1
+            return None
+
+        with self._lock:
+            self._touched[key] = now
+        self.hits += 1
+        return response
+
+    def set(self, key: str, response: str):
+        """Store a response; the write and eviction happen on the writer thread"""
+        now = time.time()
+        with self._lock:
+            self._pending[key] = (response, now)
+        self._submit(self._write_response, key, response, now)
+
+    def _submit(self, write, *args):
+        if self.closed:
+            return
+        self._writer.submit(write, *args)
+
+    def _write_response(self, key: str, response: str, now: float):
+        size = len(response.encode("utf-8"))
+        try:
+            self.write_conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touched()
+                self.write_conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, response, size, now, now)
+                )
+                self._evict(now)
+                self.write_conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.write_conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            pass
+        finally:
+            with self._lock:
+                if self._pending.get(key) == (response, now):
+                    del self._pending[key]
+
+    def _write_delete(self, key: str):
+        try:
+            deleted = self.write_conn.execute(
+                "DELETE FROM responses WHERE key = ? AND created_at <= ?", (key, time.time() - self.ttl)
+            )
+            self.evictions += max(deleted.rowcount, 0)
+        except sqlite3.Error:
+            pass
+
+    def _write_touched(self):
+        """Record the access times of cache hits since the last write"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            self.write_conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items()]
+            )
+
+    def _evict(self, now: float):
+        """Remove expired entries, then the least recently used over budget"""
+        expired = self.write_conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        self.evictions += max(expired.rowcount, 0)
+
+        total = self.write_conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        stale_keys = []
+        for key, size in self.write_conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            stale_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.write_conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+        self.evictions += len(stale_keys)
+
+    def _write_clear(self):
+        try:
+            self.write_conn.execute("DELETE FROM responses")
+        except sqlite3.Error:
+            pass
+
+    def flush(self):
+        """Block until every queued write, including pending access times, is on disk"""
+        if self.closed:
+            return
+
+        def write_touched():
+            try:
+                self._write_touched()
+            except sqlite3.Error:
+                pass
+
+        self._writer.submit(write_touched).result()
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._pending.clear()
+            self._touched.clear()
+        self._submit(self._write_clear)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters for this process"""
+        try:
+            stored_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            stored_bytes = 0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": stored_bytes,
+        }
+
+    def close(self):
+        """Finish queued writes and close the database connections"""
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self._writer.shutdown(wait=True)
+        self.conn.close()
+        self.write_conn.close()
+
+    def __len__(self) -> int:
+        try:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM responses WHERE created_at > ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+
+class SemanticCache:
+    """Near-duplicate cache tier for guidance on lightly edited answers
+    
+    Answers are turned into hashed character n-gram vectors and compared by
+    cosine similarity, using NumPy when it is installed. Entries are indexed
+    per question (the caller's ``index_key``), so only earlier answers to the
+    same question can match. Answers shorter than ``min_chars`` are left to
+    the exact-match cache, since a few characters say little about meaning.
+    """
+    
+    def __init__(
+        self,
+        threshold: float,
+        ttl: int,
+        max_entries_per_key: int = 50,
+        ngram: int = 3,
+        dimensions: int = 1024,
+        min_chars: int = 20
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries_per_key = max_entries_per_key
+        self.ngram = ngram
+        self.dimensions = dimensions
+        self.min_chars = min_chars
+        # index_key -> parallel lists of vectors, responses and store times
+        self.indexes: Dict[str, Tuple[List, List[str], List[float]]] = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def _vectorize(self, text: str):
+        """Unit-length hashed n-gram counts, dense with NumPy or sparse without"""
+        normalized = " ".join(text.lower().split())
+        grams = Counter(
+            zlib.crc32(normalized[i:i + self.ngram].encode("utf-8")) % self.dimensions
+            for i in range(max(len(normalized) - self.ngram + 1, 1))
+        )
+        norm = math.sqrt(sum(count * count for count in grams.values())) or 1.0
+        
+        if numpy is None:
+            return {index: count / norm for index, count in grams.items()}
+        vector = numpy.zeros(self.dimensions, dtype=numpy.float32)
+        vector[list(grams)] = list(grams.values())
+        return vector / norm
+    
+    def _similarities(self, vectors: List, vector) -> List[float]:
+        if numpy is None:
+            return [sum(weight * other.get(index, 0.0) for index, weight in vector.items()) for other in vectors]
+        return (numpy.vstack(vectors) @ vector).tolist()
+    
+    def get(self, index_key: str, text: str) -> Optional[str]:
+        """Guidance stored for the most similar earlier answer, if similar enough"""
+        entry = self.indexes.get(index_key)
+        if entry is None or len(text) < self.min_chars:
+            self.misses += 1
+            return None
+        
+        self._expire(index_key)
+        vectors, responses, _ = entry
+        if not vectors:
+            self.misses += 1
+            return None
+        
+        scores = self._similarities(vectors, self._vectorize(text))
+        best = max(range(len(scores)), key=scores.__getitem__)
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        return responses[best]
+    
+    def set(self, index_key: str, text: str, response: str):
+        """Remember guidance given for an answer"""
+        if len(text) < self.min_chars:
+            return
+        
+        vectors, responses, stored = self.indexes.setdefault(index_key, ([], [], []))
+        vectors.append(self._vectorize(text))
+        responses.append(response)
+        stored.append(time.time())
+        if len(vectors) > self.max_entries_per_key:
+            del vectors[0], responses[0], stored[0]
+    
+    def _expire(self, index_key: str):
+        vectors, responses, stored = self.indexes[index_key]
+        cutoff = time.time() - self.ttl
+        while stored and stored[0] <= cutoff:
+            del vectors[0], responses[0], stored[0]
+    
+    def clear(self):
+        """Drop every indexed answer"""
+        self.indexes.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counters for the similarity tier"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": sum(len(responses) for _, responses, _ in self.indexes.values()),
+        }
+
+
+def create_cache(config: AIConfig):
+    """Create the response cache backend selected in the configuration"""
+    if config.cache_backend == CacheBackend.DISK:
+        path = Path(config.cache_path) if config.cache_path else default_cache_path()
+        return DiskCache(path, config.cache_ttl, config.cache_max_bytes)
+    return MemoryCache(config.cache_ttl, config.cache_max_bytes)
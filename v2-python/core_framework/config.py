@@ -1,10 +1,13 @@
 """Configuration management for CORE Framework AI integration"""
 
 import os
-from typing import Optional, Dict, Any, List
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
 from pydantic import BaseModel, Field
 from enum import Enum
 
+from .models import QUESTIONS
+
 
 class AIProvider(str, Enum):
     OPENROUTER = "openrouter"
@@ -27,6 +30,48 @@ class OllamaModel(str, Enum):
     GEMMA = "gemma"
 
 
+class QualityTier(str, Enum):
+    FAST = "fast"
+    STANDARD = "standard"
+    ADVANCED = "advanced"
+
+    @property
+    def rank(self) -> int:
+        """Position in the ordering fast < standard < advanced"""
+        return list(QualityTier).index(self)
+
+
+# Quality tier of each built-in model, used by automatic model selection
+MODEL_QUALITY_TIERS: Dict[str, QualityTier] = {
+    OpenRouterModel.CLAUDE_SONNET.value: QualityTier.ADVANCED,
+    OpenRouterModel.CLAUDE_HAIKU.value: QualityTier.STANDARD,
+    OpenRouterModel.GPT4_TURBO.value: QualityTier.ADVANCED,
+    OpenRouterModel.GPT4O.value: QualityTier.ADVANCED,
+    OpenRouterModel.LLAMA_70B.value: QualityTier.STANDARD,
+    OllamaModel.LLAMA3.value: QualityTier.STANDARD,
+    OllamaModel.MISTRAL.value: QualityTier.STANDARD,
+    OllamaModel.CODELLAMA.value: QualityTier.FAST,
+    OllamaModel.GEMMA.value: QualityTier.FAST,
+}
+
+
+# Most tokens a model may generate in one reply; packed batches must stay under it.
+# Ollama models have no fixed limit beyond their context window.
+MODEL_MAX_OUTPUT_TOKENS: Dict[str, int] = {
+    OpenRouterModel.CLAUDE_SONNET.value: 8192,
+    OpenRouterModel.CLAUDE_HAIKU.value: 4096,
+    OpenRouterModel.GPT4_TURBO.value: 4096,
+    OpenRouterModel.GPT4O.value: 16384,
+    OpenRouterModel.LLAMA_70B.value: 4096,
+}
+DEFAULT_MAX_OUTPUT_TOKENS = 4096  # assumed for OpenRouter models not listed above
+
+
+class CacheBackend(str, Enum):
+    MEMORY = "memory"
+    DISK = "disk"
+
+
 class AIConfig(BaseModel):
     """AI configuration settings"""
     
@@ -38,42 +83,113 @@ class AIConfig(BaseModel):
     openrouter_api_key: Optional[str] = None
     openrouter_model: OpenRouterModel = OpenRouterModel.CLAUDE_HAIKU
     openrouter_base_url: str = "https://openrouter.ai/api/v1"
+    enable_prompt_caching: bool = True  # cache_control markers for models that support them
     
     # Ollama settings
     ollama_base_url: str = "http://localhost:11434"
     ollama_model: OllamaModel = OllamaModel.LLAMA3
+    ollama_keep_alive: str = "30m"  # how long Ollama keeps the model loaded after a call
+    ollama_warmup: bool = True  # load the model when a handler is entered
     
     # Rate limiting
     max_requests_per_minute: int = 20
+    ollama_max_requests_per_minute: int = 60
+    rate_limit_timeout: float = 30.0  # longest wait for a free slot
+    prefetch_reserve: int = 5  # requests per window kept back from speculative prefetch
+    
+    # Scheduling: concurrent calls per provider and slots kept for interactive use
+    max_concurrent_requests: int = 8
+    ollama_max_concurrent_requests: int = 2
+    interactive_reserve: int = 1
+    
+    # Adaptive concurrency: grow limits while healthy, halve them on 429/5xx or rising latency
+    adaptive_concurrency: bool = False
+    adaptive_max_concurrency: int = 32
+    ollama_adaptive_max_concurrency: int = 8
+    
+    # Retries
     max_retries: int = 3
     retry_delay: float = 1.0
     
+    # Circuit breaker: stop calling a provider that keeps failing
+    circuit_failure_rate: float = 0.5
+    circuit_min_calls: int = 4
+    circuit_window: int = 20
+    circuit_slow_call_seconds: float = 20.0  # slower successes count as failures
+    circuit_open_seconds: float = 30.0
+    
+    # Hedging: race the fallback against a primary slower than its usual tail
+    enable_hedging: bool = False
+    hedge_percentile: float = 0.95
+    hedge_delay: float = 5.0  # used until enough latency samples exist
+    hedge_min_samples: int = 20
+    
     # Response settings
     max_tokens: int = 1000
     temperature: float = 0.7
-    timeout: float = 30.0
+    timeout: float = 30.0  # total per attempt
+    connect_timeout: float = 5.0
+    first_byte_timeout: float = 30.0  # also the longest gap between streamed chunks
+    request_deadline: Optional[float] = 60.0  # whole request, retries and fallback included
+    
+    # Provider discovery: probe endpoints in the background instead of at load time
+    discover_providers: bool = False
+    discovery_ttl: float = 60.0
+    discovery_timeout: float = 2.0
+    discovery_connect_timeout: float = 1.0
+    
+    # Model catalog
+    model_catalog_ttl: float = 3600.0
+    
+    # Automatic model selection: fastest model per provider that meets the tier
+    auto_select_model: bool = False
+    model_quality_tier: QualityTier = QualityTier.STANDARD
+    phase_quality_tiers: Dict[str, QualityTier] = Field(default_factory=dict)  # per-phase overrides
+    model_max_error_rate: float = 0.25
+    model_calibration_path: Optional[str] = None  # defaults to ~/.cache/core-framework
+    
+    # Local pre-screen: canned guidance for answers that do not need the AI
+    enable_answer_prescreen: bool = False
+    
+    # Packed batch mode: questions from one phase answered in a single call
+    batch_pack_size: int = 5
+    
+    # Multi-turn conversations: older turns are summarized past the budget
+    conversation_token_budget: int = 3000
+    conversation_keep_turns: int = 2  # most recent exchanges always sent verbatim
+    
+    # Connection pool shared by every handler in the process
+    use_shared_pool: bool = True
+    pool_limit: int = 100
+    pool_limit_per_host: int = 10
+    pool_dns_cache_ttl: int = 300
+    pool_keepalive_timeout: float = 60.0
     
     # Caching
     enable_cache: bool = True
     cache_ttl: int = 3600  # 1 hour
+    cache_backend: CacheBackend = CacheBackend.MEMORY
+    cache_path: Optional[str] = None  # defaults to ~/.cache/core-framework
+    cache_max_bytes: int = 50 * 1024 * 1024  # LRU byte budget for either backend
+    cache_partial_streams: bool = False  # keep text of streams cancelled midway
+    enable_semantic_cache: bool = False  # reuse guidance for near-identical answers
+    semantic_cache_threshold: float = 0.95  # cosine similarity of answer n-grams
 
 
 def load_config() -> AIConfig:
     """Load AI configuration from environment variables"""
     
-    # Determine provider based on available configuration
-    provider = AIProvider.DISABLED
+    # Determine provider based on available configuration. Ollama is assumed
+    # reachable here; ProviderDiscovery checks it in the background and
+    # routing skips it if it turns out to be down.
+    provider = AIProvider.OLLAMA
     fallback_provider = AIProvider.DISABLED
     
     openrouter_key = os.getenv("OPENROUTER_API_KEY")
-    ollama_available = check_ollama_availability()
     
     if openrouter_key:
         provider = AIProvider.OPENROUTER
-        if ollama_available:
-            fallback_provider = AIProvider.OLLAMA
-    elif ollama_available:
-        provider = AIProvider.OLLAMA
+        fallback_provider = AIProvider.OLLAMA
     
     return AIConfig(
         provider=provider,
@@ -86,23 +202,34 @@ def load_config() -> AIConfig:
             os.getenv("OLLAMA_MODEL", OllamaModel.LLAMA3.value)
         ),
         ollama_base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+        ollama_keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
         max_requests_per_minute=int(os.getenv("AI_MAX_REQUESTS_PER_MINUTE", "20")),
+        ollama_max_requests_per_minute=int(os.getenv("OLLAMA_MAX_REQUESTS_PER_MINUTE", "60")),
+        rate_limit_timeout=float(os.getenv("AI_RATE_LIMIT_TIMEOUT", "30.0")),
+        adaptive_concurrency=os.getenv("AI_ADAPTIVE_CONCURRENCY", "false").lower() == "true",
         max_retries=int(os.getenv("AI_MAX_RETRIES", "3")),
         timeout=float(os.getenv("AI_TIMEOUT", "30.0")),
+        request_deadline=float(os.getenv("AI_REQUEST_DEADLINE", "60.0")),
         temperature=float(os.getenv("AI_TEMPERATURE", "0.7")),
+        enable_hedging=os.getenv("AI_ENABLE_HEDGING", "false").lower() == "true",
+        hedge_delay=float(os.getenv("AI_HEDGE_DELAY", "5.0")),
+        cache_backend=CacheBackend(os.getenv("AI_CACHE_BACKEND", CacheBackend.MEMORY.value)),
+        cache_path=os.getenv("AI_CACHE_PATH"),
+        cache_ttl=int(os.getenv("AI_CACHE_TTL", "3600")),
+        cache_max_bytes=int(os.getenv("AI_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+        cache_partial_streams=os.getenv("AI_CACHE_PARTIAL_STREAMS", "false").lower() == "true",
+        discover_providers=os.getenv("AI_DISCOVER_PROVIDERS", "true").lower() == "true",
+        discovery_ttl=float(os.getenv("AI_DISCOVERY_TTL", "60.0")),
+        model_catalog_ttl=float(os.getenv("AI_MODEL_CATALOG_TTL", "3600.0")),
+        auto_select_model=os.getenv("AI_AUTO_SELECT_MODEL", "false").lower() == "true",
+        model_quality_tier=QualityTier(os.getenv("AI_MODEL_QUALITY_TIER", QualityTier.STANDARD.value)),
+        model_calibration_path=os.getenv("AI_MODEL_CALIBRATION_PATH"),
+        enable_answer_prescreen=os.getenv("AI_ANSWER_PRESCREEN", "false").lower() == "true",
+        enable_semantic_cache=os.getenv("AI_SEMANTIC_CACHE", "false").lower() == "true",
+        semantic_cache_threshold=float(os.getenv("AI_SEMANTIC_CACHE_THRESHOLD", "0.95")),
     )
 
 
-def check_ollama_availability() -> bool:
-    """Check if Ollama is available locally"""
-    try:
-        import requests
-        response = requests.get("http://localhost:11434/api/tags", timeout=2)
-        return response.status_code == 200
-    except:
-        return False
-
-
 # Phase-specific AI prompts
 PHASE_PROMPTS = {
     "clarify": {
@@ -124,22 +251,76 @@ PHASE_PROMPTS = {
 }
 
 
-def get_phase_prompt(phase: str, question_text: str, current_answer: str = "") -> Dict[str, str]:
-    """Get AI prompt for a specific phase and question"""
+def _phase_system_prompt(phase_config: Dict[str, str]) -> str:
+    """System prompt shared by every question in a phase"""
+    return (
+        f"{phase_config['system']}\n\n"
+        f"The user asks: {phase_config['guidance']}\n\n"
+        "Please provide specific follow-up questions or suggestions to help them improve their answer. "
+        "Keep your response concise and actionable."
+    )
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """Precompiled prompt for one question
     
-    phase_config = PHASE_PROMPTS.get(phase, PHASE_PROMPTS["clarify"])
+    ``system`` is the same string object for every question in a phase, so
+    the longest possible prefix is shared across requests for provider-side
+    caching. Only the answer is appended at render time.
+    """
+    key: str
+    system: str
+    user_prefix: str
     
-    user_prompt = f"""
-Question: {question_text}
+    def render(self, current_answer: str = "") -> Dict[str, str]:
+        """Build the prompt for an answer"""
+        return {
+            "system": self.system,
+            "user": self.user_prefix + (current_answer.strip() or "Not answered yet")
+        }
 
-Current answer: {current_answer if current_answer else "Not answered yet"}
 
-{phase_config["guidance"]}
+PHASE_SYSTEM_PROMPTS: Dict[str, str] = {
+    phase: _phase_system_prompt(phase_config) for phase, phase_config in PHASE_PROMPTS.items()
+}
 
-Please provide specific follow-up questions or suggestions to help me improve my answer. Keep your response concise and actionable.
-"""
+# One template per question, combining its ai_prompt with the phase prompt
+PROMPT_TEMPLATES: Dict[str, PromptTemplate] = {
+    question.id: PromptTemplate(
+        key=question.id,
+        system=PHASE_SYSTEM_PROMPTS[question.phase.value],
+        user_prefix=f"{question.ai_prompt}\n\nQuestion: {question.text}\n\nCurrent answer: "
+    )
+    for question in QUESTIONS
+}
+
+_TEMPLATES_BY_TEXT: Dict[Tuple[str, str], PromptTemplate] = {
+    (question.phase.value, question.text): PROMPT_TEMPLATES[question.id] for question in QUESTIONS
+}
+
+
+def get_prompt_template(phase: str, question_text: str) -> PromptTemplate:
+    """Template for a question, or a generic phase template for unknown questions"""
+    template = _TEMPLATES_BY_TEXT.get((phase, question_text))
+    if template is not None:
+        return template
     
-    return {
-        "system": phase_config["system"],
-        "user": user_prompt.strip()
-    }
+    if phase not in PHASE_SYSTEM_PROMPTS:
+        phase = "clarify"
+    return PromptTemplate(
+        key=phase,
+        system=PHASE_SYSTEM_PROMPTS[phase],
+        user_prefix=f"Question: {question_text}\n\nCurrent answer: "
+    )
+
+
+def get_phase_prompt(phase: str, question_text: str, current_answer: str = "") -> Dict[str, str]:
+    """Get AI prompt for a specific phase and question
+    
+    Everything that is the same for every question in a phase goes in the
+    system prompt, and the question and answer come last. Providers can then
+    cache the shared prefix instead of processing it again each request.
+    Known questions also get their own ``ai_prompt`` focus.
+    """
+    return get_prompt_template(phase, question_text).render(current_answer)
@@ -0,0 +1,44 @@
+"""Process-wide HTTP connection pool for AI providers"""
+
+import asyncio
+import weakref
+
+import aiohttp
+
+from .config import AIConfig
+
+
+# aiohttp sessions are bound to the event loop they were created on, so the
+# process keeps one pooled session per loop rather than a single global one.
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+
+
+def get_shared_session(config: AIConfig) -> aiohttp.ClientSession:
+    """Borrow the keep-alive session for the running event loop
+
+    The first caller's pool settings size the connector; later handlers
+    reuse the same connections, DNS cache and TLS sessions.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config.pool_limit,
+            limit_per_host=config.pool_limit_per_host,
+            ttl_dns_cache=config.pool_dns_cache_ttl,
+            keepalive_timeout=config.pool_keepalive_timeout
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+
+async def close_shared_session():
+    """Close the pooled session for the running event loop
+
+    Call this on application shutdown; handlers only borrow the pool and
+    never close it themselves.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
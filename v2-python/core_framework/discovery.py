@@ -0,0 +1,131 @@
+"""Asynchronous reachability checks for AI providers"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from .config import AIConfig, AIProvider
+
+
+@dataclass
+class ProviderProbe:
+    """Result of one reachability check"""
+    available: bool
+    checked_at: float
+    latency: Optional[float] = None
+    error: Optional[str] = None
+
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        return {
+            "available": self.available,
+            "age": round(time.monotonic() - self.checked_at, 1),
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "error": self.error,
+        }
+
+
+class ProviderDiscovery:
+    """Finds out which configured providers are reachable, without blocking
+
+    All configured endpoints are probed in parallel with a short connect
+    timeout, so a provider that is down costs at most
+    ``discovery_timeout`` seconds in the background rather than stalling
+    startup. Results are kept for ``discovery_ttl`` seconds; reading a stale
+    result should start a refresh (:meth:`refresh_in_background`) and use
+    the old value meanwhile.
+    """
+
+    def __init__(self, config: AIConfig):
+        self.config = config
+        self.results: Dict[AIProvider, ProviderProbe] = {}
+        self._refresh_task: Optional["asyncio.Task[Dict[AIProvider, ProviderProbe]]"] = None
+
+    def configured(self) -> List[AIProvider]:
+        """Providers worth probing with the current configuration"""
+        providers = [AIProvider.OLLAMA]
+        if self.config.openrouter_api_key:
+            providers.insert(0, AIProvider.OPENROUTER)
+        return providers
+
+    def is_available(self, provider: AIProvider) -> Optional[bool]:
+        """Last known reachability, or None if the provider was never probed"""
+        probe = self.results.get(provider)
+        return probe.available if probe else None
+
+    def is_stale(self, provider: AIProvider) -> bool:
+        """Check if a provider's result is missing or older than the TTL"""
+        probe = self.results.get(provider)
+        return probe is None or time.monotonic() - probe.checked_at >= self.config.discovery_ttl
+
+    def refresh_in_background(
+        self, session: Optional[aiohttp.ClientSession] = None
+    ) -> Optional["asyncio.Task[Dict[AIProvider, ProviderProbe]]"]:
+        """Start a refresh unless one is running; no-op outside an event loop"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return self._refresh_task
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        self._refresh_task = asyncio.ensure_future(self.refresh(session))
+        return self._refresh_task
+
+    async def wait_for_first_results(self, session: Optional[aiohttp.ClientSession] = None):
+        """Wait for the first probe of every configured provider, if still pending
+
+        Later refreshes run in the background and never make callers wait.
+        A caller that gives up does not cancel the shared probe.
+        """
+        if all(provider in self.results for provider in self.configured()):
+            return
+        task = self.refresh_in_background(session)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def refresh(self, session: Optional[aiohttp.ClientSession] = None) -> Dict[AIProvider, ProviderProbe]:
+        """Probe every configured provider in parallel and store the results"""
+        if session is None:
+            async with aiohttp.ClientSession() as owned:
+                return await self.refresh(owned)
+
+        providers = self.configured()
+        probes = await asyncio.gather(*(self._probe(session, provider) for provider in providers))
+        self.results.update(zip(providers, probes))
+        return dict(self.results)
+
+    def _probe_url(self, provider: AIProvider) -> str:
+        if provider == AIProvider.OLLAMA:
+            return f"{self.config.ollama_base_url}/api/tags"
+        return f"{self.config.openrouter_base_url}/models"
+
+    async def _probe(self, session: aiohttp.ClientSession, provider: AIProvider) -> ProviderProbe:
+        """Check that a provider answers at all; any HTTP response below 500 counts"""
+        timeout = aiohttp.ClientTimeout(
+            total=self.config.discovery_timeout,
+            sock_connect=self.config.discovery_connect_timeout
+        )
+        started = time.monotonic()
+        try:
+            async with session.get(self._probe_url(provider), timeout=timeout) as response:
+                latency = time.monotonic() - started
+                if response.status >= 500:
+                    return ProviderProbe(False, time.monotonic(), latency, f"HTTP {response.status}")
+                return ProviderProbe(True, time.monotonic(), latency)
+        except asyncio.TimeoutError:
+            return ProviderProbe(False, time.monotonic(), error="timed out")
+        except aiohttp.ClientError as e:
+            return ProviderProbe(False, time.monotonic(), error=str(e) or type(e).__name__)
+
+    def close(self):
+        """Cancel a refresh that is still running"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        return {provider.value: probe.to_status() for provider, probe in self.results.items()}
@@ -4,6 +4,7 @@ import json
 import uuid
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from textual.app import App, ComposeResult
 from textual.containers import ScrollableContainer
@@ -16,6 +17,8 @@ from .models import (
     ImplementationType, SessionStatus, QUESTIONS_BY_PHASE
 )
 from .output_generator import OutputGenerator
+from .ai_handler import AIHandler
+from .connection_pool import close_shared_session
 
 
 class QuestionScreen(Screen):
@@ -23,11 +26,13 @@ class QuestionScreen(Screen):
     
     BINDINGS = [
         Binding("ctrl+s", "save_and_next", "Save & Next"),
+        Binding("f2", "ai_help", "AI Help"),
         Binding("escape", "back", "Back"),
     ]
     
-    def __init__(self, question: Question, session_data: SessionData, phase_index: int, question_index: int, total_questions: int):
+    def __init__(self, question: Question, session_data: SessionData, phase_index: int, question_index: int, total_questions: int, ai_handler: Optional[AIHandler] = None):
         super().__init__()
+        self.ai_handler = ai_handler
         self.question = question
         self.session_data = session_data
         self.phase_index = phase_index
@@ -59,7 +64,9 @@ class QuestionScreen(Screen):
                 id="answer-input"
             )
             yield Static("")
+            yield Static("", id="ai-guidance")
             yield Button("Save & Next →", id="next-btn")
+            yield Button("Ask AI (F2)", id="ai-btn")
             yield Button("← Back", id="back-btn")
         
         yield Footer()
@@ -67,6 +74,8 @@ class QuestionScreen(Screen):
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "next-btn":
             self.action_save_and_next()
+        elif event.button.id == "ai-btn":
+            self.action_ai_help()
         elif event.button.id == "back-btn":
             self.action_back()
     
@@ -98,10 +107,35 @@ class QuestionScreen(Screen):
             self.session_data.answers.append(new_answer)
         
         self.session_data.session.updated_at = datetime.now()
+        self.cancel_ai_guidance()
         self.dismiss(True)
     
     def action_back(self):
+        self.cancel_ai_guidance()
         self.dismiss(False)
+    
+    def cancel_ai_guidance(self):
+        """Abort a pending guidance request for this question"""
+        self.workers.cancel_group(self, "ai-help")
+    
+    def action_ai_help(self):
+        if self.ai_handler is None:
+            self.notify("AI assistance is not available", severity="warning")
+            return
+        
+        self.query_one("#ai-guidance", Static).update("[dim]Asking AI for guidance...[/dim]")
+        self.run_worker(self.show_ai_guidance(), group="ai-help", exclusive=True)
+    
+    async def show_ai_guidance(self):
+        current_answer = self.query_one("#answer-input", Input).value.strip()
+        # Asking again on the same question continues the earlier conversation
+        success, response, _ = await self.ai_handler.get_ai_guidance(
+            self.question.phase.value, self.question.text, current_answer,
+            conversation_id=self.question.id
+        )
+        
+        style = "green" if success else "red"
+        self.query_one("#ai-guidance", Static).update(f"[{style}]AI:[/{style}] {response}")
 
 
 class COREFrameworkApp(App):
@@ -132,6 +166,7 @@ class COREFrameworkApp(App):
     
     def __init__(self):
         super().__init__()
+        self.ai_handler: Optional[AIHandler] = None
         self.session_data = self.create_new_session()
         self.phases = [
             (PhaseType.CLARIFY, "Clarify", "Define your project vision and goals"),
@@ -165,6 +200,19 @@ class COREFrameworkApp(App):
         
         yield Footer()
     
+    def on_mount(self) -> None:
+        self.ai_handler = AIHandler()
+        if self.ai_handler.config.discover_providers:
+            # Probe providers in the background so startup never waits on one that is down
+            self.run_worker(self.ai_handler.refresh_providers(), group="discovery", exit_on_error=False)
+        if self.ai_handler.config.ollama_warmup:
+            # Load the local model while the user reads the welcome screen
+            self.run_worker(self.ai_handler.warm_up(), group="warm-up", exit_on_error=False)
+    
+    async def on_unmount(self) -> None:
+        await self.ai_handler.close()
+        await close_shared_session()
+    
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id.startswith("phase-"):
             phase_index = int(event.button.id.split("-")[1])
@@ -187,13 +235,39 @@ class COREFrameworkApp(App):
             return
         
         question = questions[question_index]
-        screen = QuestionScreen(question, self.session_data, phase_index, question_index, len(questions))
+        screen = QuestionScreen(question, self.session_data, phase_index, question_index, len(questions), self.ai_handler)
         
         def on_question_complete(should_continue):
             if should_continue:
                 self.show_question(phase_index, question_index + 1, questions)
         
         self.push_screen(screen, on_question_complete)
+        self.cancel_stale_prefetches({q.id for q in questions[question_index:question_index + 2]})
+        self.prefetch_guidance(questions, question_index + 1)
+    
+    def cancel_stale_prefetches(self, keep: set):
+        """Cancel prefetches except those for the given question ids
+        
+        The prefetch for the question just opened is kept: it is the one an
+        interactive request is about to join.
+        """
+        for worker in list(self.workers):
+            if worker.group == "prefetch" and worker.name.split(":", 1)[1] not in keep:
+                worker.cancel()
+    
+    def prefetch_guidance(self, questions: list, question_index: int):
+        """Fetch guidance for the upcoming question while the user works on this one"""
+        if self.ai_handler is None or question_index >= len(questions):
+            return
+        
+        question = questions[question_index]
+        existing = next((a.response for a in self.session_data.answers if a.question_id == question.id), "")
+        self.run_worker(
+            self.ai_handler.prefetch_guidance(question.phase.value, question.text, existing),
+            name=f"prefetch:{question.id}",
+            group="prefetch",
+            exit_on_error=False
+        )
     
     def action_save(self):
         try:
@@ -0,0 +1,368 @@
+"""In-memory catalog of the models each AI provider offers"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .cache import default_cache_path
+from .config import AIConfig, AIProvider, MODEL_QUALITY_TIERS, OllamaModel, OpenRouterModel, QualityTier
+
+
+# Models automatic selection may choose from, per provider
+CANDIDATE_MODELS: Dict[AIProvider, List[str]] = {
+    AIProvider.OPENROUTER: [model.value for model in OpenRouterModel],
+    AIProvider.OLLAMA: [model.value for model in OllamaModel],
+}
+
+
+def default_calibration_path() -> Path:
+    """Location of persisted model latency and error rates for this user"""
+    return default_cache_path().parent / "model_calibration.json"
+
+
+@dataclass
+class ModelInfo:
+    """What is known about one model"""
+    name: str
+    provider: AIProvider
+    context_length: Optional[int] = None
+    size_bytes: Optional[int] = None  # download size of a local model
+    observed_latency: Optional[float] = None  # moving average of successful production calls
+    calibration_latency: Optional[float] = None  # moving average of successful calibration calls
+    error_rate: float = 0.0  # moving average of failed calls
+    samples: int = 0
+
+    def record_latency(self, latency: float, calibration: bool = False):
+        """Fold a successful call's latency into the moving averages
+
+        Calibration calls ask for a few tokens and real calls for hundreds,
+        so their latencies are averaged separately.
+        """
+        previous = self.calibration_latency if calibration else self.observed_latency
+        average = latency if previous is None else 0.8 * previous + 0.2 * latency
+        if calibration:
+            self.calibration_latency = average
+        else:
+            self.observed_latency = average
+        self.error_rate *= 0.8
+        self.samples += 1
+
+    def record_error(self):
+        """Fold a failed call into the error rate"""
+        self.error_rate = 0.8 * self.error_rate + 0.2 if self.samples else 1.0
+        self.samples += 1
+
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        return {
+            "name": self.name,
+            "provider": self.provider.value,
+            "context_length": self.context_length,
+            "size_bytes": self.size_bytes,
+            "observed_latency": round(self.observed_latency, 3) if self.observed_latency is not None else None,
+            "calibration_latency": (
+                round(self.calibration_latency, 3) if self.calibration_latency is not None else None
+            ),
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+def _builtin_openrouter_models() -> Dict[str, ModelInfo]:
+    """OpenRouter models known without asking the API"""
+    return {model.value: ModelInfo(name=model.value, provider=AIProvider.OPENROUTER) for model in OpenRouterModel}
+
+
+class ModelCatalog:
+    """Model lists fetched once per provider and served from memory
+
+    A provider's list is fetched on first use and kept for
+    ``model_catalog_ttl`` seconds. After that, lookups keep returning the
+    cached list while a refresh runs in the background. Latency and error
+    rates observed on real or calibration calls are kept across refreshes
+    and can be saved to disk.
+    """
+
+    def __init__(self, config: AIConfig):
+        self.config = config
+        self.models: Dict[AIProvider, Dict[str, ModelInfo]] = {}
+        self.fetched_at: Dict[AIProvider, float] = {}
+        self.listed: Dict[AIProvider, List[str]] = {}  # names the provider reported last time
+        self.errors: Dict[AIProvider, str] = {}
+        self._refresh_tasks: Dict[AIProvider, "asyncio.Task[Tuple[bool, str]]"] = {}
+
+    def is_stale(self, provider: AIProvider) -> bool:
+        """Check if a provider's list is missing or older than the TTL"""
+        fetched_at = self.fetched_at.get(provider)
+        return fetched_at is None or time.monotonic() - fetched_at >= self.config.model_catalog_ttl
+
+    async def list_models(
+        self, provider: AIProvider, session: Optional[aiohttp.ClientSession] = None
+    ) -> Tuple[bool, List[ModelInfo]]:
+        """Models offered by a provider, fetching only if nothing is cached yet
+
+        If the first fetch of OpenRouter's list fails, its built-in models are
+        served instead until the next refresh.
+
+        Returns:
+            (success, models)
+        """
+        if provider not in self.fetched_at:
+            await self.refresh(provider, session)
+            if provider not in self.fetched_at:
+                return False, []
+        elif self.is_stale(provider):
+            self.refresh_in_background(provider, session)
+        models = self.models[provider]
+        return True, [models[name] for name in self.listed[provider]]
+
+    def get(self, provider: AIProvider, name: str) -> Optional[ModelInfo]:
+        """Look up a model without any network call"""
+        return self.models.get(provider, {}).get(name)
+
+    def _entry(self, provider: AIProvider, name: str) -> ModelInfo:
+        models = self.models.setdefault(provider, {})
+        if name not in models:
+            models[name] = ModelInfo(name=name, provider=provider)
+        return models[name]
+
+    def record_latency(self, provider: AIProvider, name: str, latency: float, calibration: bool = False):
+        """Attribute a successful call's latency to the model that served it"""
+        self._entry(provider, name).record_latency(latency, calibration)
+
+    def record_error(self, provider: AIProvider, name: str):
+        """Attribute a failed call to the model that was asked"""
+        self._entry(provider, name).record_error()
+
+    def measured(self, provider: AIProvider) -> List[ModelInfo]:
+        """Candidate models with latency or error data"""
+        return [
+            info for info in (self.get(provider, name) for name in CANDIDATE_MODELS.get(provider, []))
+            if info is not None and info.samples
+        ]
+
+    def select_model(self, provider: AIProvider, tier: QualityTier, max_error_rate: float) -> Optional[str]:
+        """Fastest measured candidate at or above a quality tier
+
+        Latencies of short calibration calls and of real answers are never
+        compared with each other. Candidates timed only by calibration are
+        tried first, fastest first, so each gets a production measurement;
+        after that the fastest in production wins.
+        Models without latency data or failing more often than
+        ``max_error_rate`` are skipped. Returns None when no candidate
+        qualifies, leaving the configured model in place.
+        """
+        production, unproven = [], []
+        for name in CANDIDATE_MODELS.get(provider, []):
+            info = self.get(provider, name)
+            if info is None or info.error_rate > max_error_rate:
+                continue
+            if MODEL_QUALITY_TIERS.get(name, QualityTier.FAST).rank < tier.rank:
+                continue
+            if info.observed_latency is not None:
+                production.append((info.observed_latency, name))
+            elif info.calibration_latency is not None:
+                unproven.append((info.calibration_latency, name))
+        measured = unproven or production
+        return min(measured)[1] if measured else None
+
+    def load(self, path: Path) -> bool:
+        """Restore latency and error rates saved by :meth:`save`
+
+        Returns:
+            True if a calibration file was read
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            return False
+
+        for provider_name, models in data.get("models", {}).items():
+            try:
+                provider = AIProvider(provider_name)
+            except ValueError:
+                continue
+            for name, stored in models.items():
+                info = self._entry(provider, name)
+                info.observed_latency = stored.get("observed_latency")
+                info.calibration_latency = stored.get("calibration_latency")
+                info.error_rate = stored.get("error_rate", 0.0)
+                info.samples = stored.get("samples", 0)
+        return True
+
+    def save(self, path: Path) -> Tuple[bool, str]:
+        """Write measured latency and error rates so they survive restarts
+
+        Returns:
+            (success, error_message)
+        """
+        data = {
+            "saved_at": time.time(),
+            "models": {
+                provider.value: {
+                    name: {
+                        "observed_latency": info.observed_latency,
+                        "calibration_latency": info.calibration_latency,
+                        "error_rate": info.error_rate,
+                        "samples": info.samples,
+                    }
+                    for name, info in models.items()
+                    if info.samples
+                }
+                for provider, models in self.models.items()
+            },
+        }
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename, so a crash never leaves a half-written file
+            temporary = path.with_suffix(".tmp")
+            with open(temporary, "w", encoding="utf-8") as handle:
+                json.dump(data, handle, indent=2)
+            os.replace(temporary, path)
+        except OSError as e:
+            return False, str(e)
+        return True, ""
+
+    def refresh_in_background(
+        self, provider: AIProvider, session: Optional[aiohttp.ClientSession] = None
+    ) -> "asyncio.Task[Tuple[bool, str]]":
+        """Start refreshing a provider's list unless a refresh is already running"""
+        task = self._refresh_tasks.get(provider)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self.refresh(provider, session))
+            self._refresh_tasks[provider] = task
+        return task
+
+    async def refresh(
+        self, provider: AIProvider, session: Optional[aiohttp.ClientSession] = None
+    ) -> Tuple[bool, str]:
+        """Fetch a provider's model list and replace the cached one
+
+        Returns:
+            (success, error_message)
+        """
+        if session is None:
+            async with aiohttp.ClientSession() as owned:
+                return await self.refresh(provider, owned)
+
+        try:
+            if provider == AIProvider.OPENROUTER:
+                fetched = await self._fetch_openrouter(session)
+            elif provider == AIProvider.OLLAMA:
+                fetched = await self._fetch_ollama(session)
+            else:
+                return False, f"No model list for provider {provider.value}"
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            error = str(e) or type(e).__name__
+            if provider not in self.fetched_at and provider == AIProvider.OPENROUTER:
+                # Nothing cached yet: fall back to the built-in models, retried after the TTL
+                self._store(provider, _builtin_openrouter_models())
+            self.errors[provider] = error
+            return False, error
+
+        self._store(provider, fetched)
+        self.errors.pop(provider, None)
+        return True, ""
+
+    def _store(self, provider: AIProvider, fetched: Dict[str, ModelInfo]):
+        """Replace a provider's list, keeping what was measured on its models"""
+        # Keep what was learned from real calls across refreshes, including
+        # measured models the provider lists under another name (e.g. Ollama tags)
+        self.listed[provider] = list(fetched)
+        for name, info in self.models.get(provider, {}).items():
+            if name not in fetched:
+                if info.samples:
+                    fetched[name] = info
+                continue
+            fetched[name].observed_latency = info.observed_latency
+            fetched[name].calibration_latency = info.calibration_latency
+            fetched[name].error_rate = info.error_rate
+            fetched[name].samples = info.samples
+        self.models[provider] = fetched
+        self.fetched_at[provider] = time.monotonic()
+
+    def _timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=self.config.timeout, sock_connect=self.config.connect_timeout)
+
+    async def _fetch_openrouter(self, session: aiohttp.ClientSession) -> Dict[str, ModelInfo]:
+        """OpenRouter's public model list, with the built-in models as a fallback"""
+        url = f"{self.config.openrouter_base_url}/models"
+        async with session.get(url, timeout=self._timeout()) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, (), status=response.status, message=f"HTTP {response.status}"
+                )
+            data = await response.json()
+
+        models = {
+            entry["id"]: ModelInfo(
+                name=entry["id"],
+                provider=AIProvider.OPENROUTER,
+                context_length=entry.get("context_length")
+            )
+            for entry in data.get("data", [])
+        }
+        for name, info in _builtin_openrouter_models().items():
+            models.setdefault(name, info)
+        return models
+
+    async def _fetch_ollama(self, session: aiohttp.ClientSession) -> Dict[str, ModelInfo]:
+        """Locally installed Ollama models, with context lengths looked up in parallel"""
+        url = f"{self.config.ollama_base_url}/api/tags"
+        async with session.get(url, timeout=self._timeout()) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, (), status=response.status, message=f"HTTP {response.status}"
+                )
+            data = await response.json()
+
+        models = {
+            entry["name"]: ModelInfo(name=entry["name"], provider=AIProvider.OLLAMA, size_bytes=entry.get("size"))
+            for entry in data.get("models", [])
+        }
+        lengths = await asyncio.gather(*(self._ollama_context_length(session, name) for name in models))
+        for info, context_length in zip(models.values(), lengths):
+            info.context_length = context_length
+        return models
+
+    async def _ollama_context_length(self, session: aiohttp.ClientSession, name: str) -> Optional[int]:
+        """Context length from /api/show; missing metadata is not an error"""
+        url = f"{self.config.ollama_base_url}/api/show"
+        try:
+            async with session.post(url, json={"model": name}, timeout=self._timeout()) as response:
+                if response.status != 200:
+                    return None
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+        for key, value in data.get("model_info", {}).items():
+            if key.endswith(".context_length"):
+                return int(value)
+        return None
+
+    def close(self):
+        """Cancel refreshes that are still running"""
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        self._refresh_tasks.clear()
+
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        status: Dict[str, Any] = {}
+        for provider in AIProvider:
+            if provider not in self.models and provider not in self.errors:
+                continue
+            fetched_at = self.fetched_at.get(provider)
+            status[provider.value] = {
+                "models": len(self.listed.get(provider, [])),
+                "age": round(time.monotonic() - fetched_at, 1) if fetched_at is not None else None,
+                "error": self.errors.get(provider),
+            }
+        return status
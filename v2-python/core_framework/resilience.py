@@ -0,0 +1,119 @@
+"""Failure isolation helpers for AI provider calls"""
+
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Deque, Dict
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclass
+class CircuitBreaker:
+    """Circuit breaker tracking the health of one provider
+
+    Closed: calls flow and outcomes are recorded in a sliding window. Once
+    at least ``minimum_calls`` outcomes exist and the share of failures (or
+    calls slower than ``slow_call_seconds``) reaches ``failure_rate_threshold``
+    the breaker opens. Open: calls are rejected until ``open_seconds`` have
+    passed. Half-open: a single trial call decides whether to close again.
+    """
+    failure_rate_threshold: float = 0.5
+    slow_call_seconds: float = 20.0
+    minimum_calls: int = 4
+    window_size: int = 20
+    open_seconds: float = 30.0
+    state: CircuitState = CircuitState.CLOSED
+    outcomes: Deque[bool] = field(default_factory=deque)
+    opened_at: float = 0.0
+    trial_in_flight: bool = False
+
+    def is_open(self) -> bool:
+        """Check if calls are currently rejected without side effects"""
+        if self.state == CircuitState.OPEN:
+            return self.open_remaining() > 0
+        return self.state == CircuitState.HALF_OPEN and self.trial_in_flight
+
+    def open_remaining(self) -> float:
+        """Seconds until an open breaker lets a trial call through"""
+        if self.state != CircuitState.OPEN:
+            return 0.0
+        return max(self.opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def allow_request(self) -> bool:
+        """Check if a call may proceed, claiming the trial slot when half-open"""
+        if self.state == CircuitState.OPEN:
+            if self.open_remaining() > 0:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self.trial_in_flight = False
+
+        if self.state == CircuitState.HALF_OPEN:
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+
+        return True
+
+    def release_trial(self):
+        """Give back a half-open trial slot that was never used"""
+        self.trial_in_flight = False
+
+    def record_success(self, latency: float = 0.0):
+        """Record a successful call"""
+        if latency > self.slow_call_seconds:
+            self.record_failure()
+            return
+
+        if self.state == CircuitState.HALF_OPEN:
+            self.close()
+            return
+        self._record(True)
+
+    def record_failure(self):
+        """Record a failed call"""
+        if self.state == CircuitState.HALF_OPEN:
+            self.trip()
+            return
+        self._record(False)
+
+    def _record(self, success: bool):
+        self.outcomes.append(success)
+        while len(self.outcomes) > self.window_size:
+            self.outcomes.popleft()
+
+        if len(self.outcomes) >= self.minimum_calls and self.failure_rate() >= self.failure_rate_threshold:
+            self.trip()
+
+    def failure_rate(self) -> float:
+        """Share of failed calls in the current window"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def trip(self):
+        """Open the breaker"""
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+        self.outcomes.clear()
+
+    def close(self):
+        """Close the breaker and start a fresh window"""
+        self.state = CircuitState.CLOSED
+        self.trial_in_flight = False
+        self.outcomes.clear()
+
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        return {
+            "state": self.state.value,
+            "failure_rate": round(self.failure_rate(), 3),
+            "recent_calls": len(self.outcomes),
+            "open_remaining": round(self.open_remaining(), 2),
+        }
@@ -0,0 +1,203 @@
+"""Priority-aware admission control for AI provider calls"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+
+class RequestPriority(IntEnum):
+    INTERACTIVE = 0  # a user is waiting on screen
+    BATCH = 1  # bulk runs such as whole-session pre-review
+    BACKGROUND = 2  # speculative prefetch
+
+
+class RequestScheduler:
+    """Bounded-concurrency scheduler with strict priority classes
+
+    At most ``max_concurrency`` calls run at once. Waiting calls are served
+    FIFO within a class, and a lower class never starts while a higher class
+    is queued. The last ``interactive_reserve`` slots are kept for
+    interactive calls, so background work can soak up spare capacity
+    without delaying a user.
+    """
+
+    def __init__(self, max_concurrency: int, interactive_reserve: int = 1):
+        self.max_concurrency = max_concurrency
+        self.interactive_reserve = interactive_reserve
+        self.active = 0
+        self.queues: Dict[RequestPriority, Deque[Tuple["asyncio.Future[None]", Any]]] = {
+            priority: deque() for priority in RequestPriority
+        }
+        self.wait_times: Dict[RequestPriority, Deque[float]] = {
+            priority: deque(maxlen=200) for priority in RequestPriority
+        }
+        # Class each waiter was finally admitted under, after any reprioritize
+        self._granted_priority: Dict["asyncio.Future[None]", RequestPriority] = {}
+
+    def _capacity_for(self, priority: RequestPriority) -> int:
+        """Concurrency a priority class may use"""
+        if priority == RequestPriority.INTERACTIVE:
+            return self.max_concurrency
+        return max(self.max_concurrency - self.interactive_reserve, 1)
+
+    def _queued_at_or_above(self, priority: RequestPriority) -> bool:
+        return any(self.queues[level] for level in RequestPriority if level <= priority)
+
+    @asynccontextmanager
+    async def slot(self, priority: RequestPriority, owner: Any = None) -> AsyncIterator[None]:
+        """Hold a concurrency slot for the duration of one provider call
+
+        ``owner`` identifies the waiting request so it can later be moved to
+        a higher class with :meth:`reprioritize`.
+        """
+        started = time.monotonic()
+        priority = await self._acquire(priority, owner)
+        self.wait_times[priority].append(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: RequestPriority, owner: Any) -> RequestPriority:
+        if self.active < self._capacity_for(priority) and not self._queued_at_or_above(priority):
+            self.active += 1
+            return priority
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self.queues[priority].append((waiter, owner))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self._granted_priority.pop(waiter, None)
+                self._release()
+            else:
+                self._discard(waiter)
+            raise
+
+        return self._granted_priority.pop(waiter, priority)
+
+    def _discard(self, waiter: "asyncio.Future[None]"):
+        for queue in self.queues.values():
+            for entry in queue:
+                if entry[0] is waiter:
+                    queue.remove(entry)
+                    return
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters, highest class first"""
+        for priority in RequestPriority:
+            queue = self.queues[priority]
+            while queue and self.active < self._capacity_for(priority):
+                waiter, _ = queue.popleft()
+                if waiter.done():
+                    continue
+                self.active += 1
+                self._granted_priority[waiter] = priority
+                waiter.set_result(None)
+            if queue:
+                # Strict priority: lower classes wait behind this one
+                return
+
+    def reprioritize(self, owner: Any, priority: RequestPriority):
+        """Move a waiting request to a higher class, e.g. when a user joins it"""
+        moved: List[Tuple["asyncio.Future[None]", Any]] = []
+        for level, queue in self.queues.items():
+            if level <= priority:
+                continue
+            for entry in [entry for entry in queue if entry[1] is owner]:
+                queue.remove(entry)
+                moved.append(entry)
+
+        if moved:
+            self.queues[priority].extend(moved)
+            self._dispatch()
+
+    def set_limit(self, max_concurrency: int):
+        """Change the concurrency limit and admit waiters if it grew"""
+        self.max_concurrency = max(max_concurrency, 1)
+        self._dispatch()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth and wait-time metrics per priority class"""
+        classes: Dict[str, Dict[str, Optional[float]]] = {}
+        for priority in RequestPriority:
+            waits = sorted(self.wait_times[priority])
+            classes[priority.name.lower()] = {
+                "queued": len(self.queues[priority]),
+                "wait_avg": round(sum(waits) / len(waits), 4) if waits else None,
+                "wait_p99": round(waits[min(int(0.99 * len(waits)), len(waits) - 1)], 4) if waits else None,
+            }
+        return {
+            "active": self.active,
+            "limit": self.max_concurrency,
+            "classes": classes,
+        }
+
+
+@dataclass
+class AdaptiveLimit:
+    """AIMD concurrency limit driven by how a provider responds
+
+    Each success while the limit is fully used adds ``1 / limit``, so the
+    limit grows by about one per round of calls. Throttling, server errors,
+    timeouts or a short-term latency average drifting above
+    ``latency_tolerance`` times the long-term one cut the limit by
+    ``backoff_ratio``, at most once per ``cooldown`` seconds so one burst of
+    failures counts as a single signal.
+    """
+    limit: float
+    min_limit: int = 1
+    max_limit: int = 32
+    backoff_ratio: float = 0.5
+    latency_tolerance: float = 2.0
+    cooldown: float = 1.0
+    short_latency: Optional[float] = None
+    long_latency: Optional[float] = None
+    last_decrease: float = 0.0
+    decreases: int = 0
+
+    @property
+    def current(self) -> int:
+        """Concurrency to enforce right now"""
+        return min(max(int(self.limit), self.min_limit), self.max_limit)
+
+    def on_success(self, latency: float, in_flight: int) -> int:
+        """Feed a successful call and return the new limit"""
+        self.short_latency = latency if self.short_latency is None else 0.7 * self.short_latency + 0.3 * latency
+        self.long_latency = latency if self.long_latency is None else 0.95 * self.long_latency + 0.05 * latency
+
+        if self.short_latency > self.long_latency * self.latency_tolerance:
+            # Queueing at the provider shows up as latency before it shows up as errors
+            return self.on_overload()
+
+        if in_flight >= self.current:
+            self.limit = min(self.limit + 1 / self.limit, float(self.max_limit))
+        return self.current
+
+    def on_overload(self) -> int:
+        """Back off after throttling, a server error or a timeout"""
+        now = time.monotonic()
+        if now - self.last_decrease >= self.cooldown:
+            self.limit = max(self.limit * self.backoff_ratio, float(self.min_limit))
+            self.last_decrease = now
+            self.decreases += 1
+        return self.current
+
+    def to_status(self) -> Dict[str, Any]:
+        """Summary for status reporting"""
+        return {
+            "limit": self.current,
+            "decreases": self.decreases,
+            "latency_short": round(self.short_latency, 3) if self.short_latency is not None else None,
+            "latency_long": round(self.long_latency, 3) if self.long_latency is not None else None,
+        }
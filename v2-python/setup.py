@@ -11,7 +11,12 @@ setup(
         "rich>=13.0.0",
         "pydantic>=2.0.0",
         "click>=8.0.0",
+        "aiohttp>=3.8.0",
     ],
+    extras_require={
+        # Vectorized similarity scoring for the semantic cache tier
+        "semantic": ["numpy>=1.20"],
+    },
     entry_points={
         "console_scripts": [
             "core-framework=core_framework.main:main",
@@ -2,11 +2,27 @@
 
 import pytest
 import asyncio
+import aiohttp
+import json
+import time
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime
 
-from core_framework.ai_handler import AIHandler, RateLimiter
-from core_framework.config import AIConfig, AIProvider, OpenRouterModel, OllamaModel, get_phase_prompt
+from core_framework.ai_handler import (
+    AIHandler, AIStreamError, ProviderError, RateLimiter, RequestContext, _parse_packed_answers, _parse_retry_after
+)
+from core_framework.answer_analyzer import analyze_answer, find_question
+from core_framework.cache import DiskCache, MemoryCache, SemanticCache
+from core_framework.connection_pool import close_shared_session, get_shared_session
+from core_framework.discovery import ProviderDiscovery, ProviderProbe
+from core_framework.model_catalog import ModelCatalog, ModelInfo
+from core_framework.resilience import CircuitBreaker, CircuitState
+from core_framework.scheduler import AdaptiveLimit, RequestPriority, RequestScheduler
+from core_framework.config import (
+    AIConfig, AIProvider, CacheBackend, OpenRouterModel, OllamaModel, QualityTier, PHASE_PROMPTS, PROMPT_TEMPLATES,
+    get_phase_prompt, get_prompt_template
+)
+from core_framework.models import PhaseType, QUESTIONS, QUESTIONS_BY_ID, QUESTIONS_BY_PHASE
 
 
 class TestRateLimiter:
@@ -36,8 +52,406 @@ class TestRateLimiter:
         assert not limiter.can_make_request()
         
         # Wait for window to pass (simulate by clearing old requests)
-        limiter.requests = []
+        limiter.requests.clear()
         assert limiter.can_make_request()
+    
+    def test_rate_limiter_reports_remaining_and_eta(self):
+        """Test remaining-capacity and next-slot reporting"""
+        limiter = RateLimiter(max_requests=2, window_seconds=60)
+        
+        assert limiter.remaining() == 2
+        assert limiter.next_slot_eta() == 0.0
+        
+        limiter.record_request()
+        limiter.record_request()
+        
+        assert limiter.remaining() == 0
+        assert 59 < limiter.next_slot_eta() <= 60
+    
+    @pytest.mark.asyncio
+    async def test_acquire_waits_for_free_slot(self):
+        """Test that acquire queues until the window frees a slot"""
+        limiter = RateLimiter(max_requests=1, window_seconds=0.05)
+        
+        assert await limiter.acquire(timeout=1)
+        assert await limiter.acquire(timeout=1)
+        assert len(limiter.requests) == 1
+    
+    @pytest.mark.asyncio
+    async def test_acquire_gives_up_when_slot_is_beyond_timeout(self):
+        """Test that acquire fails fast when waiting cannot help"""
+        limiter = RateLimiter(max_requests=1, window_seconds=60)
+        limiter.record_request()
+        
+        assert not await limiter.acquire(timeout=0.5)
+    
+    @pytest.mark.asyncio
+    async def test_release_returns_the_callers_own_reservation(self):
+        """Test that releasing an older reservation keeps the newer one in the window"""
+        limiter = RateLimiter(max_requests=2, window_seconds=60)
+        
+        first = await limiter.acquire(timeout=1)
+        second = await limiter.acquire(timeout=1)
+        limiter.release(first)
+        
+        assert list(limiter.requests) == [second]
+        limiter.release(first)  # a second release is a no-op
+        assert list(limiter.requests) == [second]
+    
+    @pytest.mark.asyncio
+    async def test_waiters_are_served_by_priority(self):
+        """Test that a later interactive caller takes the next slot before queued batch callers"""
+        limiter = RateLimiter(max_requests=1, window_seconds=0.05)
+        limiter.record_request()
+        order = []
+        
+        async def take(name, priority):
+            assert await limiter.acquire(timeout=5, priority=priority)
+            order.append(name)
+        
+        batch = [asyncio.ensure_future(take(f"b{i}", RequestPriority.BATCH)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        user = asyncio.ensure_future(take("user", RequestPriority.INTERACTIVE))
+        await asyncio.gather(user, *batch)
+        
+        assert order == ["user", "b0", "b1", "b2"]
+        assert limiter.waiters == []
+    
+    @pytest.mark.asyncio
+    async def test_reprioritize_and_timeout_leave_queue_consistent(self):
+        """Test that a promoted waiter goes first and a timed-out one leaves the queue"""
+        limiter = RateLimiter(max_requests=1, window_seconds=0.05)
+        limiter.record_request()
+        owner = object()
+        order = []
+        
+        async def take(name, priority, **kwargs):
+            if await limiter.acquire(priority=priority, **kwargs):
+                order.append(name)
+        
+        batch = asyncio.ensure_future(take("batch", RequestPriority.BATCH, timeout=5))
+        prefetch = asyncio.ensure_future(take("prefetch", RequestPriority.BACKGROUND, timeout=5, owner=owner))
+        impatient = asyncio.ensure_future(take("impatient", RequestPriority.BACKGROUND, timeout=0.01))
+        await asyncio.sleep(0)
+        limiter.reprioritize(owner, RequestPriority.INTERACTIVE)
+        await asyncio.gather(batch, prefetch, impatient)
+        
+        assert order == ["prefetch", "batch"]
+        assert limiter.waiters == []
+
+
+class TestResponseCache:
+    """Test response cache backends"""
+    
+    def test_memory_cache_expires_entries(self):
+        """Test that the memory cache honors its TTL"""
+        cache = MemoryCache(ttl=60, max_bytes=1024)
+        cache.set("key", "response")
+        assert cache.get("key") == "response"
+        
+        cache.entries["key"] = ("response", 0.0)
+        assert cache.get("key") is None
+        assert len(cache) == 0
+    
+    def test_memory_cache_evicts_least_recently_used(self):
+        """Test that the memory cache stays within its byte budget"""
+        cache = MemoryCache(ttl=60, max_bytes=30)
+        cache.set("a", "x" * 10)
+        cache.set("b", "y" * 10)
+        assert cache.get("a") == "x" * 10  # "b" is now least recently used
+        cache.set("c", "z" * 10)
+        
+        assert cache.get("b") is None
+        assert cache.get("a") == "x" * 10
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] <= 30
+    
+    def test_memory_cache_sweeps_expired_entries_on_write(self):
+        """Test that expired entries are dropped without being read"""
+        cache = MemoryCache(ttl=60, max_bytes=1024)
+        cache.set("stale", "response")
+        cache.entries["stale"] = ("response", 0.0)
+        cache._last_sweep = 0.0
+        
+        cache.set("fresh", "response")
+        
+        assert "stale" not in cache.entries
+        assert len(cache) == 1
+    
+    def test_disk_cache_persists_across_instances(self, tmp_path):
+        """Test that a second cache on the same file sees stored responses"""
+        path = tmp_path / "cache.sqlite3"
+        cache = DiskCache(path, ttl=60, max_bytes=1024)
+        cache.set("key", "persisted response")
+        cache.close()
+        
+        reopened = DiskCache(path, ttl=60, max_bytes=1024)
+        assert reopened.get("key") == "persisted response"
+        assert len(reopened) == 1
+    
+    def test_disk_cache_expires_entries(self, tmp_path):
+        """Test that the disk cache honors its TTL"""
+        cache = DiskCache(tmp_path / "cache.sqlite3", ttl=60, max_bytes=1024)
+        cache.set("key", "response")
+        cache.flush()
+        cache.conn.execute("UPDATE responses SET created_at = 0")
+        
+        assert cache.get("key") is None
+        assert len(cache) == 0
+    
+    def test_disk_cache_evicts_least_recently_used_over_budget(self, tmp_path):
+        """Test that the disk cache stays within its byte budget"""
+        cache = DiskCache(tmp_path / "cache.sqlite3", ttl=60, max_bytes=20)
+        cache.set("old", "x" * 10)
+        cache.set("new", "y" * 10)
+        cache.flush()
+        cache.conn.execute("UPDATE responses SET accessed_at = 0 WHERE key = 'old'")
+        cache.set("newest", "z" * 10)
+        cache.flush()
+        
+        assert cache.get("old") is None
+        assert cache.get("new") == "y" * 10
+        assert cache.get("newest") == "z" * 10
+    
+    def test_disk_cache_batches_access_times(self, tmp_path):
+        """Test that cache hits are served before their write lands and record access times later"""
+        cache = DiskCache(tmp_path / "cache.sqlite3", ttl=60, max_bytes=1024)
+        cache._writer.submit(time.sleep, 0.05)  # hold the writer thread
+        cache.set("key", "response")
+        assert cache.get("key") == "response"  # from memory until written
+        
+        cache.flush()
+        cache.conn.execute("UPDATE responses SET accessed_at = 0")
+        assert cache.get("key") == "response"
+        assert cache.conn.execute("SELECT accessed_at FROM responses").fetchone()[0] == 0
+        
+        cache.flush()
+        assert cache.conn.execute("SELECT accessed_at FROM responses").fetchone()[0] > 0
+        cache.close()
+    
+    @pytest.mark.asyncio
+    async def test_handler_closes_disk_cache(self, tmp_path):
+        """Test that leaving the handler writes out and closes the disk cache"""
+        config = AIConfig(
+            provider=AIProvider.OLLAMA,
+            cache_backend=CacheBackend.DISK,
+            cache_path=str(tmp_path / "cache.sqlite3")
+        )
+        async with AIHandler(config) as handler:
+            handler._cache_response("key", "response")
+        
+        assert handler.cache.closed
+        assert DiskCache(tmp_path / "cache.sqlite3", ttl=60, max_bytes=1024).get("key") == "response"
+    
+    def test_handler_uses_disk_backend(self, tmp_path):
+        """Test that the handler shares cached responses through the disk backend"""
+        config = AIConfig(
+            provider=AIProvider.OLLAMA,
+            cache_backend=CacheBackend.DISK,
+            cache_path=str(tmp_path / "cache.sqlite3")
+        )
+        prompt = {"system": "System prompt", "user": "prompt"}
+        first = AIHandler(config)
+        key = first._get_cache_key(prompt, AIProvider.OLLAMA)
+        first._cache_response(key, "shared response")
+        first.cache.flush()
+        
+        second = AIHandler(config)
+        assert second._get_cache_key(prompt, AIProvider.OLLAMA) == key
+        assert second._get_cached_response(key) == "shared response"
+        assert second.get_provider_status()["cache_backend"] == "disk"
+
+
+class TestSemanticCache:
+    """Test the near-duplicate cache tier"""
+    
+    ANSWER = "A mobile app that helps students plan their weekly study sessions and track progress."
+    
+    def test_lightly_edited_answer_matches(self):
+        """Test that a one-word edit finds the earlier guidance"""
+        cache = SemanticCache(threshold=0.95, ttl=3600)
+        cache.set("C-01", self.ANSWER, "Guidance")
+        
+        assert cache.get("C-01", self.ANSWER.replace("track progress", "track their progress")) == "Guidance"
+        assert cache.get("C-01", "A B2B dashboard for logistics companies to monitor fleet fuel usage.") is None
+        assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+    
+    def test_index_is_per_question(self):
+        """Test that the same answer to another question does not match"""
+        cache = SemanticCache(threshold=0.95, ttl=3600)
+        cache.set("C-01", self.ANSWER, "Guidance")
+        
+        assert cache.get("C-02", self.ANSWER) is None
+    
+    def test_short_answers_and_expired_entries_are_ignored(self):
+        """Test the minimum length and TTL"""
+        cache = SemanticCache(threshold=0.95, ttl=3600)
+        cache.set("C-01", "Yes", "Guidance")
+        assert cache.get("C-01", "Yes") is None
+        
+        cache.set("C-01", self.ANSWER, "Guidance")
+        cache.indexes["C-01"][2][0] = 0.0
+        assert cache.get("C-01", self.ANSWER) is None
+    
+    @pytest.mark.asyncio
+    async def test_handler_serves_similar_answer_and_reports_hits(self):
+        """Test that an edited answer reuses guidance without a provider call"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, enable_semantic_cache=True))
+        handler._call_ollama = AsyncMock(return_value=(True, "Guidance"))
+        question = QUESTIONS_BY_ID["C-01"].text
+        
+        await handler.get_ai_guidance("clarify", question, self.ANSWER)
+        success, response, _ = await handler.get_ai_guidance("clarify", question, self.ANSWER + " Soon.")
+        
+        assert success
+        assert response == "Guidance"
+        assert handler._call_ollama.call_count == 1
+        status = handler.get_provider_status()
+        assert status["semantic_cache_hits"] == 1
+        assert status["cache_hits"] == 0
+    
+    def test_disabled_by_default(self):
+        """Test that only exact matches are served unless enabled"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        
+        assert handler.semantic_cache is None
+        assert handler.get_provider_status()["semantic_cache_enabled"] is False
+
+
+class TestAnswerAnalyzer:
+    """Test the local pre-screen that answers common cases without the AI"""
+    
+    def test_length_problems_get_canned_guidance(self):
+        """Test empty, short and long answers"""
+        question = QUESTIONS_BY_ID["C-01"]
+        
+        assert analyze_answer(question, "   ").issues == ["empty"]
+        assert analyze_answer(question, "An app").issues == ["too_short"]
+        too_long = analyze_answer(question, "word " * 200)
+        assert too_long.issues == ["too_long"] and not too_long.needs_ai
+        assert str(question.max_length) in too_long.guidance
+    
+    def test_question_rules(self):
+        """Test the per-question metric and exclusion checks"""
+        success = analyze_answer(
+            QUESTIONS_BY_ID["C-02"],
+            "Students use the planner regularly and say it helps them stay on top of their courses."
+        )
+        assert success.issues == ["missing_metric"] and not success.needs_ai
+        
+        measured = analyze_answer(
+            QUESTIONS_BY_ID["C-02"],
+            "500 students plan their week in the app and 70% of them finish their planned sessions."
+        )
+        assert measured.issues == [] and measured.needs_ai  # a passing rule still needs the AI's judgement
+        
+        scope = analyze_answer(
+            QUESTIONS_BY_ID["C-05"],
+            "Only the study planner and the progress tracker for university students in Europe."
+        )
+        assert scope.issues == ["missing_exclusions"]
+    
+    def test_loose_tokens_do_not_pass_rules(self):
+        """Test that a stray digit or "not" is not taken for a metric or an exclusion"""
+        success = analyze_answer(
+            QUESTIONS_BY_ID["C-02"],
+            "Our users are happy with version 2 of the product and recommend it to their friends."
+        )
+        assert success.issues == ["missing_metric"]
+        
+        scope = analyze_answer(
+            QUESTIONS_BY_ID["C-05"],
+            "The planner covers everything a student needs, and it should not be slow on phones."
+        )
+        assert scope.issues == ["missing_exclusions"]
+        
+        for question_id, answer in (
+            ("C-05", "Group study features and teacher dashboards are out of scope for the first release."),
+            ("C-05", "We will not support payments or build a mobile app until the web version works."),
+            ("R-02", "About 10 hours per week, a budget of $200 and a first release by March 2025."),
+        ):
+            assert analyze_answer(QUESTIONS_BY_ID[question_id], answer).issues == []
+    
+    def test_answer_without_rules_needs_ai(self):
+        """Test that a plausible answer for a question without rules goes to the AI"""
+        unchecked = analyze_answer(
+            QUESTIONS_BY_ID["C-01"],
+            "A todo app. I have not decided who it is for or why anyone would use it yet."
+        )
+        
+        assert unchecked.needs_ai
+        assert unchecked.issues == []
+    
+    def test_vague_answer_needs_ai(self):
+        """Test that an answer full of vague words is escalated"""
+        assessment = analyze_answer(
+            QUESTIONS_BY_ID["C-01"],
+            "Basically some stuff to make things better and easier for everyone, maybe with various good features."
+        )
+        
+        assert assessment.needs_ai
+        assert assessment.issues == ["vague"]
+    
+    def test_find_question(self):
+        """Test question lookup by phase and text"""
+        question = QUESTIONS_BY_ID["C-02"]
+        
+        assert find_question("clarify", question.text) is question
+        assert find_question("organize", question.text) is None
+    
+    @pytest.mark.asyncio
+    async def test_handler_answers_locally_then_escalates(self):
+        """Test canned guidance without a provider call, and escalation on a second ask"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, enable_answer_prescreen=True))
+        handler._call_ollama = AsyncMock(return_value=(True, "AI guidance"))
+        question = QUESTIONS_BY_ID["C-01"]
+        
+        success, response, conversation = await handler.get_ai_guidance(
+            "clarify", question.text, "An app", conversation_id=question.id
+        )
+        assert success
+        assert str(question.min_length) in response
+        assert conversation.messages[-1].model == "local"
+        handler._call_ollama.assert_not_called()
+        
+        success, response, _ = await handler.get_ai_guidance(
+            "clarify", question.text, "An app", conversation_id=question.id
+        )
+        assert response == "AI guidance"
+        assert handler._call_ollama.call_count == 1
+        assert handler.get_provider_status()["prescreen"] == {"answered": 1, "escalated": 0, "enabled": True}
+    
+    @pytest.mark.asyncio
+    async def test_vague_answer_and_disabled_prescreen_reach_provider(self):
+        """Test that vague answers escalate and the pre-screen is off by default"""
+        vague = "Basically some stuff to make things better and easier for everyone, maybe with various good features."
+        question = QUESTIONS_BY_ID["C-01"].text
+        
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, enable_answer_prescreen=True))
+        handler._call_ollama = AsyncMock(return_value=(True, "AI guidance"))
+        _, response, _ = await handler.get_ai_guidance("clarify", question, vague)
+        assert response == "AI guidance"
+        assert handler.prescreen_stats["escalated"] == 1
+        
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(return_value=(True, "AI guidance"))
+        _, response, _ = await handler.get_ai_guidance("clarify", question, "")
+        assert response == "AI guidance"
+    
+    @pytest.mark.asyncio
+    async def test_prefetch_skips_locally_answered_questions(self):
+        """Test that prefetch spends no provider call on an answer the pre-screen handles"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, enable_answer_prescreen=True))
+        handler._call_ollama = AsyncMock(return_value=(True, "AI guidance"))
+        question = QUESTIONS_BY_ID["C-01"].text
+        
+        assert await handler.prefetch_guidance("clarify", question, "")
+        handler._call_ollama.assert_not_called()
+        
+        assert await handler.prefetch_guidance(
+            "clarify", question, "A todo app. I have not decided who it is for or why anyone would use it yet."
+        )
+        assert handler._call_ollama.call_count == 1
 
 
 class TestAIConfig:
@@ -54,7 +468,6 @@ class TestAIConfig:
         assert config.enable_cache == True
     
     @patch.dict('os.environ', {'OPENROUTER_API_KEY': 'test-key'})
-    @patch('core_framework.config.check_ollama_availability', return_value=True)
     def test_config_loading_with_env_vars(self):
         """Test loading configuration from environment variables"""
         from core_framework.config import load_config
@@ -64,6 +477,7 @@ class TestAIConfig:
         assert config.provider == AIProvider.OPENROUTER
         assert config.fallback_provider == AIProvider.OLLAMA
         assert config.openrouter_api_key == 'test-key'
+        assert config.discover_providers
     
     def test_phase_prompt_generation(self):
         """Test phase-specific prompt generation"""
@@ -99,17 +513,30 @@ class TestAIHandler:
         """Test AI handler initialization"""
         assert ai_handler.config.provider == AIProvider.OPENROUTER
         assert ai_handler.rate_limiter.max_requests == 10
-        assert ai_handler.cache == {}
+        assert len(ai_handler.cache) == 0
     
     def test_cache_key_generation(self, ai_handler):
         """Test cache key generation"""
-        key1 = ai_handler._get_cache_key("test prompt", "model1")
-        key2 = ai_handler._get_cache_key("test prompt", "model2")
-        key3 = ai_handler._get_cache_key("different prompt", "model1")
+        prompt = {"system": "System prompt", "user": "test prompt"}
+        key = ai_handler._get_cache_key(prompt, AIProvider.OPENROUTER)
+        
+        assert key == ai_handler._get_cache_key(dict(prompt), AIProvider.OPENROUTER)  # Same inputs
+        assert key != ai_handler._get_cache_key(prompt, AIProvider.OLLAMA)  # Different providers
+        assert key != ai_handler._get_cache_key({**prompt, "user": "different prompt"}, AIProvider.OPENROUTER)
+        assert key != ai_handler._get_cache_key({**prompt, "system": "Other system"}, AIProvider.OPENROUTER)
+    
+    def test_cache_key_covers_model_and_sampling(self, mock_config):
+        """Test that model and sampling parameters are part of the cache key"""
+        prompt = {"system": "System prompt", "user": "test prompt"}
+        key = AIHandler(mock_config)._get_cache_key(prompt, AIProvider.OPENROUTER)
         
-        assert key1 != key2  # Different models
-        assert key1 != key3  # Different prompts
-        assert key1 == ai_handler._get_cache_key("test prompt", "model1")  # Same inputs
+        for change in (
+            {"openrouter_model": OpenRouterModel.GPT4O},
+            {"temperature": 0.2},
+            {"max_tokens": 200},
+        ):
+            other = AIHandler(mock_config.model_copy(update=change))
+            assert other._get_cache_key(prompt, AIProvider.OPENROUTER) != key
     
     def test_cache_operations(self, ai_handler):
         """Test cache storage and retrieval"""
@@ -135,6 +562,9 @@ class TestAIHandler:
         assert "rate_limit_remaining" in status
         assert "cache_enabled" in status
         assert "cached_responses" in status
+        assert "cache_hits" in status
+        assert "cache_misses" in status
+        assert "cache_evictions" in status
         
         assert status["primary_provider"] == "openrouter"
         assert status["openrouter_configured"] == True
@@ -169,6 +599,37 @@ class TestAIHandler:
         assert "Rate limit exceeded" in response
         assert conversation is None
     
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_rate_limits_are_per_provider(self, mock_post):
+        """Test that an exhausted remote quota does not throttle the local fallback"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            fallback_provider=AIProvider.OLLAMA,
+            openrouter_api_key="test-key",
+            max_requests_per_minute=1,
+            ollama_warmup=False
+        ))
+        handler.rate_limiters[AIProvider.OPENROUTER].record_request()
+        
+        mock_response = AsyncMock(status=200)
+        mock_response.json.return_value = {"message": {"role": "assistant", "content": "Local response"}}
+        mock_post.return_value.__aenter__.return_value = mock_response
+        
+        async with handler:
+            success, response, _ = await handler.get_ai_guidance(
+                "clarify", "Test question", "Test answer"
+            )
+        
+        assert success
+        assert response == "Local response"
+        assert mock_post.call_args.args[0].startswith(handler.config.ollama_base_url)
+        
+        status = handler.get_provider_status()
+        assert status["rate_limits"]["openrouter"]["remaining"] == 0
+        assert status["rate_limits"]["openrouter"]["next_slot_eta"] > 0
+        assert status["rate_limits"]["ollama"]["remaining"] == 59
+    
     @pytest.mark.asyncio
     @patch('aiohttp.ClientSession.post')
     async def test_openrouter_api_call_success(self, mock_post, ai_handler):
@@ -222,7 +683,7 @@ class TestAIHandler:
         # Mock successful API response
         mock_response = AsyncMock()
         mock_response.status = 200
-        mock_response.json.return_value = {"response": "Ollama guidance response"}
+        mock_response.json.return_value = {"message": {"role": "assistant", "content": "Ollama guidance response"}}
         mock_post.return_value.__aenter__.return_value = mock_response
         
         async with handler:
@@ -238,7 +699,7 @@ class TestAIHandler:
     @patch('aiohttp.ClientSession.post')
     async def test_ollama_connection_error(self, mock_post):
         """Test Ollama connection error"""
-        config = AIConfig(provider=AIProvider.OLLAMA)
+        config = AIConfig(provider=AIProvider.OLLAMA, ollama_base_url="http://gpu-box:11434")
         handler = AIHandler(config)
         
         # Mock connection error
@@ -253,12 +714,14 @@ class TestAIHandler:
         
         assert not success
         assert "Cannot connect to Ollama" in response
+        assert "http://gpu-box:11434" in response
     
     @pytest.mark.asyncio
     async def test_get_ai_guidance_with_cache(self, ai_handler):
         """Test AI guidance with caching"""
         # Pre-populate cache
-        cache_key = ai_handler._get_cache_key("Test user prompt", str(ai_handler.config.provider))
+        prompt_data = get_phase_prompt("clarify", "Test question", "Test answer")
+        cache_key = ai_handler._get_cache_key(prompt_data, ai_handler.config.provider)
         ai_handler._cache_response(cache_key, "Cached response")
         
         success, response, conversation = await ai_handler.get_ai_guidance(
@@ -276,16 +739,18 @@ class TestAIHandler:
         config = AIConfig(
             provider=AIProvider.OPENROUTER,
             fallback_provider=AIProvider.OLLAMA,
-            openrouter_api_key="test-key"
+            openrouter_api_key="test-key",
+            retry_delay=0.01,
+            ollama_warmup=False
         )
         handler = AIHandler(config)
         
-        # Mock OpenRouter failure, then Ollama success
+        # Mock OpenRouter failing every retry, then Ollama success
         responses = [
-            # OpenRouter failure
-            AsyncMock(status=500, text=AsyncMock(return_value="Server error")),
+            # OpenRouter failures
+            *[AsyncMock(status=500, text=AsyncMock(return_value="Server error"), headers={}) for _ in range(3)],
             # Ollama success
-            AsyncMock(status=200, json=AsyncMock(return_value={"response": "Fallback response"}))
+            AsyncMock(status=200, json=AsyncMock(return_value={"message": {"role": "assistant", "content": "Fallback response"}}))
         ]
         
         mock_post.return_value.__aenter__.side_effect = responses
@@ -301,6 +766,1725 @@ class TestAIHandler:
         assert conversation.messages[1].model == "ollama"  # Used fallback provider
 
 
+class TestOllamaChat:
+    """Test the Ollama chat endpoint, keep-alive and warm-up"""
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_chat_endpoint_pins_model(self, mock_post):
+        """Test that calls go to /api/chat with keep_alive set"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, ollama_keep_alive="1h", ollama_warmup=False))
+        mock_post.return_value.__aenter__.return_value = AsyncMock(
+            status=200, json=AsyncMock(return_value={"message": {"role": "assistant", "content": "Reply"}})
+        )
+        
+        async with handler:
+            success, response = await handler._call_ollama({"system": "System", "user": "User"})
+        
+        assert success
+        assert response == "Reply"
+        assert mock_post.call_args.args[0].endswith("/api/chat")
+        payload = mock_post.call_args.kwargs["json"]
+        assert payload["keep_alive"] == "1h"
+        assert payload["messages"] == [
+            {"role": "system", "content": "System"},
+            {"role": "user", "content": "User"},
+        ]
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_entering_handler_warms_up_model(self, mock_post):
+        """Test that __aenter__ loads the Ollama model in the background"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        mock_post.return_value.__aenter__.return_value = AsyncMock(status=200)
+        
+        async with handler:
+            assert await handler._warmup_task
+        
+        payload = mock_post.call_args.kwargs["json"]
+        assert payload["messages"] == []
+        assert payload["keep_alive"] == handler.config.ollama_keep_alive
+        assert handler._warmup_task is None
+    
+    @pytest.mark.asyncio
+    async def test_no_warm_up_without_ollama(self):
+        """Test that a remote-only handler never contacts Ollama"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        
+        async with handler:
+            assert handler._warmup_task is None
+    
+    @pytest.mark.asyncio
+    async def test_follow_up_keeps_a_stable_message_prefix(self):
+        """Test that each turn resends earlier messages unchanged so Ollama can reuse its KV cache"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(side_effect=[(True, "First reply"), (True, "Second reply")])
+        
+        await handler.get_ai_guidance("clarify", "Test question", conversation_id="C-01")
+        await handler.ask_follow_up("C-01", "And then?")
+        
+        first, second = [handler._ollama_payload(call.args[0])["messages"] for call in handler._call_ollama.call_args_list]
+        assert second[:len(first)] == first
+
+
+class TestPromptTemplates:
+    """Test the per-question prompt template registry"""
+    
+    def test_every_question_has_a_template(self):
+        """Test that templates are compiled for all questions at import"""
+        assert set(PROMPT_TEMPLATES) == {question.id for question in QUESTIONS}
+    
+    def test_known_question_uses_its_ai_prompt(self):
+        """Test that a question's own ai_prompt replaces generic guidance"""
+        question = QUESTIONS_BY_ID["C-01"]
+        
+        prompt = get_phase_prompt("clarify", question.text, "  An app  ")
+        
+        assert prompt["user"].startswith(question.ai_prompt)
+        assert prompt["user"].endswith("Current answer: An app")
+    
+    def test_phase_questions_share_one_system_prompt(self):
+        """Test that every question in a phase renders the same prefix object"""
+        first, second = QUESTIONS_BY_PHASE[PhaseType.ORGANIZE][:2]
+        
+        assert get_phase_prompt("organize", first.text)["system"] is get_phase_prompt("organize", second.text)["system"]
+    
+    def test_unknown_question_gets_generic_template(self):
+        """Test the phase fallback for free-form questions"""
+        template = get_prompt_template("refine", "Something custom?")
+        
+        assert template.key == "refine"
+        assert template.render()["user"] == "Question: Something custom?\n\nCurrent answer: Not answered yet"
+        assert get_prompt_template("unknown", "Something custom?").key == "clarify"
+
+
+class TestPromptCaching:
+    """Test provider-side prompt caching of the stable prefix"""
+    
+    def test_stable_prefix_comes_first(self):
+        """Test that phase instructions sit in the system prompt and the answer comes last"""
+        first = get_phase_prompt("clarify", "What is your project about?", "An app")
+        second = get_phase_prompt("clarify", "Who are your users?", "Students")
+        
+        assert first["system"] == second["system"]
+        assert PHASE_PROMPTS["clarify"]["guidance"] in first["system"]
+        assert first["user"].endswith("Current answer: An app")
+    
+    def test_anthropic_payload_marks_system_and_history(self):
+        """Test cache_control breakpoints on the system prompt and the last earlier turn"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_model=OpenRouterModel.CLAUDE_HAIKU))
+        prompt_data = {
+            "system": "System",
+            "user": "Now",
+            "history": [{"role": "user", "content": "Before"}, {"role": "assistant", "content": "Reply"}],
+        }
+        
+        messages = handler._openrouter_payload(prompt_data)["messages"]
+        
+        assert messages[0]["content"] == [{"type": "text", "text": "System", "cache_control": {"type": "ephemeral"}}]
+        assert messages[1]["content"] == "Before"
+        assert messages[2]["content"][0]["cache_control"] == {"type": "ephemeral"}
+        assert messages[3]["content"] == "Now"
+        assert prompt_data["history"][1]["content"] == "Reply"  # prompt data left untouched
+    
+    def test_models_without_cache_control_get_plain_messages(self):
+        """Test that markers are only sent to models that honor them"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_model=OpenRouterModel.GPT4O))
+        
+        messages = handler._openrouter_payload({"system": "System", "user": "Now"})["messages"]
+        
+        assert all(isinstance(message["content"], str) for message in messages)
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_cached_token_usage_is_recorded(self, mock_post):
+        """Test that per-request cached prompt tokens are reported in status"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        mock_post.return_value.__aenter__.return_value = AsyncMock(status=200, json=AsyncMock(return_value={
+            "choices": [{"message": {"content": "Reply"}}],
+            "usage": {"prompt_tokens": 1200, "completion_tokens": 80, "prompt_tokens_details": {"cached_tokens": 1000}},
+        }))
+        
+        async with handler:
+            await handler._call_openrouter({"system": "System", "user": "User"})
+        
+        stats = handler.provider_stats[AIProvider.OPENROUTER]
+        assert list(stats.usage) == [{"prompt_tokens": 1200, "cached_tokens": 1000, "completion_tokens": 80}]
+        status = handler.get_provider_status()["providers"]["openrouter"]
+        assert status["cached_tokens"] == 1000
+        assert status["cached_token_ratio"] == 0.833
+
+
+class TestProviderRouting:
+    """Test per-request provider routing"""
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_concurrent_fallback_does_not_reroute_other_requests(self, mock_post):
+        """Test that one request falling back leaves concurrent requests on the primary"""
+        config = AIConfig(
+            provider=AIProvider.OPENROUTER,
+            fallback_provider=AIProvider.OLLAMA,
+            openrouter_api_key="test-key",
+            retry_delay=0.01,
+            ollama_warmup=False
+        )
+        handler = AIHandler(config)
+        
+        def route(url, **kwargs):
+            if url.startswith(config.ollama_base_url):
+                response = AsyncMock(status=200)
+                response.json.return_value = {"message": {"role": "assistant", "content": "Local response"}}
+            elif "Failing question" in kwargs["json"]["messages"][1]["content"]:
+                response = AsyncMock(status=500, text=AsyncMock(return_value="Server error"), headers={})
+            else:
+                response = AsyncMock(status=200)
+                response.json.return_value = {"choices": [{"message": {"content": "Remote response"}}]}
+            
+            async def slow_enter(*args):
+                await asyncio.sleep(0.01)
+                return response
+            
+            context = MagicMock()
+            context.__aenter__ = AsyncMock(side_effect=slow_enter)
+            context.__aexit__ = AsyncMock(return_value=False)
+            return context
+        
+        mock_post.side_effect = route
+        
+        async with handler:
+            failing, healthy = await asyncio.gather(
+                handler.get_ai_guidance("clarify", "Failing question", "Answer"),
+                handler.get_ai_guidance("clarify", "Healthy question", "Answer"),
+            )
+        
+        assert failing[1] == "Local response"
+        assert failing[2].messages[1].model == "ollama"
+        assert healthy[1] == "Remote response"
+        assert healthy[2].messages[1].model == "openrouter"
+        assert config.provider == AIProvider.OPENROUTER
+        
+        status = handler.get_provider_status()["providers"]
+        # The failing question used every retry before falling back
+        assert status["openrouter"]["attempts"] == 4
+        assert status["openrouter"]["failures"] == 3
+        assert status["ollama"]["successes"] == 1
+
+
+class TestProviderDiscovery:
+    """Test background provider discovery"""
+    
+    @patch.dict('os.environ', {}, clear=True)
+    @patch('aiohttp.ClientSession.get')
+    def test_load_config_does_not_probe(self, mock_get):
+        """Test that loading config makes no network calls"""
+        from core_framework.config import load_config
+        
+        config = load_config()
+        
+        assert config.provider == AIProvider.OLLAMA
+        assert config.fallback_provider == AIProvider.DISABLED
+        mock_get.assert_not_called()
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.get')
+    async def test_probes_configured_endpoints(self, mock_get):
+        """Test that each configured endpoint is probed at its own URL"""
+        config = AIConfig(openrouter_api_key="test-key", ollama_base_url="http://gpu-box:11434")
+        discovery = ProviderDiscovery(config)
+        
+        def probe(url, **kwargs):
+            if url.startswith("http://gpu-box:11434"):
+                raise aiohttp.ClientConnectionError("Connection refused")
+            context = MagicMock()
+            context.__aenter__ = AsyncMock(return_value=AsyncMock(status=200))
+            context.__aexit__ = AsyncMock(return_value=False)
+            return context
+        
+        mock_get.side_effect = probe
+        
+        async with aiohttp.ClientSession() as session:
+            await discovery.refresh(session)
+        
+        assert discovery.is_available(AIProvider.OPENROUTER) is True
+        assert discovery.is_available(AIProvider.OLLAMA) is False
+        assert discovery.results[AIProvider.OLLAMA].error == "Connection refused"
+        assert mock_get.call_args_list[1][0][0] == "http://gpu-box:11434/api/tags"
+    
+    @pytest.mark.asyncio
+    async def test_probes_run_in_parallel(self):
+        """Test that a slow provider does not delay the others"""
+        discovery = ProviderDiscovery(AIConfig(openrouter_api_key="test-key"))
+        
+        async def slow_probe(session, provider):
+            await asyncio.sleep(0.1)
+            return ProviderProbe(True, time.monotonic())
+        
+        discovery._probe = slow_probe
+        started = time.monotonic()
+        await discovery.refresh(MagicMock())
+        
+        assert time.monotonic() - started < 0.18
+        assert set(discovery.results) == {AIProvider.OPENROUTER, AIProvider.OLLAMA}
+    
+    @pytest.mark.asyncio
+    async def test_routing_skips_unreachable_provider(self):
+        """Test that routing skips a provider found down and refreshes stale results"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA,
+            fallback_provider=AIProvider.OPENROUTER,
+            openrouter_api_key="test-key",
+            discover_providers=True,
+            discovery_ttl=60.0
+        ))
+        handler.discovery.refresh_in_background = MagicMock()
+        handler.session = MagicMock()
+        now = time.monotonic()
+        handler.discovery.results = {
+            AIProvider.OLLAMA: ProviderProbe(False, now, error="Connection refused"),
+            AIProvider.OPENROUTER: ProviderProbe(True, now),
+        }
+        
+        assert handler._route() == [AIProvider.OPENROUTER]
+        handler.discovery.refresh_in_background.assert_not_called()
+        assert handler.get_provider_status()["ollama_available"] is False
+        
+        # Nothing reachable: no route, and no call to a provider known to be down
+        handler.discovery.results[AIProvider.OPENROUTER] = ProviderProbe(False, now - 120)
+        assert handler._route() == []
+        handler.discovery.refresh_in_background.assert_called_once_with(handler.session)
+        
+        handler._call_ollama = AsyncMock(return_value=(True, "unused"))
+        handler._call_openrouter = AsyncMock(return_value=(True, "unused"))
+        success, message, _ = await handler.get_ai_guidance("conv", "assessment", "Question?", "Answer")
+        
+        assert not success
+        assert "not configured" in message
+        handler._call_ollama.assert_not_called()
+        handler._call_openrouter.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_refresh_providers_joins_running_probe(self):
+        """Test that an explicit refresh and the first request share one round of probes"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, discover_providers=True))
+        probes = []
+        
+        async def down(session, provider):
+            probes.append(provider)
+            await asyncio.sleep(0.01)
+            return ProviderProbe(False, time.monotonic(), error="timed out")
+        
+        handler.discovery._probe = down
+        handler.session = MagicMock()
+        handler._call_ollama = AsyncMock(return_value=(True, "unused"))
+        
+        status, (success, _, _) = await asyncio.gather(
+            handler.refresh_providers(),
+            handler.get_ai_guidance("conv", "assessment", "Question?", "Answer")
+        )
+        
+        assert status == {"ollama": False}
+        assert not success
+        assert probes == [AIProvider.OLLAMA]
+    
+    @pytest.mark.asyncio
+    async def test_first_request_waits_for_discovery(self):
+        """Test that the first request does not go to a provider the first probe finds down"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, discover_providers=True))
+        
+        async def down(session, provider):
+            await asyncio.sleep(0.01)
+            return ProviderProbe(False, time.monotonic(), error="timed out")
+        
+        handler.discovery._probe = down
+        handler.session = MagicMock()
+        handler._call_ollama = AsyncMock(return_value=(True, "unused"))
+        
+        success, message, _ = await handler.get_ai_guidance("conv", "assessment", "Question?", "Answer")
+        
+        assert not success
+        assert "not configured" in message
+        handler._call_ollama.assert_not_called()
+    
+    def test_explicit_config_routes_without_discovery(self):
+        """Test that discovery is off unless requested"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler.discovery.results[AIProvider.OLLAMA] = ProviderProbe(False, time.monotonic())
+        
+        assert handler._route() == [AIProvider.OLLAMA]
+
+
+class TestModelCatalog:
+    """Test the cached model catalog"""
+    
+    @staticmethod
+    def _response(data, status=200):
+        response = AsyncMock(status=status)
+        response.json.return_value = data
+        context = MagicMock()
+        context.__aenter__ = AsyncMock(return_value=response)
+        context.__aexit__ = AsyncMock(return_value=False)
+        return context
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    @patch('aiohttp.ClientSession.get')
+    async def test_ollama_models_fetched_once_with_metadata(self, mock_get, mock_post):
+        """Test that the list is served from memory with context lengths"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, ollama_warmup=False))
+        mock_get.side_effect = lambda url, **kwargs: self._response(
+            {"models": [{"name": "llama3:latest", "size": 4661224676}, {"name": "mistral:latest", "size": 4109865159}]}
+        )
+        mock_post.side_effect = lambda url, **kwargs: self._response(
+            {"model_info": {"general.architecture": "llama", "llama.context_length": 8192}}
+        )
+        
+        async with handler:
+            first = await handler.list_available_models()
+            second = await handler.list_available_models()
+        
+        assert first == second == (True, ["llama3:latest", "mistral:latest"])
+        assert mock_get.call_count == 1
+        assert mock_post.call_count == 2
+        info = handler.get_model_info("llama3:latest")
+        assert info.context_length == 8192
+        assert info.size_bytes == 4661224676
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.get')
+    async def test_openrouter_models_include_context_length(self, mock_get):
+        """Test that OpenRouter's list is fetched and the built-in models are kept"""
+        catalog = ModelCatalog(AIConfig())
+        mock_get.return_value = self._response(
+            {"data": [{"id": "anthropic/claude-3-haiku", "context_length": 200000}]}
+        )
+        
+        async with aiohttp.ClientSession() as session:
+            success, models = await catalog.list_models(AIProvider.OPENROUTER, session)
+        
+        assert success
+        assert catalog.get(AIProvider.OPENROUTER, "anthropic/claude-3-haiku").context_length == 200000
+        assert {model.name for model in models} >= {model.value for model in OpenRouterModel}
+    
+    @pytest.mark.asyncio
+    async def test_stale_list_is_served_while_refreshing(self):
+        """Test that a stale list is returned at once and refreshed in the background"""
+        catalog = ModelCatalog(AIConfig(model_catalog_ttl=60.0))
+        fetches = []
+        
+        async def fetch(session):
+            fetches.append(time.monotonic())
+            return {f"model-{len(fetches)}": ModelInfo(name=f"model-{len(fetches)}", provider=AIProvider.OLLAMA)}
+        
+        catalog._fetch_ollama = fetch
+        await catalog.list_models(AIProvider.OLLAMA, MagicMock())
+        catalog.record_latency(AIProvider.OLLAMA, "model-1", 0.5)
+        catalog.fetched_at[AIProvider.OLLAMA] -= 120
+        
+        success, models = await catalog.list_models(AIProvider.OLLAMA, MagicMock())
+        assert [model.name for model in models] == ["model-1"]
+        
+        await catalog._refresh_tasks[AIProvider.OLLAMA]
+        assert len(fetches) == 2
+        assert catalog.get(AIProvider.OLLAMA, "model-2") is not None
+        assert not catalog.is_stale(AIProvider.OLLAMA)
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.get')
+    async def test_fetch_errors_are_reported(self, mock_get):
+        """Test that a failed fetch returns no models and records the error"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, ollama_warmup=False))
+        mock_get.side_effect = aiohttp.ClientConnectionError("Connection refused")
+        
+        async with handler:
+            assert await handler.list_available_models() == (False, [])
+        
+        assert handler.get_provider_status()["model_catalog"]["ollama"]["error"] == "Connection refused"
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.get')
+    async def test_openrouter_falls_back_to_builtin_models(self, mock_get):
+        """Test that a failed first OpenRouter fetch still lists the built-in models"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        mock_get.side_effect = aiohttp.ClientConnectionError("Connection refused")
+        
+        async with handler:
+            success, models = await handler.list_available_models()
+            assert success and models == [model.value for model in OpenRouterModel]
+            assert await handler.list_available_models() == (success, models)
+        
+        assert mock_get.call_count == 1
+        assert handler.get_provider_status()["model_catalog"]["openrouter"]["error"] == "Connection refused"
+    
+    @pytest.mark.asyncio
+    async def test_observed_latency_is_recorded(self):
+        """Test that successful calls update the serving model's latency"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(return_value=(True, "Guidance"))
+        
+        await handler.get_ai_guidance("clarify", "What is your project about?", "An app")
+        
+        info = handler.get_model_info(handler.config.ollama_model.value)
+        assert info is not None and info.observed_latency is not None
+
+
+class TestModelSelection:
+    """Test latency-aware automatic model selection"""
+    
+    @staticmethod
+    def _measure(catalog, provider, latencies):
+        for name, latency in latencies.items():
+            catalog.record_latency(provider, name, latency)
+    
+    def test_fastest_model_meeting_tier_wins(self):
+        """Test that selection respects the quality tier and error rate"""
+        catalog = ModelCatalog(AIConfig())
+        self._measure(catalog, AIProvider.OPENROUTER, {
+            OpenRouterModel.CLAUDE_HAIKU.value: 0.8,
+            OpenRouterModel.GPT4O.value: 1.5,
+            OpenRouterModel.CLAUDE_SONNET.value: 2.5,
+        })
+        
+        assert catalog.select_model(AIProvider.OPENROUTER, QualityTier.STANDARD, 0.25) == OpenRouterModel.CLAUDE_HAIKU.value
+        assert catalog.select_model(AIProvider.OPENROUTER, QualityTier.ADVANCED, 0.25) == OpenRouterModel.GPT4O.value
+        
+        for _ in range(3):
+            catalog.record_error(AIProvider.OPENROUTER, OpenRouterModel.GPT4O.value)
+        assert catalog.select_model(AIProvider.OPENROUTER, QualityTier.ADVANCED, 0.25) == OpenRouterModel.CLAUDE_SONNET.value
+        assert catalog.select_model(AIProvider.OLLAMA, QualityTier.FAST, 0.25) is None
+    
+    def test_calibration_and_production_latency_are_not_mixed(self):
+        """Test that selection settles on the model fastest in production, whatever calibration said"""
+        catalog = ModelCatalog(AIConfig())
+        haiku, sonnet = OpenRouterModel.CLAUDE_HAIKU.value, OpenRouterModel.CLAUDE_SONNET.value
+        catalog.record_latency(AIProvider.OPENROUTER, haiku, 0.5, calibration=True)
+        catalog.record_latency(AIProvider.OPENROUTER, sonnet, 0.2, calibration=True)
+        production = {haiku: 4.0, sonnet: 6.0}
+        
+        choices = []
+        for _ in range(8):
+            choice = catalog.select_model(AIProvider.OPENROUTER, QualityTier.STANDARD, 0.25)
+            choices.append(choice)
+            catalog.record_latency(AIProvider.OPENROUTER, choice, production[choice])
+        
+        # Each calibrated model is tried once, then the faster one in production keeps the traffic
+        assert choices == [sonnet, haiku] + [haiku] * 6
+        assert catalog.get(AIProvider.OPENROUTER, sonnet).calibration_latency == 0.2
+    
+    def test_phases_route_to_their_tier(self, tmp_path):
+        """Test that each phase gets the fastest model for its tier"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            openrouter_api_key="test-key",
+            auto_select_model=True,
+            phase_quality_tiers={"equip": QualityTier.ADVANCED},
+            model_calibration_path=str(tmp_path / "calibration.json")
+        ))
+        self._measure(handler.model_catalog, AIProvider.OPENROUTER, {
+            OpenRouterModel.CLAUDE_HAIKU.value: 0.8,
+            OpenRouterModel.GPT4O.value: 1.5,
+        })
+        
+        clarify = handler._phase_prompt("clarify", "What is your project about?", "An app")
+        equip = handler._phase_prompt("equip", "What is your first step?", "Set up the repo")
+        
+        assert handler._openrouter_payload(clarify)["model"] == OpenRouterModel.CLAUDE_HAIKU.value
+        assert handler._openrouter_payload(equip)["model"] == OpenRouterModel.GPT4O.value
+        assert handler._get_cache_key(equip, AIProvider.OPENROUTER) != handler._get_cache_key(
+            dict(equip, models={}), AIProvider.OPENROUTER
+        )
+        # Ollama has no measurements, so it keeps the configured model
+        assert handler._ollama_payload(clarify)["model"] == handler.config.ollama_model.value
+    
+    def test_selection_is_off_by_default(self):
+        """Test that the configured models are used unless selection is enabled"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER))
+        self._measure(handler.model_catalog, AIProvider.OPENROUTER, {OpenRouterModel.GPT4O.value: 0.1})
+        
+        prompt_data = handler._phase_prompt("clarify", "What is your project about?", "An app")
+        
+        assert "models" not in prompt_data
+        assert handler._openrouter_payload(prompt_data)["model"] == OpenRouterModel.CLAUDE_HAIKU.value
+    
+    @pytest.mark.asyncio
+    async def test_calibration_is_persisted(self, tmp_path):
+        """Test that calibration times each candidate and survives a restart"""
+        config = AIConfig(
+            provider=AIProvider.OLLAMA,
+            auto_select_model=True,
+            model_quality_tier=QualityTier.FAST,
+            model_calibration_path=str(tmp_path / "calibration.json")
+        )
+        handler = AIHandler(config)
+        delays = {"llama3": 0.03, "mistral": 0.01, "codellama": 0.02}
+        
+        async def fake_ollama(prompt_data, **kwargs):
+            model = prompt_data["models"]["ollama"]
+            if model not in delays:
+                return False, "Ollama API error (404): model not found"
+            await asyncio.sleep(delays[model])
+            return True, "ready"
+        
+        handler._call_ollama = fake_ollama
+        results = await handler.calibrate_models()
+        
+        assert set(results["ollama"]) == {model.value for model in OllamaModel}
+        assert results["ollama"]["gemma"] is None
+        assert handler.model_catalog.select_model(AIProvider.OLLAMA, QualityTier.FAST, 0.25) == "mistral"
+        
+        restarted = AIHandler(config)
+        prompt_data = restarted._phase_prompt("clarify", "What is your project about?", "An app")
+        assert restarted._ollama_payload(prompt_data)["model"] == "mistral"
+        assert restarted.model_catalog.get(AIProvider.OLLAMA, "gemma").error_rate == 1.0
+    
+    @pytest.mark.asyncio
+    async def test_production_calls_feed_selection(self, tmp_path):
+        """Test that a failing selected model is dropped in favour of the next fastest"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA,
+            auto_select_model=True,
+            max_retries=1,
+            model_calibration_path=str(tmp_path / "calibration.json")
+        ))
+        self._measure(handler.model_catalog, AIProvider.OLLAMA, {"mistral": 0.1, "llama3": 0.5})
+        handler._call_ollama = AsyncMock(return_value=(False, "Ollama API error (500): model crashed"))
+        
+        for answer in ("An app", "A mobile app"):
+            await handler.get_ai_guidance("clarify", "What is your project about?", answer)
+        
+        assert handler._call_ollama.call_args[0][0]["models"] == {"ollama": "mistral"}
+        assert handler.get_provider_status()["model_selection"]["selected"]["ollama"] == "llama3"
+
+
+class TestDeadlines:
+    """Test deadline budgets, retry classification and Retry-After"""
+    
+    @pytest.mark.asyncio
+    async def test_retry_after_replaces_backoff(self):
+        """Test that a Retry-After hint is used instead of exponential backoff"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, retry_delay=30.0))
+        handler._call_ollama = AsyncMock(side_effect=[
+            ProviderError("Ollama API error (429): busy", status=429, retry_after=0.01),
+            (True, "Guidance"),
+        ])
+        
+        success, response, _ = await asyncio.wait_for(
+            handler.get_ai_guidance("clarify", "Test question"), timeout=1
+        )
+        
+        assert success
+        assert response == "Guidance"
+        assert handler._call_ollama.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_retries_that_cannot_finish_in_time_are_skipped(self):
+        """Test that no retry starts when its backoff would outlast the deadline"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, retry_delay=5.0))
+        handler._call_ollama = AsyncMock(side_effect=ProviderError("Ollama API error (503): loading", status=503))
+        
+        success, response, _ = await asyncio.wait_for(
+            handler.get_ai_guidance("clarify", "Test question", deadline=1.0), timeout=1
+        )
+        
+        assert not success
+        assert "no time left to retry" in response
+        assert handler._call_ollama.call_count == 1
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_fatal_status_is_not_retried(self, mock_post):
+        """Test that a non-retryable status fails on the first attempt"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        mock_post.return_value.__aenter__.return_value = AsyncMock(
+            status=401, text=AsyncMock(return_value="Unauthorized"), headers={}
+        )
+        
+        async with handler:
+            success, response, _ = await handler.get_ai_guidance("clarify", "Test question")
+        
+        assert not success
+        assert "OpenRouter API error (401)" in response
+        assert mock_post.call_count == 1
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_retryable_status_raises_with_retry_after(self, mock_post):
+        """Test that 429 and 5xx responses surface as ProviderError"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        mock_post.return_value.__aenter__.return_value = AsyncMock(
+            status=429, text=AsyncMock(return_value="Slow down"), headers={"Retry-After": "7"}
+        )
+        
+        async with handler:
+            with pytest.raises(ProviderError) as excinfo:
+                await handler._call_openrouter({"system": "System", "user": "User"})
+        
+        assert excinfo.value.status == 429
+        assert excinfo.value.retry_after == 7.0
+    
+    def test_parse_retry_after_http_date(self):
+        """Test Retry-After given as an HTTP date"""
+        assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+        assert _parse_retry_after("soon") is None
+        assert _parse_retry_after(None) is None
+    
+    def test_attempt_timeouts_come_out_of_remaining_budget(self):
+        """Test that connect, first-byte and total timeouts are capped by the deadline"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, timeout=30.0, connect_timeout=5.0))
+        
+        timeout = handler._request_timeout(RequestContext(deadline=time.monotonic() + 2.0))
+        
+        assert timeout.total <= 2.0
+        assert timeout.sock_connect <= 2.0
+        assert timeout.sock_read <= 2.0
+        assert handler._request_timeout().total == 30.0
+    
+    @pytest.mark.asyncio
+    async def test_caller_stops_waiting_at_its_deadline(self):
+        """Test that get_ai_guidance returns once its own deadline passes"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        
+        async def hanging_call(prompt_data, **kwargs):
+            await asyncio.sleep(60)
+        
+        handler._call_ollama = hanging_call
+        
+        success, response, _ = await asyncio.wait_for(
+            handler.get_ai_guidance("clarify", "Test question", deadline=0.05), timeout=1
+        )
+        
+        assert not success
+        assert "timed out" in response
+        await asyncio.sleep(0)
+        assert handler._inflight == {}
+
+
+class TestCircuitBreaker:
+    """Test per-provider circuit breaking"""
+    
+    def test_breaker_opens_at_failure_rate(self):
+        """Test that the breaker opens once enough calls fail"""
+        breaker = CircuitBreaker(failure_rate_threshold=0.5, minimum_calls=4)
+        
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+        
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        assert not breaker.allow_request()
+    
+    def test_slow_calls_count_as_failures(self):
+        """Test that successes over the latency threshold count against the provider"""
+        breaker = CircuitBreaker(slow_call_seconds=1.0, minimum_calls=2)
+        
+        breaker.record_success(latency=5.0)
+        breaker.record_success(latency=5.0)
+        
+        assert breaker.state == CircuitState.OPEN
+    
+    def test_half_open_allows_single_trial(self):
+        """Test that one trial call decides whether the breaker closes"""
+        breaker = CircuitBreaker(open_seconds=0.0)
+        breaker.trip()
+        
+        assert breaker.allow_request()
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert not breaker.allow_request()
+        
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+    
+    def test_failed_trial_reopens(self):
+        """Test that a failed half-open trial opens the breaker again"""
+        breaker = CircuitBreaker(open_seconds=0.0)
+        breaker.trip()
+        breaker.allow_request()
+        
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+    
+    @pytest.mark.asyncio
+    async def test_open_provider_skips_straight_to_fallback(self):
+        """Test that requests bypass a provider whose breaker is open"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            fallback_provider=AIProvider.OLLAMA,
+            openrouter_api_key="test-key"
+        ))
+        handler.circuit_breakers[AIProvider.OPENROUTER].trip()
+        handler._call_openrouter = AsyncMock(return_value=(True, "Remote response"))
+        handler._call_ollama = AsyncMock(return_value=(True, "Local response"))
+        
+        success, response, _ = await handler.get_ai_guidance("clarify", "Test question", "Test answer")
+        
+        assert response == "Local response"
+        handler._call_openrouter.assert_not_called()
+        assert handler.rate_limiters[AIProvider.OPENROUTER].remaining() == 20
+        
+        status = handler.get_provider_status()["circuit_breakers"]
+        assert status["openrouter"]["state"] == "open"
+        assert status["ollama"]["state"] == "closed"
+    
+    @pytest.mark.asyncio
+    async def test_rejected_trial_returns_rate_limit_slot(self):
+        """Test that a request the breaker turns away after queueing does not use up the rate limit"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            fallback_provider=AIProvider.OLLAMA,
+            openrouter_api_key="test-key"
+        ))
+        # Half-open with the trial already taken by another request
+        handler.circuit_breakers[AIProvider.OPENROUTER].allow_request = MagicMock(return_value=False)
+        handler._call_openrouter = AsyncMock(return_value=(True, "Remote response"))
+        handler._call_ollama = AsyncMock(return_value=(True, "Local response"))
+        
+        async def stream_ollama(prompt_data):
+            yield "Local stream"
+        
+        handler._stream_ollama = stream_ollama
+        
+        success, response, _ = await handler.get_ai_guidance("clarify", "Test question", "Test answer")
+        chunks = [chunk async for chunk in handler.get_ai_guidance_stream("clarify", "Other question", "Answer")]
+        
+        assert response == "Local response"
+        assert chunks == ["Local stream"]
+        handler._call_openrouter.assert_not_called()
+        assert handler.rate_limiters[AIProvider.OPENROUTER].remaining() == 20
+    
+    @pytest.mark.asyncio
+    async def test_breaker_stops_retries_and_probes_recovery(self):
+        """Test that a tripping breaker ends retries and a background probe closes it"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA,
+            circuit_min_calls=2,
+            circuit_open_seconds=0.2,
+            max_retries=5,
+            retry_delay=0.001
+        ))
+        handler._call_ollama = AsyncMock(side_effect=aiohttp.ClientError("down"))
+        handler._check_provider_health = AsyncMock(return_value=True)
+        
+        async with handler:
+            success, response, _ = await handler.get_ai_guidance("clarify", "Test question", "Test answer")
+            assert not success
+            assert "circuit open" in response
+            assert handler._call_ollama.call_count == 2
+            
+            await asyncio.wait_for(handler._probe_tasks[AIProvider.OLLAMA], timeout=1)
+        
+        assert handler.circuit_breakers[AIProvider.OLLAMA].state == CircuitState.CLOSED
+
+
+class TestHedgedRequests:
+    """Test hedging a slow primary provider with the fallback"""
+    
+    @pytest.fixture
+    def hedging_handler(self):
+        """Create AI handler with hedging enabled and a short hedge delay"""
+        return AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            fallback_provider=AIProvider.OLLAMA,
+            openrouter_api_key="test-key",
+            enable_hedging=True,
+            hedge_delay=0.01
+        ))
+    
+    @pytest.mark.asyncio
+    async def test_fallback_wins_when_primary_is_slow(self, hedging_handler):
+        """Test that the hedge answers and the slow primary is cancelled"""
+        primary_cancelled = asyncio.Event()
+        
+        async def slow_openrouter(prompt_data, **kwargs):
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                primary_cancelled.set()
+                raise
+            return True, "Remote response"
+        
+        hedging_handler._call_openrouter = slow_openrouter
+        hedging_handler._call_ollama = AsyncMock(return_value=(True, "Local response"))
+        
+        success, response, conversation = await hedging_handler.get_ai_guidance(
+            "clarify", "Test question", "Test answer"
+        )
+        
+        assert success
+        assert response == "Local response"
+        assert conversation.messages[1].model == "ollama"
+        assert primary_cancelled.is_set()
+        assert hedging_handler.hedge_stats == {"launched": 1, "won": 1}
+    
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self, hedging_handler):
+        """Test that no hedge is sent when the primary answers in time"""
+        hedging_handler._call_openrouter = AsyncMock(return_value=(True, "Remote response"))
+        hedging_handler._call_ollama = AsyncMock(return_value=(True, "Local response"))
+        
+        success, response, _ = await hedging_handler.get_ai_guidance(
+            "clarify", "Test question", "Test answer"
+        )
+        
+        assert response == "Remote response"
+        hedging_handler._call_ollama.assert_not_called()
+        assert hedging_handler.hedge_stats["launched"] == 0
+    
+    def test_hedge_delay_tracks_observed_tail_latency(self, hedging_handler):
+        """Test that the hedge delay switches to the p95 once samples exist"""
+        stats = hedging_handler.provider_stats[AIProvider.OPENROUTER]
+        assert hedging_handler._hedge_delay(AIProvider.OPENROUTER) == 0.01
+        
+        for latency in range(1, 101):
+            stats.record(True, latency=latency / 100)
+        
+        assert hedging_handler._hedge_delay(AIProvider.OPENROUTER) == pytest.approx(0.96)
+
+
+class TestRequestScheduler:
+    """Test priority-aware scheduling of provider calls"""
+    
+    async def _run(self, scheduler, priority, name, order, release, owner=None):
+        async with scheduler.slot(priority, owner):
+            order.append(name)
+            await release.wait()
+    
+    @pytest.mark.asyncio
+    async def test_interactive_requests_jump_the_queue(self):
+        """Test that queued interactive work starts before queued background work"""
+        scheduler = RequestScheduler(max_concurrency=1, interactive_reserve=0)
+        order = []
+        gate = asyncio.Event()
+        
+        holder = asyncio.ensure_future(self._run(scheduler, RequestPriority.BATCH, "holder", order, gate))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.ensure_future(self._run(scheduler, RequestPriority.BACKGROUND, "bg1", order, asyncio.Event())),
+            asyncio.ensure_future(self._run(scheduler, RequestPriority.BACKGROUND, "bg2", order, asyncio.Event())),
+            asyncio.ensure_future(self._run(scheduler, RequestPriority.INTERACTIVE, "user", order, asyncio.Event())),
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.metrics()["classes"]["background"]["queued"] == 2
+        
+        gate.set()
+        await holder
+        await asyncio.sleep(0)
+        assert order == ["holder", "user"]
+        
+        for task in waiters:
+            task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert scheduler.active == 0
+    
+    @pytest.mark.asyncio
+    async def test_fifo_within_class(self):
+        """Test that requests of the same class start in arrival order"""
+        scheduler = RequestScheduler(max_concurrency=1, interactive_reserve=0)
+        order = []
+        release = asyncio.Event()
+        release.set()
+        
+        await asyncio.gather(*[
+            self._run(scheduler, RequestPriority.BATCH, f"b{i}", order, release) for i in range(4)
+        ])
+        
+        assert order == ["b0", "b1", "b2", "b3"]
+        assert scheduler.metrics()["classes"]["batch"]["wait_avg"] is not None
+    
+    @pytest.mark.asyncio
+    async def test_reserved_slot_stays_free_for_interactive(self):
+        """Test that background work cannot take the interactive reserve"""
+        scheduler = RequestScheduler(max_concurrency=2, interactive_reserve=1)
+        order = []
+        gate = asyncio.Event()
+        
+        tasks = [
+            asyncio.ensure_future(self._run(scheduler, RequestPriority.BACKGROUND, f"bg{i}", order, gate))
+            for i in range(2)
+        ]
+        await asyncio.sleep(0)
+        assert order == ["bg0"]
+        
+        user = asyncio.ensure_future(self._run(scheduler, RequestPriority.INTERACTIVE, "user", order, gate))
+        await asyncio.sleep(0)
+        assert order == ["bg0", "user"]
+        
+        gate.set()
+        await asyncio.gather(user, *tasks)
+    
+    @pytest.mark.asyncio
+    async def test_reprioritize_promotes_waiting_request(self):
+        """Test that a waiting background request can be promoted"""
+        scheduler = RequestScheduler(max_concurrency=1, interactive_reserve=0)
+        order = []
+        gate = asyncio.Event()
+        owner = object()
+        
+        holder = asyncio.ensure_future(self._run(scheduler, RequestPriority.INTERACTIVE, "holder", order, gate))
+        await asyncio.sleep(0)
+        batch = asyncio.ensure_future(self._run(scheduler, RequestPriority.BATCH, "batch", order, gate))
+        prefetch = asyncio.ensure_future(self._run(scheduler, RequestPriority.BACKGROUND, "prefetch", order, gate, owner))
+        await asyncio.sleep(0)
+        
+        scheduler.reprioritize(owner, RequestPriority.INTERACTIVE)
+        gate.set()
+        await asyncio.gather(holder, batch, prefetch)
+        
+        assert order == ["holder", "prefetch", "batch"]
+    
+    @pytest.mark.asyncio
+    async def test_handler_schedules_batch_work_as_batch(self):
+        """Test that batch guidance is admitted under the batch class"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(return_value=(True, "Guidance"))
+        
+        await handler.get_ai_guidance_batch([("clarify", "Q1", ""), ("clarify", "Q2", "")])
+        
+        metrics = handler.get_provider_status()["schedulers"]["ollama"]
+        assert metrics["classes"]["batch"]["wait_avg"] is not None
+        assert metrics["classes"]["interactive"]["wait_avg"] is None
+
+
+    @pytest.mark.asyncio
+    async def test_interactive_request_overtakes_batch_waiting_on_rate_limit(self):
+        """Test that an exhausted rate budget still serves an interactive call first"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, enable_cache=False))
+        handler.rate_limiters[AIProvider.OLLAMA] = RateLimiter(max_requests=2, window_seconds=0.1)
+        served = []
+        
+        async def fake_ollama(prompt_data, **kwargs):
+            served.append(prompt_data["user"])
+            return True, "Guidance"
+        
+        handler._call_ollama = fake_ollama
+        batch = [
+            asyncio.ensure_future(handler.get_ai_guidance("clarify", f"Batch {i}", "", priority=RequestPriority.BATCH))
+            for i in range(8)
+        ]
+        await asyncio.sleep(0.05)
+        await handler.get_ai_guidance("clarify", "Interactive", "")
+        
+        assert "Interactive" in served[2]
+        await asyncio.gather(*batch)
+
+
+class TestAdaptiveConcurrency:
+    """Test AIMD concurrency limits fed by provider responses"""
+    
+    def test_limit_grows_only_while_saturated(self):
+        """Test additive increase of about one per round of full-limit calls"""
+        adaptive = AdaptiveLimit(2.0, max_limit=4)
+        
+        for _ in range(10):
+            adaptive.on_success(1.0, in_flight=1)
+        assert adaptive.current == 2
+        
+        for _ in range(4):
+            adaptive.on_success(1.0, in_flight=adaptive.current)
+        assert adaptive.current == 3
+        
+        for _ in range(50):
+            adaptive.on_success(1.0, in_flight=adaptive.current)
+        assert adaptive.current == 4
+    
+    def test_limit_never_exceeds_pool_connections_per_host(self):
+        """Test that the adaptive maximum is capped by the shared connector's per-host limit"""
+        handler = AIHandler(AIConfig(adaptive_concurrency=True, adaptive_max_concurrency=32, pool_limit_per_host=10))
+        assert handler.adaptive_limits[AIProvider.OPENROUTER].max_limit == 10
+        assert handler.adaptive_limits[AIProvider.OLLAMA].max_limit == 8
+        
+        own_session = AIHandler(AIConfig(adaptive_concurrency=True, use_shared_pool=False))
+        assert own_session.adaptive_limits[AIProvider.OPENROUTER].max_limit == 32
+    
+    def test_overload_halves_limit_once_per_cooldown(self):
+        """Test multiplicative decrease that ignores the rest of a failure burst"""
+        adaptive = AdaptiveLimit(8.0, cooldown=60.0)
+        
+        assert adaptive.on_overload() == 4
+        assert adaptive.on_overload() == 4
+        assert adaptive.decreases == 1
+    
+    def test_rising_latency_backs_off(self):
+        """Test that latency climbing well above its long-term level cuts the limit"""
+        adaptive = AdaptiveLimit(8.0)
+        for _ in range(20):
+            adaptive.on_success(1.0, in_flight=1)
+        
+        for _ in range(5):
+            adaptive.on_success(5.0, in_flight=8)
+        
+        assert adaptive.current == 4
+    
+    @pytest.mark.asyncio
+    async def test_throttled_provider_gets_lower_concurrency(self):
+        """Test that a 429 shrinks the provider's scheduler limit but not the other's"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA, adaptive_concurrency=True, ollama_max_concurrent_requests=4,
+            retry_delay=0.001
+        ))
+        handler._call_ollama = AsyncMock(side_effect=[
+            ProviderError("Ollama API error (429): busy", status=429),
+            (True, "Guidance"),
+        ])
+        
+        success, _, _ = await handler.get_ai_guidance("clarify", "Test question")
+        
+        assert success
+        assert handler.schedulers[AIProvider.OLLAMA].max_concurrency == 2
+        assert handler.schedulers[AIProvider.OPENROUTER].max_concurrency == 8
+        status = handler.get_provider_status()["adaptive_concurrency"]
+        assert status["ollama"]["limit"] == 2
+        assert status["ollama"]["decreases"] == 1
+    
+    def test_disabled_by_default(self):
+        """Test that static limits apply unless adaptive mode is enabled"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        
+        assert handler.adaptive_limits == {}
+        assert handler.get_provider_status()["adaptive_concurrency"] == {}
+
+
+class TestConversations:
+    """Test multi-turn conversations and context budgeting"""
+    
+    @pytest.mark.asyncio
+    async def test_follow_up_sends_earlier_turns(self):
+        """Test that a follow-up carries the previous exchange"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(side_effect=[(True, "First reply"), (True, "Second reply")])
+        
+        await handler.get_ai_guidance("clarify", "Test question", "Test answer", conversation_id="C-01")
+        success, response, conversation = await handler.ask_follow_up("C-01", "What should I cut?")
+        
+        assert success
+        assert response == "Second reply"
+        prompt_data = handler._call_ollama.call_args.args[0]
+        assert [turn["role"] for turn in prompt_data["history"]] == ["user", "assistant"]
+        assert prompt_data["history"][1]["content"] == "First reply"
+        assert prompt_data["user"] == "What should I cut?"
+        assert conversation is handler.conversations["C-01"]
+        assert len(conversation.messages) == 4
+    
+    def test_payloads_place_history_between_system_and_user(self):
+        """Test that both providers see earlier turns in order"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, enable_prompt_caching=False))
+        prompt_data = {
+            "system": "System",
+            "user": "Now",
+            "history": [{"role": "user", "content": "Before"}, {"role": "assistant", "content": "Reply"}],
+        }
+        
+        for payload in (handler._openrouter_payload(prompt_data), handler._ollama_payload(prompt_data)):
+            messages = payload["messages"]
+            assert [message["content"] for message in messages] == ["System", "Before", "Reply", "Now"]
+    
+    @pytest.mark.asyncio
+    async def test_long_conversation_is_folded_into_summary(self):
+        """Test that turns beyond the token budget are summarized"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA, conversation_token_budget=200, conversation_keep_turns=1
+        ))
+        long_reply = "detail " * 100
+        handler._call_ollama = AsyncMock(side_effect=[
+            (True, long_reply), (True, long_reply), (True, "Condensed summary"), (True, "Third reply")
+        ])
+        
+        await handler.get_ai_guidance("clarify", "Test question", conversation_id="C-01")
+        await handler.ask_follow_up("C-01", "Second question")
+        success, _, conversation = await handler.ask_follow_up("C-01", "Third question")
+        
+        assert success
+        assert conversation.messages[0].role == "system"
+        assert "Condensed summary" in conversation.messages[0].content
+        assert [message.content for message in conversation.messages[1:]] == [
+            "Second question", long_reply, "Third question", "Third reply"
+        ]
+        assert handler._call_ollama.call_args.args[0]["history"][0]["role"] == "system"
+    
+    @pytest.mark.asyncio
+    async def test_fold_falls_back_to_transcript_when_summary_fails(self):
+        """Test that folding still bounds the prompt if the summary call fails"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA, conversation_token_budget=100, conversation_keep_turns=0
+        ))
+        handler._call_ollama = AsyncMock(side_effect=[
+            (True, "word " * 200), (False, "Ollama API error (400): bad"), (True, "Reply")
+        ])
+        
+        await handler.get_ai_guidance("clarify", "Test question", conversation_id="C-01")
+        success, _, conversation = await handler.ask_follow_up("C-01", "More?")
+        
+        assert success
+        summary = conversation.messages[0].content
+        assert conversation.messages[0].role == "system"
+        assert len(summary) < 200
+    
+    @pytest.mark.asyncio
+    async def test_unknown_conversation(self):
+        """Test that a follow-up needs an existing conversation"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        
+        success, response, conversation = await handler.ask_follow_up("missing", "Hello?")
+        
+        assert not success
+        assert "Unknown conversation" in response
+        assert conversation is None
+    
+    @pytest.mark.asyncio
+    async def test_conversations_without_id_are_not_stored(self):
+        """Test that one-off guidance does not accumulate state"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(return_value=(True, "Guidance"))
+        
+        _, _, conversation = await handler.get_ai_guidance("clarify", "Test question")
+        
+        assert conversation is not None
+        assert handler.conversations == {}
+
+
+class TestPrefetch:
+    """Test speculative prefetch of guidance"""
+    
+    @pytest.mark.asyncio
+    async def test_prefetched_guidance_is_served_from_cache(self):
+        """Test that asking after a prefetch does not call the provider again"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        handler._call_ollama = AsyncMock(return_value=(True, "Prefetched guidance"))
+        
+        assert await handler.prefetch_guidance("clarify", "Next question")
+        success, response, _ = await handler.get_ai_guidance("clarify", "Next question")
+        
+        assert success
+        assert response == "Prefetched guidance"
+        assert handler._call_ollama.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_prefetch_leaves_reserved_budget_for_interactive_requests(self):
+        """Test that prefetch does nothing when the rate limit is nearly used up"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA,
+            ollama_max_requests_per_minute=6,
+            prefetch_reserve=5
+        ))
+        handler._call_ollama = AsyncMock(return_value=(True, "Guidance"))
+        handler.rate_limiters[AIProvider.OLLAMA].record_request()
+        
+        assert not await handler.prefetch_guidance("clarify", "Next question")
+        handler._call_ollama.assert_not_called()
+        
+        success, _, _ = await handler.get_ai_guidance("clarify", "Next question")
+        assert success
+
+
+class TestConnectionPool:
+    """Test the shared HTTP connection pool"""
+    
+    @pytest.mark.asyncio
+    async def test_handlers_borrow_one_pooled_session(self):
+        """Test that handlers reuse one session and leave it open on exit"""
+        config = AIConfig(provider=AIProvider.OLLAMA, pool_limit_per_host=4)
+        
+        async with AIHandler(config) as first:
+            first_session = first.session
+        async with AIHandler(config) as second:
+            assert second.session is first_session
+        
+        assert not first_session.closed
+        assert first_session.connector.limit_per_host == 4
+        assert first_session.connector.use_dns_cache
+        
+        await close_shared_session()
+        assert first_session.closed
+        
+        replacement = get_shared_session(config)
+        assert replacement is not first_session
+        await close_shared_session()
+    
+    @pytest.mark.asyncio
+    async def test_handler_borrows_pool_without_context_manager(self):
+        """Test that a bare handler lazily borrows the pooled session"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        
+        assert handler._http() is get_shared_session(handler.config)
+        await close_shared_session()
+    
+    @pytest.mark.asyncio
+    async def test_private_session_is_closed_on_exit(self):
+        """Test that a handler opting out of the pool owns and closes its session"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, use_shared_pool=False))
+        
+        async with handler:
+            session = handler.session
+            assert session is not get_shared_session(handler.config)
+        
+        assert session.closed
+        await close_shared_session()
+
+
+class TestRequestCoalescing:
+    """Test single-flight sharing of identical in-flight requests"""
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_identical_requests_share_one_call(self, mock_post):
+        """Test that concurrent identical requests send one HTTP request"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        
+        mock_response = AsyncMock(status=200)
+        mock_response.json.return_value = {"choices": [{"message": {"content": "Shared response"}}]}
+        
+        async def slow_enter(*args):
+            await asyncio.sleep(0.01)
+            return mock_response
+        
+        mock_post.return_value.__aenter__.side_effect = slow_enter
+        
+        async with handler:
+            results = await asyncio.gather(*[
+                handler.get_ai_guidance("clarify", "Test question", "Test answer", conversation_id=f"c{i}")
+                for i in range(3)
+            ])
+        
+        assert mock_post.call_count == 1
+        assert [response for _, response, _ in results] == ["Shared response"] * 3
+        assert [conversation.id for _, _, conversation in results] == ["c0", "c1", "c2"]
+        assert handler._inflight == {}
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_cancelled_caller_does_not_cancel_shared_request(self, mock_post):
+        """Test that other waiters still get the result when one caller gives up"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+        
+        mock_response = AsyncMock(status=200)
+        mock_response.json.return_value = {"choices": [{"message": {"content": "Shared response"}}]}
+        
+        async def slow_enter(*args):
+            await asyncio.sleep(0.05)
+            return mock_response
+        
+        mock_post.return_value.__aenter__.side_effect = slow_enter
+        
+        async with handler:
+            first = asyncio.ensure_future(handler.get_ai_guidance("clarify", "Test question", "Test answer"))
+            second = asyncio.ensure_future(handler.get_ai_guidance("clarify", "Test question", "Test answer"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            success, response, _ = await second
+        
+        assert success
+        assert response == "Shared response"
+        assert mock_post.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_last_caller_cancelling_aborts_request(self):
+        """Test that the provider call is cancelled once no caller is waiting"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA))
+        aborted = asyncio.Event()
+        
+        async def hanging_call(prompt_data, **kwargs):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                aborted.set()
+                raise
+        
+        handler._call_ollama = hanging_call
+        
+        caller = asyncio.ensure_future(handler.get_ai_guidance("clarify", "Test question"))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.wait_for(aborted.wait(), timeout=1)
+        
+        assert caller.cancelled()
+        assert handler._inflight == {}
+    
+    @pytest.mark.asyncio
+    async def test_cancel_stops_pending_retries(self):
+        """Test that cancelling during backoff sends no further attempts"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, retry_delay=30.0))
+        handler._call_ollama = AsyncMock(side_effect=RuntimeError("boom"))
+        
+        caller = asyncio.ensure_future(handler.get_ai_guidance("clarify", "Test question"))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.01)
+        
+        assert caller.cancelled()
+        assert handler._call_ollama.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_queued_request_releases_rate_limit(self):
+        """Test that a request cancelled before it was sent gives its slot back"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, ollama_max_requests_per_minute=5))
+        scheduler = handler.schedulers[AIProvider.OLLAMA]
+        scheduler.set_limit(1)
+        release = asyncio.Event()
+        
+        async def hold_slot():
+            async with scheduler.slot(RequestPriority.INTERACTIVE):
+                await release.wait()
+        
+        holder = asyncio.ensure_future(hold_slot())
+        await asyncio.sleep(0)
+        caller = asyncio.ensure_future(handler.get_ai_guidance("clarify", "Test question"))
+        await asyncio.sleep(0.01)
+        assert handler.rate_limiters[AIProvider.OLLAMA].remaining() == 4
+        
+        caller.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        await holder
+        
+        assert handler.rate_limiters[AIProvider.OLLAMA].remaining() == 5
+        assert scheduler.active == 0
+
+
+class TestBatchGuidance:
+    """Test concurrent batch guidance"""
+    
+    @pytest.fixture
+    def ai_handler(self):
+        """Create AI handler with OpenRouter configured"""
+        return AIHandler(AIConfig(provider=AIProvider.OPENROUTER, openrouter_api_key="test-key"))
+    
+    @pytest.mark.asyncio
+    async def test_batch_returns_results_in_input_order(self, ai_handler):
+        """Test that results line up with items even when they finish out of order"""
+        async def fake_guidance(phase, question_text, current_answer, **kwargs):
+            await asyncio.sleep(0.03 if question_text == "Q1" else 0.0)
+            return True, f"Guidance for {question_text}", None
+        
+        ai_handler.get_ai_guidance = fake_guidance
+        items = [("clarify", f"Q{i}", "") for i in range(1, 4)]
+        
+        completion_order = [index async for index, _ in ai_handler.iter_ai_guidance_batch(items)]
+        results = await ai_handler.get_ai_guidance_batch(items)
+        
+        assert completion_order[-1] == 0
+        assert [response for _, response, _ in results] == [
+            "Guidance for Q1", "Guidance for Q2", "Guidance for Q3"
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_batch_reports_per_item_errors(self, ai_handler):
+        """Test that one failing item does not fail the whole batch"""
+        async def fake_guidance(phase, question_text, current_answer, **kwargs):
+            if question_text == "Q2":
+                raise RuntimeError("boom")
+            return True, "ok", None
+        
+        ai_handler.get_ai_guidance = fake_guidance
+        results = await ai_handler.get_ai_guidance_batch(
+            [("clarify", "Q1", ""), ("clarify", "Q2", ""), ("clarify", "Q3", "")]
+        )
+        
+        assert [success for success, _, _ in results] == [True, False, True]
+        assert "boom" in results[1][1]
+    
+    @pytest.mark.asyncio
+    async def test_batch_respects_max_concurrency(self, ai_handler):
+        """Test that no more than max_concurrency requests run at once"""
+        running = 0
+        peak = 0
+        
+        async def fake_guidance(phase, question_text, current_answer, **kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return True, "ok", None
+        
+        ai_handler.get_ai_guidance = fake_guidance
+        await ai_handler.get_ai_guidance_batch(
+            [("clarify", f"Q{i}", "") for i in range(8)], max_concurrency=3
+        )
+        
+        assert peak == 3
+
+
+class TestPackedBatch:
+    """Test packing several same-phase questions into one provider call"""
+    
+    @pytest.fixture
+    def ai_handler(self):
+        """Create AI handler with Ollama configured"""
+        return AIHandler(AIConfig(provider=AIProvider.OLLAMA, batch_pack_size=5))
+    
+    @pytest.mark.asyncio
+    async def test_same_phase_questions_share_one_call(self, ai_handler):
+        """Test that one packed reply is split into per-question results and cache entries"""
+        ai_handler._call_ollama = AsyncMock(return_value=(True, '{"1": "Guidance one", "2": "Guidance two", "3": "Guidance three"}'))
+        items = [("clarify", f"Q{i}", "Answer") for i in range(1, 4)]
+        
+        results = await ai_handler.get_ai_guidance_batch(items, packed=True)
+        
+        assert ai_handler._call_ollama.call_count == 1
+        assert [response for _, response, _ in results] == ["Guidance one", "Guidance two", "Guidance three"]
+        assert results[1][2].messages[0].content.endswith("Current answer: Answer")
+        prompt_data = ai_handler._call_ollama.call_args.args[0]
+        assert prompt_data["user"].count("### Question") == 3
+        assert prompt_data["max_tokens"] == 3 * ai_handler.config.max_tokens
+        
+        success, response, _ = await ai_handler.get_ai_guidance("clarify", "Q2", "Answer")
+        assert success and response == "Guidance two"
+        assert ai_handler._call_ollama.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_packs_split_by_phase_and_size(self, ai_handler):
+        """Test that packs never mix phases or exceed batch_pack_size"""
+        async def fake_call(prompt_data, **kwargs):
+            count = prompt_data["user"].count("### Question")
+            return True, json.dumps({str(n): f"Answer {n}" for n in range(1, count + 1)})
+        
+        ai_handler._call_ollama = AsyncMock(side_effect=fake_call)
+        items = [("clarify", f"C{i}", "") for i in range(7)] + [("refine", "R1", ""), ("refine", "R2", "")]
+        
+        results = await ai_handler.get_ai_guidance_batch(items, packed=True)
+        
+        assert all(success for success, _, _ in results)
+        sizes = sorted(call.args[0]["user"].count("### Question") for call in ai_handler._call_ollama.call_args_list)
+        assert sizes == [2, 2, 5]
+    
+    @pytest.mark.asyncio
+    async def test_unparseable_reply_falls_back_to_single_requests(self, ai_handler):
+        """Test that a malformed packed reply is retried question by question"""
+        ai_handler._call_ollama = AsyncMock(side_effect=[
+            (True, "Sorry, here are some thoughts without JSON"),
+            (True, "Single one"),
+            (True, "Single two"),
+        ])
+        
+        results = await ai_handler.get_ai_guidance_batch(
+            [("clarify", "Q1", ""), ("clarify", "Q2", "")], packed=True, max_concurrency=1
+        )
+        
+        assert sorted(response for _, response, _ in results) == ["Single one", "Single two"]
+        assert ai_handler._call_ollama.call_count == 3
+    
+    @pytest.mark.asyncio
+    async def test_failed_packed_request_falls_back_to_single_requests(self, ai_handler):
+        """Test that a rejected packed request is retried question by question"""
+        ai_handler._call_ollama = AsyncMock(side_effect=[
+            (False, "Ollama API error (400): prompt too long"),
+            (True, "Single one"),
+            (True, "Single two"),
+        ])
+        
+        results = await ai_handler.get_ai_guidance_batch(
+            [("clarify", "Q1", ""), ("clarify", "Q2", "")], packed=True, max_concurrency=1
+        )
+        
+        assert sorted(response for _, response, _ in results) == ["Single one", "Single two"]
+        assert all(success for success, _, _ in results)
+    
+    @pytest.mark.asyncio
+    async def test_packs_fit_the_model_output_limit(self):
+        """Test that packs shrink so their token budget stays under the model's output cap"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            openrouter_api_key="test-key",
+            openrouter_model=OpenRouterModel.CLAUDE_HAIKU,
+            max_tokens=1000,
+            batch_pack_size=5
+        ))
+        
+        async def fake_call(prompt_data, **kwargs):
+            count = prompt_data["user"].count("### Question")
+            return True, json.dumps({str(n): f"Answer {n}" for n in range(1, count + 1)})
+        
+        handler._call_openrouter = AsyncMock(side_effect=fake_call)
+        await handler.get_ai_guidance_batch([("clarify", f"C{i}", "") for i in range(5)], packed=True)
+        
+        budgets = sorted(call.args[0].get("max_tokens", 1000) for call in handler._call_openrouter.call_args_list)
+        assert budgets == [1000, 4000]
+    
+    @pytest.mark.asyncio
+    async def test_cached_items_are_not_packed(self, ai_handler):
+        """Test that items already in the cache are served without a call"""
+        prompt_data = get_phase_prompt("clarify", "Q1", "")
+        ai_handler._cache_response(ai_handler._get_cache_key(prompt_data, AIProvider.OLLAMA), "Cached")
+        ai_handler._call_ollama = AsyncMock(return_value=(True, "Fresh"))
+        
+        results = await ai_handler.get_ai_guidance_batch([("clarify", "Q1", ""), ("clarify", "Q2", "")], packed=True)
+        
+        assert [response for _, response, _ in results] == ["Cached", "Fresh"]
+        assert "### Question" not in ai_handler._call_ollama.call_args.args[0]["user"]
+    
+    @pytest.mark.asyncio
+    async def test_prescreen_and_similarity_apply_before_packing(self):
+        """Test that packed batches answer locally and from similar answers like single requests"""
+        handler = AIHandler(AIConfig(
+            provider=AIProvider.OLLAMA, enable_answer_prescreen=True, enable_semantic_cache=True
+        ))
+        handler._call_ollama = AsyncMock(return_value=(True, "AI guidance"))
+        first, second = QUESTIONS_BY_ID["C-01"], QUESTIONS_BY_ID["C-02"]
+        empty = [("clarify", first.text, ""), ("clarify", second.text, "")]
+        
+        packed = await handler.get_ai_guidance_batch(empty, packed=True)
+        single = await handler.get_ai_guidance_batch(empty)
+        
+        assert [result[:2] for result in packed] == [result[:2] for result in single]
+        assert all(result[2].messages[-1].model == "local" for result in packed)
+        handler._call_ollama.assert_not_called()
+        
+        answer = "Busy university students who lose track of assignments spread across several course portals."
+        prompt_data = handler._phase_prompt("clarify", first.text, answer)
+        handler.semantic_cache.set(
+            handler._semantic_index_key("clarify", first.text, AIProvider.OLLAMA, prompt_data), answer, "Similar guidance"
+        )
+        
+        results = await handler.get_ai_guidance_batch([("clarify", first.text, answer + " ")], packed=True)
+        
+        assert results[0][:2] == (True, "Similar guidance")
+        handler._call_ollama.assert_not_called()
+        assert handler.prescreen_stats == {"answered": 4, "escalated": 1}
+    
+    def test_parse_packed_answers(self):
+        """Test splitting JSON replies, including fenced ones"""
+        assert _parse_packed_answers('```json\n{"1": " a ", "2": "b"}\n```', 2) == ["a", "b"]
+        assert _parse_packed_answers('{"1": "a"}', 2) is None
+        assert _parse_packed_answers('{"1": "a", "2": ""}', 2) is None
+        assert _parse_packed_answers("no json here", 1) is None
+
+
+class MockStreamContent:
+    """Async line iterator standing in for aiohttp's response.content"""
+    
+    def __init__(self, lines):
+        self.lines = lines
+    
+    async def __aiter__(self):
+        for line in self.lines:
+            yield line
+
+
+class TestAIStreaming:
+    """Test token streaming for AI guidance"""
+    
+    @pytest.fixture
+    def ai_handler(self):
+        """Create AI handler with OpenRouter primary and Ollama fallback"""
+        return AIHandler(AIConfig(
+            provider=AIProvider.OPENROUTER,
+            fallback_provider=AIProvider.OLLAMA,
+            openrouter_api_key="test-key",
+            ollama_warmup=False
+        ))
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_openrouter_stream_yields_tokens(self, mock_post, ai_handler):
+        """Test that OpenRouter SSE chunks are yielded as they arrive"""
+        mock_response = AsyncMock()
+        mock_response.status = 200
+        mock_response.content = MockStreamContent([
+            b": OPENROUTER PROCESSING\n",
+            b'data: {"choices": [{"delta": {"content": "Hello"}}]}\n',
+            b"\n",
+            b'data: {"choices": [{"delta": {"content": " world"}}]}\n',
+            b"data: [DONE]\n",
+        ])
+        mock_post.return_value.__aenter__.return_value = mock_response
+        
+        conversations = []
+        async with ai_handler:
+            chunks = [
+                chunk async for chunk in ai_handler.get_ai_guidance_stream(
+                    "clarify", "Test question", "Test answer", on_complete=conversations.append
+                )
+            ]
+        
+        assert chunks == ["Hello", " world"]
+        assert mock_post.call_args.kwargs["json"]["stream"] is True
+        # Long streams are bounded by the gap between chunks, not a total
+        timeout = mock_post.call_args.kwargs["timeout"]
+        assert timeout.total is None
+        assert timeout.sock_read == ai_handler.config.first_byte_timeout
+        assert len(conversations) == 1
+        assert conversations[0].messages[1].content == "Hello world"
+        assert conversations[0].messages[1].model == "openrouter"
+        assert len(ai_handler.cache) == 1
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_ollama_stream_yields_tokens(self, mock_post):
+        """Test that Ollama NDJSON chunks are yielded as they arrive"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, ollama_warmup=False))
+        
+        mock_response = AsyncMock()
+        mock_response.status = 200
+        mock_response.content = MockStreamContent([
+            b'{"message": {"role": "assistant", "content": "Think"}, "done": false}\n',
+            b'{"message": {"role": "assistant", "content": " deeper"}, "done": false}\n',
+            b'{"message": {"role": "assistant", "content": ""}, "done": true}\n',
+        ])
+        mock_post.return_value.__aenter__.return_value = mock_response
+        
+        async with handler:
+            chunks = [
+                chunk async for chunk in handler.get_ai_guidance_stream(
+                    "clarify", "Test question", "Test answer"
+                )
+            ]
+        
+        assert chunks == ["Think", " deeper"]
+        assert mock_post.call_args.kwargs["json"]["stream"] is True
+    
+    @pytest.mark.asyncio
+    @patch('aiohttp.ClientSession.post')
+    async def test_stream_falls_back_before_first_token(self, mock_post, ai_handler):
+        """Test that the fallback provider streams when the primary fails up front"""
+        fallback_response = AsyncMock(status=200)
+        fallback_response.content = MockStreamContent([b'{"message": {"role": "assistant", "content": "Fallback"}, "done": true}\n'])
+        mock_post.return_value.__aenter__.side_effect = [
+            AsyncMock(status=500, text=AsyncMock(return_value="Server error")),
+            fallback_response,
+        ]
+        
+        conversations = []
+        async with ai_handler:
+            chunks = [
+                chunk async for chunk in ai_handler.get_ai_guidance_stream(
+                    "clarify", "Test question", "Test answer", on_complete=conversations.append
+                )
+            ]
+        
+        assert chunks == ["Fallback"]
+        assert conversations[0].messages[1].model == "ollama"
+    
+    @pytest.mark.parametrize("keep_partial", [False, True])
+    @pytest.mark.asyncio
+    async def test_abandoned_stream_partial_output_caching(self, keep_partial):
+        """Test that a stream stopped midway is cached only when configured"""
+        handler = AIHandler(AIConfig(provider=AIProvider.OLLAMA, cache_partial_streams=keep_partial))
+        
+        async def slow_stream(provider, prompt_data):
+            yield "Partial"
+            await asyncio.sleep(60)
+            yield " never sent"
+        
+        handler._stream_provider = slow_stream
+        
+        stream = handler.get_ai_guidance_stream("clarify", "Test question")
+        assert await stream.__anext__() == "Partial"
+        await stream.aclose()
+        
+        assert len(handler.cache) == (1 if keep_partial else 0)
+        assert handler.schedulers[AIProvider.OLLAMA].active == 0
+    
+    @pytest.mark.asyncio
+    async def test_stream_disabled_raises(self):
+        """Test that streaming with no provider raises a stream error"""
+        handler = AIHandler(AIConfig(provider=AIProvider.DISABLED))
+        
+        with pytest.raises(AIStreamError, match="not configured"):
+            async for _ in handler.get_ai_guidance_stream("clarify", "Test question"):
+                pass
+
+
 class TestIntegration:
     """Integration tests for AI functionality"""
     